@@ -13,7 +13,11 @@ CREATE TABLE IF NOT EXISTS analytics.events (
     utm_medium String,
     utm_campaign String,
     revenue Float64,
-    properties String
+    properties String,
+    -- Derived on ingest by the attribution service
+    ref_host LowCardinality(String),
+    path String,
+    device LowCardinality(String)
 ) ENGINE = MergeTree()
 ORDER BY (tenant_id, session_id, ts)
 PARTITION BY toYYYYMM(ts)
@@ -31,3 +35,217 @@ AS SELECT
     sum(revenue) as total_revenue
 FROM analytics.events
 GROUP BY tenant_id, event, hour;
+
+-- Daily active-user bitmaps per event for cohort retention.
+-- Visitors without a user_id are identified by their session id.
+CREATE TABLE IF NOT EXISTS analytics.user_activity_daily (
+    tenant_id String,
+    event String,
+    day Date,
+    users AggregateFunction(groupBitmap, UInt64)
+) ENGINE = AggregatingMergeTree()
+PARTITION BY toYYYYMM(day)
+ORDER BY (tenant_id, event, day)
+TTL day + INTERVAL 400 DAY;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS analytics.user_activity_daily_mv
+TO analytics.user_activity_daily
+AS SELECT
+    tenant_id,
+    event,
+    toDate(ts) as day,
+    groupBitmapState(cityHash64(if(user_id = '', session_id, user_id))) as users
+FROM analytics.events
+GROUP BY tenant_id, event, day;
+
+-- Backfill for events written before the view existed:
+-- INSERT INTO analytics.user_activity_daily
+-- SELECT tenant_id, event, toDate(ts) as day,
+--        groupBitmapState(cityHash64(if(user_id = '', session_id, user_id)))
+-- FROM analytics.events
+-- GROUP BY tenant_id, event, day;
+
+-- First day each user was seen, per event, for retention cohorts. One
+-- row per user once merged; a cohort is every user whose first day falls
+-- in the period, taken over all events or over the cohort event.
+CREATE TABLE IF NOT EXISTS analytics.user_first_seen (
+    tenant_id String,
+    event String,
+    user UInt64,
+    first_day AggregateFunction(min, Date)
+) ENGINE = AggregatingMergeTree()
+ORDER BY (tenant_id, event, user);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS analytics.user_first_seen_mv
+TO analytics.user_first_seen
+AS SELECT
+    tenant_id,
+    event,
+    cityHash64(if(user_id = '', session_id, user_id)) as user,
+    minState(toDate(ts)) as first_day
+FROM analytics.events
+GROUP BY tenant_id, event, user;
+
+-- Backfill for events written before the view existed:
+-- INSERT INTO analytics.user_first_seen
+-- SELECT tenant_id, event, cityHash64(if(user_id = '', session_id, user_id)) as user,
+--        minState(toDate(ts))
+-- FROM analytics.events
+-- GROUP BY tenant_id, event, user;
+
+-- Daily per-UTM rollup for dimensional breakdowns
+CREATE TABLE IF NOT EXISTS analytics.events_utm_daily (
+    tenant_id String,
+    day Date,
+    utm_source String,
+    utm_medium String,
+    utm_campaign String,
+    pageviews UInt64,
+    clicks UInt64,
+    conversions UInt64,
+    revenue Float64
+) ENGINE = SummingMergeTree()
+PARTITION BY toYYYYMM(day)
+ORDER BY (tenant_id, day, utm_source, utm_medium, utm_campaign)
+TTL day + INTERVAL 400 DAY;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS analytics.events_utm_daily_mv
+TO analytics.events_utm_daily
+AS SELECT
+    tenant_id,
+    toDate(ts) as day,
+    utm_source,
+    utm_medium,
+    utm_campaign,
+    countIf(event = 'pageview') as pageviews,
+    countIf(event = 'click') as clicks,
+    countIf(event = 'conversion') as conversions,
+    sum(revenue) as revenue
+FROM analytics.events
+GROUP BY tenant_id, day, utm_source, utm_medium, utm_campaign;
+
+-- Backfill for events written before the view existed:
+-- INSERT INTO analytics.events_utm_daily
+-- SELECT tenant_id, toDate(ts) as day, utm_source, utm_medium, utm_campaign,
+--        countIf(event = 'pageview'), countIf(event = 'click'),
+--        countIf(event = 'conversion'), sum(revenue)
+-- FROM analytics.events
+-- GROUP BY tenant_id, day, utm_source, utm_medium, utm_campaign;
+
+-- Daily order-value distribution rollup: t-digest states for percentiles
+-- and quarter-octave (log2 * 4) bucket counts for histograms
+CREATE TABLE IF NOT EXISTS analytics.order_values_daily (
+    tenant_id String,
+    day Date,
+    orders SimpleAggregateFunction(sum, UInt64),
+    revenue SimpleAggregateFunction(sum, Float64),
+    value_digest AggregateFunction(quantilesTDigest(0.5, 0.9, 0.99), Float64),
+    value_buckets SimpleAggregateFunction(sumMap, Tuple(Array(Int16), Array(UInt64)))
+) ENGINE = AggregatingMergeTree()
+PARTITION BY toYYYYMM(day)
+ORDER BY (tenant_id, day)
+TTL day + INTERVAL 400 DAY;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS analytics.order_values_daily_mv
+TO analytics.order_values_daily
+AS SELECT
+    tenant_id,
+    toDate(ts) as day,
+    toUInt64(count()) as orders,
+    sum(value) as revenue,
+    quantilesTDigestState(0.5, 0.9, 0.99)(value) as value_digest,
+    sumMap([toInt16(floor(log2(value) * 4))], [toUInt64(1)]) as value_buckets
+-- Read revenue as `value`: the `revenue` alias above would otherwise
+-- shadow the column in WHERE and in the other aggregates
+FROM (
+    SELECT tenant_id, ts, revenue as value
+    FROM analytics.events
+    WHERE event = 'conversion' AND revenue > 0
+)
+GROUP BY tenant_id, day;
+
+-- Session path transitions, written by the attribution service on ingest
+CREATE TABLE IF NOT EXISTS analytics.flow_transitions (
+    tenant_id String,
+    day Date,
+    kind LowCardinality(String),
+    step UInt8,
+    source String,
+    target String,
+    transitions UInt64
+) ENGINE = SummingMergeTree()
+PARTITION BY toYYYYMM(day)
+ORDER BY (tenant_id, kind, day, step, source, target)
+TTL day + INTERVAL 400 DAY;
+
+-- Per-session touchpoint paths for attribution. `converted` lets path
+-- queries merge the touchpoint states of converting sessions only.
+-- A session's rows arrive from several insert blocks, so `day` is a min
+-- state rather than a partition key: every row of a session lands in the
+-- one partition and merges into a single row keyed by session.
+CREATE TABLE IF NOT EXISTS analytics.session_paths (
+    tenant_id String,
+    session_id String,
+    day SimpleAggregateFunction(min, Date),
+    converted SimpleAggregateFunction(max, UInt8),
+    touchpoints AggregateFunction(groupArray, Tuple(DateTime, String, String, String)),
+    revenue AggregateFunction(sum, Float64)
+) ENGINE = AggregatingMergeTree()
+ORDER BY (tenant_id, session_id)
+TTL day + INTERVAL 400 DAY;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS analytics.session_paths_mv
+TO analytics.session_paths
+AS SELECT
+    tenant_id,
+    session_id,
+    toDate(min(ts)) as day,
+    toUInt8(max(amount > 0)) as converted,
+    -- The cast drops the element names 24.8 gives to (ts, event, ...)
+    groupArrayState(CAST((ts, event, utm_source, utm_campaign), 'Tuple(DateTime, String, String, String)')) as touchpoints,
+    sumState(amount) as revenue
+-- Read revenue as `amount`: the `revenue` alias above would otherwise
+-- shadow the column in the `converted` aggregate
+FROM (
+    SELECT tenant_id, session_id, ts, event, utm_source, utm_campaign, revenue as amount
+    FROM analytics.events
+)
+GROUP BY tenant_id, session_id;
+
+-- Backfill for events written before the view existed. Tables created
+-- with the earlier PARTITION BY toYYYYMM(day) layout must be dropped and
+-- backfilled again:
+-- INSERT INTO analytics.session_paths
+-- SELECT tenant_id, session_id, toDate(min(ts)), toUInt8(max(revenue > 0)),
+--        groupArrayState(CAST((ts, event, utm_source, utm_campaign), 'Tuple(DateTime, String, String, String)')),
+--        sumState(revenue)
+-- FROM analytics.events
+-- GROUP BY tenant_id, session_id;
+
+-- Output of the attribution backfill (python -m app.backfill in the
+-- attribution service). One row per session with its channel credits,
+-- so re-runs replace a session's earlier credits whole by version.
+CREATE TABLE IF NOT EXISTS analytics.attributed_revenue (
+    tenant_id String,
+    month UInt32,
+    model LowCardinality(String),
+    session_id String,
+    credits Map(String, Float64),
+    session_revenue Float64,
+    version UInt64
+) ENGINE = ReplacingMergeTree(version)
+PARTITION BY month
+ORDER BY (tenant_id, model, month, session_id);
+
+-- Finished (tenant, month) chunks per backfill run, for resuming
+CREATE TABLE IF NOT EXISTS analytics.attribution_backfill_progress (
+    run_id String,
+    tenant_id String,
+    month UInt32,
+    model LowCardinality(String),
+    sessions UInt64,
+    revenue Float64,
+    seconds Float64,
+    finished_at DateTime
+) ENGINE = ReplacingMergeTree(finished_at)
+ORDER BY (run_id, tenant_id, month);
@@ -0,0 +1,201 @@
+"""Dimensional breakdown query building.
+
+Rows are grouped by up to three UTM dimensions. At every level only the
+top K values within their parent are kept and the rest are folded into an
+"other" bucket, so the result stays small even for high-cardinality
+campaign sets. Whole-day ranges are read from the `events_utm_daily`
+rollup; anything else falls back to raw events.
+
+Usage (benchmark):
+    python -m app.breakdown [--tenant t0] [--days 7]
+"""
+import argparse
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+DIMENSIONS = ("utm_source", "utm_medium", "utm_campaign")
+METRICS = ("pageviews", "clicks", "conversions", "revenue")
+OTHER = "other"
+
+_DATE_ONLY = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def uses_rollup(start_date: str, end_date: str) -> bool:
+    """Check whether a range falls on day boundaries the rollup can serve."""
+    return bool(_DATE_ONLY.match(start_date) and _DATE_ONLY.match(end_date))
+
+
+def _base_query(dims: List[str], rollup: bool) -> str:
+    """Aggregate metrics by every requested dimension."""
+    keys = ", ".join(f"{dim} as k{i}_0" for i, dim in enumerate(dims))
+    if rollup:
+        return f"""
+            SELECT
+                {keys},
+                sum(pageviews) as m_pageviews,
+                sum(clicks) as m_clicks,
+                sum(conversions) as m_conversions,
+                sum(revenue) as m_revenue
+            FROM events_utm_daily
+            WHERE tenant_id = {{tenant_id:String}}
+              AND day >= toDate({{start_date:String}})
+              AND day < toDate({{end_date:String}})
+            GROUP BY {", ".join(dims)}
+        """
+    return f"""
+        SELECT
+            {keys},
+            countIf(event = 'pageview') as m_pageviews,
+            countIf(event = 'click') as m_clicks,
+            countIf(event = 'conversion') as m_conversions,
+            sum(revenue) as m_revenue
+        FROM events
+        WHERE tenant_id = {{tenant_id:String}}
+          AND ts >= {{start_date:String}}
+          AND ts <= {{end_date:String}}
+        GROUP BY {", ".join(dims)}
+    """
+
+
+def _collapse_level(inner: str, level: int, depth: int, sort: str) -> str:
+    """Fold everything past the top K at one level into "other"."""
+    keys = [f"k{i}_{level}" for i in range(depth)]
+    metrics = ", ".join(f"m_{m}" for m in METRICS)
+    parents = keys[:level]
+    partition = f"PARTITION BY {', '.join(parents)} " if parents else ""
+
+    outputs = []
+    for i, key in enumerate(keys):
+        if i == level:
+            outputs.append(f"if(rnk > {{top_k:UInt32}}, '{OTHER}', {key}) as k{i}_{level + 1}")
+        else:
+            outputs.append(f"{key} as k{i}_{level + 1}")
+
+    return f"""
+        SELECT {", ".join(outputs)}, {metrics}
+        FROM (
+            SELECT
+                {", ".join(keys)}, {metrics},
+                dense_rank() OVER ({partition}ORDER BY grp DESC, {keys[level]}) as rnk
+            FROM (
+                SELECT
+                    {", ".join(keys)}, {metrics},
+                    sum(m_{sort}) OVER (PARTITION BY {", ".join(keys[:level + 1])}) as grp
+                FROM ({inner})
+            )
+        )
+    """
+
+
+def build_breakdown_query(
+    dims: List[str],
+    sort: str,
+    rollup: bool,
+) -> str:
+    """Build the top-K breakdown query with "other" rollup and pagination."""
+    depth = len(dims)
+    query = _base_query(dims, rollup)
+    for level in range(depth):
+        query = _collapse_level(query, level, depth, sort)
+
+    keys = [f"k{i}_{depth}" for i in range(depth)]
+    return f"""
+        SELECT
+            {", ".join(f"{key} as {dim}" for key, dim in zip(keys, dims))},
+            {", ".join(f"sum(m_{m}) as {m}" for m in METRICS)},
+            count() OVER () as total_rows
+        FROM ({query})
+        GROUP BY {", ".join(keys)}
+        ORDER BY {sort} DESC, {", ".join(keys)}
+        LIMIT {{limit:UInt32}} OFFSET {{offset:UInt32}}
+    """
+
+
+def breakdown_rows(dims: List[str], rows: List[Tuple]) -> Tuple[List[Dict[str, Any]], int]:
+    """Shape result rows into records, returning them with the total row count."""
+    records = []
+    total = 0
+    for row in rows:
+        record = dict(zip(dims, row[:len(dims)]))
+        pageviews, clicks, conversions, revenue = row[len(dims):len(dims) + 4]
+        record.update({
+            "pageviews": pageviews,
+            "clicks": clicks,
+            "conversions": conversions,
+            "revenue": float(revenue),
+            "ctr": round((clicks / max(pageviews, 1)) * 100, 2),
+            "cvr": round((conversions / max(clicks, 1)) * 100, 2),
+        })
+        records.append(record)
+        total = row[-1]
+    return records, total
+
+
+def benchmark(client, tenant_id: str, days: int, sort: str = "conversions", top_k: int = 10) -> List[Dict]:
+    """Compare the breakdown read from raw events and from the rollup over the same days."""
+    today = datetime.utcnow().date()
+    params = {
+        "tenant_id": tenant_id,
+        "start_date": (today - timedelta(days=days)).isoformat(),
+        "end_date": today.isoformat(),
+        "top_k": top_k,
+        "limit": 1000,
+        "offset": 0,
+    }
+
+    # The rollup's end date is exclusive, the raw query's end is inclusive
+    event_params = {**params, "end_date": f"{today - timedelta(days=1)} 23:59:59"}
+
+    report = []
+    for depth in range(1, len(DIMENSIONS) + 1):
+        dims = list(DIMENSIONS[:depth])
+        row = {"dimensions": dims}
+        for label, rollup in (("events", False), ("rollup", True)):
+            started = time.perf_counter()
+            result = client.query(
+                build_breakdown_query(dims, sort, rollup),
+                parameters=params if rollup else event_params,
+            )
+            records = breakdown_rows(dims, result.result_rows)[0]
+            row[label] = {
+                "read_rows": int(result.summary.get("read_rows", 0)),
+                "read_bytes": int(result.summary.get("read_bytes", 0)),
+                "ms": round((time.perf_counter() - started) * 1000, 1),
+                # Float sums differ in the last digits with summation order
+                "rows": [{**r, "revenue": round(r["revenue"], 2)} for r in records],
+            }
+        row["same_rows"] = row["events"].pop("rows") == row["rollup"].pop("rows")
+        report.append(row)
+    return report
+
+
+def main():
+    import clickhouse_connect
+
+    parser = argparse.ArgumentParser(description="Compare breakdowns from raw events and from the daily UTM rollup")
+    parser.add_argument("--tenant", default="t0")
+    parser.add_argument("--days", type=int, default=7)
+    args = parser.parse_args()
+
+    client = clickhouse_connect.get_client(
+        host=os.getenv("CLICKHOUSE_HOST", "clickhouse"),
+        port=int(os.getenv("CLICKHOUSE_PORT", "8123")),
+        database=os.getenv("CLICKHOUSE_DB", "analytics"),
+    )
+
+    print(f"{'dimensions':<36} {'source':<7} {'ms':>9} {'read_rows':>12} {'read_bytes':>14}")
+    for row in benchmark(client, args.tenant, args.days):
+        for source in ("events", "rollup"):
+            stats = row[source]
+            print(
+                f"{','.join(row['dimensions']):<36} {source:<7} {stats['ms']:>9.1f} "
+                f"{stats['read_rows']:>12,} {stats['read_bytes']:>14,}"
+            )
+        print(f"{'':<36} same rows: {row['same_rows']}")
+
+
+if __name__ == "__main__":
+    main()
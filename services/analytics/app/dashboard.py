@@ -0,0 +1,251 @@
+"""Dashboard bundle planning and execution.
+
+A dashboard is a declarative list of widgets. Widgets that read the same
+rows are merged into a single scan (summary and funnel widgets over the
+same range share one aggregate query, timeseries widgets with the same
+range and granularity share one GROUP BY), and all scans run concurrently
+under a shared deadline. Timeseries scans are fetched as DataFrames and
+their points serialized from the columns (see app/serialize.py).
+"""
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Dict, List, Tuple
+
+from app.queries import event_for, interval_for
+from app.serialize import records_json
+
+logger = logging.getLogger(__name__)
+
+WIDGET_TYPES = ("summary", "timeseries", "funnel")
+
+# Upper bound for a bundle deadline; also caps ClickHouse max_execution_time
+MAX_DEADLINE_MS = 30_000
+
+
+def plan_scans(widgets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Group widgets into the minimal set of ClickHouse scans."""
+    scans: Dict[Tuple, Dict[str, Any]] = {}
+
+    for widget in widgets:
+        if widget["type"] == "timeseries":
+            key = ("timeseries", widget["start_date"], widget["end_date"], widget["granularity"])
+        else:
+            key = ("totals", widget["start_date"], widget["end_date"])
+
+        scan = scans.get(key)
+        if scan is None:
+            scan = scans[key] = {
+                "kind": key[0],
+                "start_date": widget["start_date"],
+                "end_date": widget["end_date"],
+                "granularity": widget.get("granularity"),
+                "summary": False,
+                "metrics": [],
+                "steps": [],
+                "widgets": [],
+            }
+
+        if widget["type"] == "summary":
+            scan["summary"] = True
+        elif widget["type"] == "funnel":
+            for step in widget["steps"]:
+                if step not in scan["steps"]:
+                    scan["steps"].append(step)
+        elif widget["metric"] not in scan["metrics"]:
+            scan["metrics"].append(widget["metric"])
+
+        scan["widgets"].append(widget)
+
+    return list(scans.values())
+
+
+def build_scan_query(tenant_id: str, scan: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """Build the query and parameters for a scan."""
+    params: Dict[str, Any] = {
+        "tenant_id": tenant_id,
+        "start_date": scan["start_date"],
+        "end_date": scan["end_date"],
+    }
+    columns = []
+    event_filter = ""
+
+    if scan["kind"] == "timeseries":
+        columns.append(f"{interval_for(scan['granularity'])} as bucket")
+        columns.append("toString(bucket) as period")
+        events = []
+        for i, metric in enumerate(scan["metrics"]):
+            if metric == "revenue":
+                columns.append(f"toFloat64(sum(revenue)) as m{i}")
+            else:
+                params[f"event_{i}"] = event_for(metric)
+                events.append(event_for(metric))
+                columns.append(f"toFloat64(countIf(event = {{event_{i}:String}})) as m{i}")
+
+        # Revenue sums every event, so only narrow the scan without it
+        if "revenue" not in scan["metrics"]:
+            params["events"] = events
+            event_filter = "AND event IN {events:Array(String)}"
+    else:
+        if scan["summary"]:
+            columns.extend([
+                "countIf(event = 'pageview') as pageviews",
+                "countIf(event = 'click') as clicks",
+                "countIf(event = 'conversion') as conversions",
+                "sum(revenue) as revenue",
+                "count(DISTINCT session_id) as sessions",
+                "count(DISTINCT user_id) as users",
+            ])
+        for i, step in enumerate(scan["steps"]):
+            params[f"step_{i}"] = step
+            columns.append(f"uniqExactIf(session_id, event = {{step_{i}:String}}) as s{i}")
+
+    query = f"""
+        SELECT
+            {", ".join(columns)}
+        FROM events
+        WHERE tenant_id = {{tenant_id:String}}
+          AND ts >= {{start_date:String}}
+          AND ts <= {{end_date:String}}
+          {event_filter}
+    """
+    if scan["kind"] == "timeseries":
+        query += """
+        GROUP BY bucket
+        ORDER BY bucket
+        """
+
+    return query, params
+
+
+def widget_payload(widget: Dict[str, Any], scan: Dict[str, Any], rows) -> Dict[str, Any]:
+    """Extract a widget's payload from its scan's result (a DataFrame for timeseries)."""
+    if widget["type"] == "timeseries":
+        column = f"m{scan['metrics'].index(widget['metric'])}"
+        # An empty result comes back without columns
+        points = rows[["period", column]].rename(columns={column: "value"}) if len(rows) else rows
+        return {
+            "metric": widget["metric"],
+            "granularity": widget["granularity"],
+            "data": records_json(points),
+        }
+
+    row = rows[0] if rows else None
+    offset = 6 if scan["summary"] else 0
+
+    if widget["type"] == "summary":
+        if row is None:
+            return {"error": "No data found"}
+        pageviews, clicks, conversions, revenue, sessions, users = row[:6]
+        return {
+            "pageviews": pageviews,
+            "clicks": clicks,
+            "conversions": conversions,
+            "revenue": float(revenue),
+            "sessions": sessions,
+            "users": users,
+            "ctr": round((clicks / max(pageviews, 1)) * 100, 2),
+            "cvr": round((conversions / max(clicks, 1)) * 100, 2),
+            "start_date": widget["start_date"],
+            "end_date": widget["end_date"],
+        }
+
+    funnel_data = []
+    for i, step in enumerate(widget["steps"]):
+        count = row[offset + scan["steps"].index(step)] if row else 0
+
+        # Calculate conversion rate from previous step
+        conversion_rate = 100.0
+        if i > 0 and funnel_data[i - 1]["count"] > 0:
+            conversion_rate = (count / funnel_data[i - 1]["count"]) * 100
+
+        funnel_data.append({
+            "step": step,
+            "count": count,
+            "conversion_rate": round(conversion_rate, 2),
+        })
+
+    return {
+        "funnel": funnel_data,
+        "start_date": widget["start_date"],
+        "end_date": widget["end_date"],
+    }
+
+
+def _execute_scan(client, tenant_id: str, scan: Dict[str, Any], timeout: float) -> Tuple[Any, float]:
+    """Run a scan, returning its rows (a DataFrame for timeseries) and elapsed milliseconds."""
+    query, params = build_scan_query(tenant_id, scan)
+    # Let ClickHouse abort the query too once the deadline has passed
+    settings = {"max_execution_time": max(1, math.ceil(timeout))}
+    started = time.perf_counter()
+    if scan["kind"] == "timeseries":
+        rows = client.query_df(query, parameters=params, settings=settings)
+    else:
+        rows = client.query(query, parameters=params, settings=settings).result_rows
+    return rows, (time.perf_counter() - started) * 1000
+
+
+async def run_dashboard(
+    client,
+    tenant_id: str,
+    widgets: List[Dict[str, Any]],
+    deadline_ms: int,
+) -> Dict[str, Any]:
+    """Execute a dashboard bundle and return every widget's payload."""
+    started = time.perf_counter()
+    timeout = deadline_ms / 1000
+
+    valid = [w for w in widgets if w["type"] in WIDGET_TYPES]
+    scans = plan_scans(valid)
+
+    tasks = {
+        asyncio.create_task(
+            asyncio.to_thread(_execute_scan, client, tenant_id, scan, timeout)
+        ): scan
+        for scan in scans
+    }
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+
+    # Resolve each scan into rows or an error
+    outcomes: Dict[int, Dict[str, Any]] = {}
+    for index, (task, scan) in enumerate(tasks.items()):
+        scan["index"] = index
+        if not task.done() or task.cancelled():
+            outcomes[index] = {"error": "Deadline exceeded", "ms": None}
+        elif task.exception() is not None:
+            logger.error(f"Dashboard scan failed: {task.exception()}")
+            outcomes[index] = {"error": str(task.exception()), "ms": None}
+        else:
+            rows, elapsed = task.result()
+            outcomes[index] = {"rows": rows, "ms": round(elapsed, 2)}
+
+    scan_of = {id(w): scan for scan in scans for w in scan["widgets"]}
+    results = []
+    for widget in widgets:
+        entry = {"id": widget["id"], "type": widget["type"]}
+
+        if widget["type"] not in WIDGET_TYPES:
+            entry["error"] = f"Unknown widget type: {widget['type']}"
+            entry["timing_ms"] = None
+            results.append(entry)
+            continue
+
+        scan = scan_of[id(widget)]
+        outcome = outcomes[scan["index"]]
+        if "error" in outcome:
+            entry["error"] = outcome["error"]
+        else:
+            entry["data"] = widget_payload(widget, scan, outcome["rows"])
+        entry["timing_ms"] = outcome["ms"]
+        entry["scan"] = scan["index"]
+        results.append(entry)
+
+    return {
+        "widgets": results,
+        "scans": len(scans),
+        "total_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
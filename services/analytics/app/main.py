@@ -1,10 +1,25 @@
 """Analytics Service for metrics and reporting."""
 from fastapi import FastAPI
-from typing import Optional
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Optional, List
 import clickhouse_connect
+import clickhouse_connect.common
+import redis
+import asyncio
 import logging
 import os
 from datetime import datetime, timedelta
+from marketeer_shared.instrumentation import InstrumentedClient, current_endpoint, instrument_app, set_tenant
+from app.anomalies import build_series, detect_anomalies, rank_anomalies
+from app.breakdown import (
+    DIMENSIONS, METRICS, breakdown_rows, build_breakdown_query, uses_rollup,
+)
+from app.dashboard import MAX_DEADLINE_MS, run_dashboard
+from app.export import EXPORT_COLUMNS, EXPORT_FORMATS, iter_export, open_export
+from app.realtime import read_today, reconcile
+from app.queries import default_range, event_for, interval_for
+from app.serialize import json_response, records_response
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -14,28 +29,86 @@ logger = logging.getLogger(__name__)
 CLICKHOUSE_HOST = os.getenv("CLICKHOUSE_HOST", "clickhouse")
 CLICKHOUSE_PORT = int(os.getenv("CLICKHOUSE_PORT", "8123"))
 CLICKHOUSE_DB = os.getenv("CLICKHOUSE_DB", "analytics")
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+REALTIME_RECONCILE_SECONDS = int(os.getenv("REALTIME_RECONCILE_SECONDS", "60"))
+REALTIME_SETTLE_MINUTES = int(os.getenv("REALTIME_SETTLE_MINUTES", "5"))
 
 # Create FastAPI app
 app = FastAPI(title="Analytics Service")
+instrument_app(app)
 
 # ClickHouse client
 ch_client = None
 
+# Redis client for real-time counters
+redis_client = None
+
+
+class DashboardWidget(BaseModel):
+    """Dashboard widget schema."""
+    id: str
+    type: str  # summary, timeseries, funnel
+    metric: Optional[str] = "impressions"
+    granularity: Optional[str] = "d"
+    steps: Optional[str] = "pageview,click,conversion"
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+
+
+class DashboardRequest(BaseModel):
+    """Dashboard bundle request schema."""
+    tenant_id: str = "t0"
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    deadline_ms: int = Field(5000, ge=1, le=MAX_DEADLINE_MS)
+    widgets: List[DashboardWidget]
+
 
 @app.on_event("startup")
 async def startup():
-    """Initialize ClickHouse connection."""
-    global ch_client
+    """Initialize ClickHouse and Redis connections."""
+    global ch_client, redis_client
     try:
-        ch_client = clickhouse_connect.get_client(
+        # Without a session the client can run concurrent queries
+        clickhouse_connect.common.set_setting("autogenerate_session_id", False)
+        ch_client = InstrumentedClient(clickhouse_connect.get_client(
             host=CLICKHOUSE_HOST,
             port=CLICKHOUSE_PORT,
             database=CLICKHOUSE_DB,
-        )
+        ))
         logger.info("ClickHouse connection established")
     except Exception as e:
         logger.error(f"Failed to connect to ClickHouse: {e}")
 
+    try:
+        redis_client = redis.from_url(REDIS_URL)
+        redis_client.ping()
+        logger.info("Redis connection established")
+    except Exception as e:
+        logger.warning(f"Redis connection failed: {e}")
+        redis_client = None
+
+    if ch_client and redis_client:
+        asyncio.create_task(reconcile_counters())
+
+
+async def reconcile_counters():
+    """Periodically reconcile the real-time counters with ClickHouse."""
+    current_endpoint.set("realtime_reconcile")
+    while True:
+        await asyncio.sleep(REALTIME_RECONCILE_SECONDS)
+        try:
+            await asyncio.to_thread(
+                reconcile,
+                redis_client,
+                ch_client,
+                datetime.utcnow(),
+                REALTIME_SETTLE_MINUTES,
+                max(1, REALTIME_RECONCILE_SECONDS - 5),
+            )
+        except Exception as e:
+            logger.error(f"Counter reconciliation failed: {e}")
+
 
 @app.get("/health")
 async def health_check():
@@ -43,6 +116,7 @@ async def health_check():
     return {
         "status": "healthy",
         "clickhouse": ch_client is not None,
+        "redis": redis_client is not None,
     }
 
 
@@ -59,46 +133,40 @@ async def get_timeseries(
         return {"error": "ClickHouse not available"}
 
     # Default to last 7 days
-    if not end_date:
-        end_date = datetime.utcnow().strftime("%Y-%m-%d")
-    if not start_date:
-        start_date = (datetime.utcnow() - timedelta(days=7)).strftime("%Y-%m-%d")
+    start_date, end_date = default_range(start_date, end_date, days=7)
 
     # Map granularity to ClickHouse interval
-    interval_map = {
-        "h": "toStartOfHour(ts)",
-        "d": "toDate(ts)",
-        "w": "toMonday(ts)",
-    }
-    interval_func = interval_map.get(granularity, "toDate(ts)")
+    interval_func = interval_for(granularity)
 
     try:
         # Build query based on metric
         if metric == "revenue":
             query = f"""
                 SELECT
-                    {interval_func} as period,
-                    sum(revenue) as value
+                    {interval_func} as bucket,
+                    toString(bucket) as period,
+                    toFloat64(sum(revenue)) as value
                 FROM events
                 WHERE tenant_id = {{tenant_id:String}}
                   AND ts >= {{start_date:String}}
                   AND ts <= {{end_date:String}}
-                GROUP BY period
-                ORDER BY period
+                GROUP BY bucket
+                ORDER BY bucket
             """
         else:
             # Count events
             query = f"""
                 SELECT
-                    {interval_func} as period,
-                    count() as value
+                    {interval_func} as bucket,
+                    toString(bucket) as period,
+                    toFloat64(count()) as value
                 FROM events
                 WHERE tenant_id = {{tenant_id:String}}
                   AND ts >= {{start_date:String}}
                   AND ts <= {{end_date:String}}
                   AND event = {{event:String}}
-                GROUP BY period
-                ORDER BY period
+                GROUP BY bucket
+                ORDER BY bucket
             """
 
         params = {
@@ -109,26 +177,15 @@ async def get_timeseries(
 
         if metric != "revenue":
             # Map metric to event name
-            event_map = {
-                "impressions": "impression",
-                "clicks": "click",
-                "conversions": "conversion",
-                "pageviews": "pageview",
-            }
-            params["event"] = event_map.get(metric, "pageview")
-
-        result = ch_client.query(query, parameters=params)
+            params["event"] = event_for(metric)
 
-        data = [
-            {"period": str(row[0]), "value": float(row[1])}
-            for row in result.result_rows
-        ]
+        # Fetch as NumPy-backed columns and serialize without per-row objects
+        df = ch_client.query_df(query, parameters=params)
 
-        return {
-            "metric": metric,
-            "granularity": granularity,
-            "data": data,
-        }
+        return records_response(
+            {"metric": metric, "granularity": granularity},
+            df[["period", "value"]],
+        )
 
     except Exception as e:
         logger.error(f"Timeseries query failed: {e}")
@@ -147,10 +204,7 @@ async def get_funnel(
         return {"error": "ClickHouse not available"}
 
     # Default to last 30 days
-    if not end_date:
-        end_date = datetime.utcnow().strftime("%Y-%m-%d")
-    if not start_date:
-        start_date = (datetime.utcnow() - timedelta(days=30)).strftime("%Y-%m-%d")
+    start_date, end_date = default_range(start_date, end_date, days=30)
 
     step_list = steps.split(",")
 
@@ -212,10 +266,7 @@ async def get_summary(
         return {"error": "ClickHouse not available"}
 
     # Default to last 7 days
-    if not end_date:
-        end_date = datetime.utcnow().strftime("%Y-%m-%d")
-    if not start_date:
-        start_date = (datetime.utcnow() - timedelta(days=7)).strftime("%Y-%m-%d")
+    start_date, end_date = default_range(start_date, end_date, days=7)
 
     try:
         query = """
@@ -263,6 +314,431 @@ async def get_summary(
         return {"error": str(e)}
 
 
+@app.post("/dashboard")
+async def get_dashboard(request: DashboardRequest):
+    """Get a bundle of dashboard widgets in one round-trip."""
+    if not ch_client:
+        return {"error": "ClickHouse not available"}
+
+    set_tenant(request.tenant_id)
+
+    # Default to last 7 days
+    start_date, end_date = default_range(request.start_date, request.end_date, days=7)
+
+    widgets = []
+    for widget in request.widgets:
+        steps = [s.strip() for s in (widget.steps or "").split(",") if s.strip()]
+        widgets.append({
+            "id": widget.id,
+            "type": widget.type,
+            "metric": widget.metric or "impressions",
+            "granularity": widget.granularity or "d",
+            "steps": steps or ["pageview", "click", "conversion"],
+            "start_date": widget.start_date or start_date,
+            "end_date": widget.end_date or end_date,
+        })
+
+    try:
+        result = await run_dashboard(ch_client, request.tenant_id, widgets, request.deadline_ms)
+        result["start_date"] = start_date
+        result["end_date"] = end_date
+        # Timeseries points are already encoded from their columns
+        return json_response(result)
+
+    except Exception as e:
+        logger.error(f"Dashboard query failed: {e}")
+        return {"error": str(e)}
+
+
+@app.get("/retention")
+async def get_retention(
+    tenant_id: str = "t0",
+    granularity: str = "w",  # d=day, w=week
+    periods: int = 12,
+    cohort_event: Optional[str] = None,
+    return_event: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+):
+    """Get a cohort retention matrix.
+
+    A cohort is every user first seen (or first doing `cohort_event`) in a
+    period; retention at offset k is the share of them active (or doing
+    `return_event`) k periods later. First days come from the per-user
+    `user_first_seen` states and activity from the daily bitmaps in
+    `user_activity_daily`, so no raw events are scanned.
+    """
+    if not ch_client:
+        return {"error": "ClickHouse not available"}
+
+    period_days = 1 if granularity == "d" else 7
+    periods = max(1, min(periods, 90 if granularity == "d" else 52))
+
+    # Default to enough history for the requested number of periods
+    start_date, end_date = default_range(start_date, end_date, days=periods * period_days)
+
+    def period_of(expr: str) -> str:
+        return expr if granularity == "d" else f"toStartOfWeek({expr}, 1)"
+
+    # Whole periods only: weeks run Monday to Sunday around the range ends
+    range_start = period_of("{start_date:Date}")
+    range_end = f"{period_of('{end_date:Date}')} + {period_days}"
+
+    try:
+        query = f"""
+            WITH
+                cohorts AS (
+                    SELECT
+                        {period_of("first_day")} as period,
+                        groupBitmapState(user) as users
+                    FROM (
+                        SELECT user, minMerge(first_day) as first_day
+                        FROM user_first_seen
+                        WHERE tenant_id = {{tenant_id:String}}
+                          {"AND event = {cohort_event:String}" if cohort_event else ""}
+                        GROUP BY user
+                    )
+                    WHERE first_day >= {range_start}
+                      AND first_day < {range_end}
+                    GROUP BY period
+                ),
+                activity AS (
+                    SELECT
+                        {period_of("day")} as period,
+                        groupBitmapMergeState(users) as users
+                    FROM user_activity_daily
+                    WHERE tenant_id = {{tenant_id:String}}
+                      AND day >= {range_start}
+                      AND day < {range_end}
+                      {"AND event = {return_event:String}" if return_event else ""}
+                    GROUP BY period
+                )
+            SELECT
+                c.period as cohort,
+                intDiv(dateDiff('day', c.period, a.period), {period_days}) as offset,
+                bitmapCardinality(c.users) as size,
+                bitmapAndCardinality(c.users, a.users) as retained
+            FROM cohorts as c
+            CROSS JOIN activity as a
+            WHERE a.period >= c.period
+              AND offset < {{periods:UInt32}}
+            ORDER BY cohort, offset
+        """
+
+        params = {
+            "tenant_id": tenant_id,
+            "start_date": start_date,
+            "end_date": end_date,
+            "periods": periods,
+        }
+        if cohort_event:
+            params["cohort_event"] = cohort_event
+        if return_event:
+            params["return_event"] = return_event
+
+        result = ch_client.query(query, parameters=params)
+
+        cohorts = []
+        for cohort, offset, size, retained in result.result_rows:
+            if not cohorts or cohorts[-1]["cohort"] != str(cohort):
+                cohorts.append({"cohort": str(cohort), "size": size, "retention": []})
+            cohorts[-1]["retention"].append({
+                "period": offset,
+                "users": retained,
+                "rate": round((retained / max(size, 1)) * 100, 2),
+            })
+
+        return {
+            "granularity": granularity,
+            "periods": periods,
+            "cohorts": cohorts,
+            "start_date": start_date,
+            "end_date": end_date,
+        }
+
+    except Exception as e:
+        logger.error(f"Retention query failed: {e}")
+        return {"error": str(e)}
+
+
+@app.get("/export")
+async def export_events(
+    tenant_id: str = "t0",
+    format: str = "parquet",  # arrow, parquet, csv
+    columns: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+):
+    """Stream a tenant's raw events as Arrow IPC, Parquet or gzipped CSV."""
+    if not ch_client:
+        return {"error": "ClickHouse not available"}
+
+    if format not in EXPORT_FORMATS:
+        return {"error": f"Invalid format: {format}"}
+
+    column_list = EXPORT_COLUMNS
+    if columns:
+        column_list = [c.strip() for c in columns.split(",") if c.strip()]
+        unknown = [c for c in column_list if c not in EXPORT_COLUMNS]
+        if unknown:
+            return {"error": f"Invalid columns: {', '.join(unknown)}"}
+
+    # Default to last 7 days
+    start_date, end_date = default_range(start_date, end_date, days=7)
+
+    params = {
+        "tenant_id": tenant_id,
+        "start_date": start_date,
+        "end_date": end_date,
+    }
+
+    try:
+        stream = open_export(ch_client, format, column_list, params)
+    except Exception as e:
+        logger.error(f"Export query failed: {e}")
+        return {"error": str(e)}
+
+    _, content_type, extension = EXPORT_FORMATS[format]
+    filename = f"events_{tenant_id}_{start_date}_{end_date}.{extension}"
+
+    return StreamingResponse(
+        iter_export(stream, format),
+        media_type=content_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.get("/breakdown")
+async def get_breakdown(
+    tenant_id: str = "t0",
+    dimensions: str = "utm_source",
+    sort: str = "conversions",
+    top_k: int = 10,
+    limit: int = 100,
+    offset: int = 0,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+):
+    """Get metrics split by up to three UTM dimensions.
+
+    Each level keeps its top `top_k` values within their parent and folds
+    the rest into "other". Whole-day ranges are served from the daily UTM
+    rollup, where `end_date` is exclusive.
+    """
+    if not ch_client:
+        return {"error": "ClickHouse not available"}
+
+    dims = [d.strip() for d in dimensions.split(",") if d.strip()]
+    if not dims or len(dims) > 3 or len(set(dims)) != len(dims):
+        return {"error": "Between one and three distinct dimensions are required"}
+    unknown = [d for d in dims if d not in DIMENSIONS]
+    if unknown:
+        return {"error": f"Invalid dimensions: {', '.join(unknown)}"}
+    if sort not in METRICS:
+        return {"error": f"Invalid sort metric: {sort}"}
+
+    # Default to last 7 days
+    start_date, end_date = default_range(start_date, end_date, days=7)
+    rollup = uses_rollup(start_date, end_date)
+
+    try:
+        query = build_breakdown_query(dims, sort, rollup)
+
+        params = {
+            "tenant_id": tenant_id,
+            "start_date": start_date,
+            "end_date": end_date,
+            "top_k": max(1, top_k),
+            "limit": max(1, min(limit, 1000)),
+            "offset": max(0, offset),
+        }
+
+        result = ch_client.query(query, parameters=params)
+        rows, total_rows = breakdown_rows(dims, result.result_rows)
+
+        return {
+            "dimensions": dims,
+            "sort": sort,
+            "top_k": params["top_k"],
+            "rows": rows,
+            "total_rows": total_rows,
+            "limit": params["limit"],
+            "offset": params["offset"],
+            "source": "rollup" if rollup else "events",
+            "start_date": start_date,
+            "end_date": end_date,
+        }
+
+    except Exception as e:
+        logger.error(f"Breakdown query failed: {e}")
+        return {"error": str(e)}
+
+
+@app.get("/today")
+async def get_today(
+    tenant_id: str = "t0",
+    minutes: bool = False,
+):
+    """Get today-so-far metrics from the real-time counters."""
+    now = datetime.utcnow()
+
+    if redis_client:
+        try:
+            result = read_today(redis_client, tenant_id, now, include_minutes=minutes)
+            result["source"] = "counters"
+            return result
+        except Exception as e:
+            logger.warning(f"Real-time counter read failed: {e}")
+
+    # Fall back to scanning today's partition
+    result = await get_summary(
+        tenant_id=tenant_id,
+        start_date=now.strftime("%Y-%m-%d"),
+        end_date=(now + timedelta(days=1)).strftime("%Y-%m-%d"),
+    )
+    if "error" not in result:
+        result["source"] = "clickhouse"
+    return result
+
+
+@app.get("/anomalies")
+async def get_anomalies(
+    tenant_id: str = "t0",
+    days: int = 14,
+    threshold: float = 3.5,
+    min_volume: float = 20,
+    limit: int = 50,
+):
+    """Get anomalies in the last 24 hours across every campaign and metric.
+
+    Each hour is compared with the same hour on the previous `days - 1`
+    days using a median baseline and a MAD-based robust z-score.
+    """
+    if not ch_client:
+        return {"error": "ClickHouse not available"}
+
+    days = max(3, min(days, 60))
+
+    # Score the last complete 24 hours
+    end = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=days)
+
+    try:
+        query = """
+            SELECT
+                utm_campaign,
+                intDiv(toUnixTimestamp(ts) - {start_ts:UInt32}, 3600) as slot,
+                countIf(event = 'pageview') as pageviews,
+                countIf(event = 'click') as clicks,
+                countIf(event = 'conversion') as conversions,
+                sum(revenue) as revenue
+            FROM events
+            WHERE tenant_id = {tenant_id:String}
+              AND ts >= {start:DateTime}
+              AND ts < {end:DateTime}
+            GROUP BY utm_campaign, slot
+        """
+
+        params = {
+            "tenant_id": tenant_id,
+            "start": start,
+            "end": end,
+            "start_ts": int((start - datetime(1970, 1, 1)).total_seconds()),
+        }
+
+        df = ch_client.query_df(query, parameters=params)
+
+        names, values = build_series(df, days)
+        scores, baseline = detect_anomalies(values, threshold, min_volume)
+        anomalies = rank_anomalies(names, values, scores, baseline, (days - 1) * 24, limit)
+
+        for anomaly in anomalies:
+            anomaly["hour"] = (start + timedelta(hours=anomaly.pop("slot"))).isoformat()
+
+        return {
+            "anomalies": anomalies,
+            "series": len(names) * values.shape[1],
+            "window_start": (end - timedelta(hours=24)).isoformat(),
+            "window_end": end.isoformat(),
+        }
+
+    except Exception as e:
+        logger.error(f"Anomaly detection failed: {e}")
+        return {"error": str(e)}
+
+
+@app.get("/revenue/distribution")
+async def get_revenue_distribution(
+    tenant_id: str = "t0",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+):
+    """Get order-value percentiles and histogram for conversions.
+
+    Merges the precomputed daily t-digest states and bucket counts in
+    `order_values_daily`, so no raw revenue values are scanned. `end_date`
+    is exclusive.
+    """
+    if not ch_client:
+        return {"error": "ClickHouse not available"}
+
+    # Default to last 30 days
+    start_date, end_date = default_range(start_date, end_date, days=30)
+
+    try:
+        query = """
+            SELECT
+                sum(orders) as orders,
+                sum(revenue) as revenue,
+                quantilesTDigestMerge(0.5, 0.9, 0.99)(value_digest) as percentiles,
+                sumMap(value_buckets) as buckets
+            FROM order_values_daily
+            WHERE tenant_id = {tenant_id:String}
+              AND day >= toDate({start_date:String})
+              AND day < toDate({end_date:String})
+        """
+
+        params = {
+            "tenant_id": tenant_id,
+            "start_date": start_date,
+            "end_date": end_date,
+        }
+
+        result = ch_client.query(query, parameters=params)
+        orders, revenue, percentiles, (bucket_keys, bucket_counts) = result.result_rows[0]
+
+        if not orders:
+            percentiles = [0.0, 0.0, 0.0]
+
+        # Buckets are quarter-octaves: key k covers [2^(k/4), 2^((k+1)/4))
+        histogram = [
+            {
+                "lower": round(2 ** (key / 4), 2),
+                "upper": round(2 ** ((key + 1) / 4), 2),
+                "count": count,
+            }
+            for key, count in zip(bucket_keys, bucket_counts)
+        ]
+
+        return {
+            "orders": orders,
+            "revenue": float(revenue),
+            "revenue_per_conversion": round(revenue / max(orders, 1), 2),
+            "percentiles": {
+                "p50": round(float(percentiles[0]), 2),
+                "p90": round(float(percentiles[1]), 2),
+                "p99": round(float(percentiles[2]), 2),
+            },
+            "histogram": histogram,
+            "start_date": start_date,
+            "end_date": end_date,
+        }
+
+    except Exception as e:
+        logger.error(f"Revenue distribution query failed: {e}")
+        return {"error": str(e)}
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8086, reload=True)
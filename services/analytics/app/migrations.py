@@ -0,0 +1,155 @@
+"""Managed ClickHouse projections and skip indexes for the events table.
+
+The events table is ordered by (tenant_id, session_id, ts), which suits
+attribution paths but not the analytics queries, which all filter on
+tenant_id, event and a ts range. The projection and skip indexes below
+let those queries prune granules instead of reading every row for the
+tenant.
+
+Usage:
+    python -m app.migrations apply [--materialize] [--wait]
+    python -m app.migrations benchmark [--tenant t0] [--days 7]
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import clickhouse_connect
+
+logger = logging.getLogger(__name__)
+
+PROJECTIONS = {
+    "p_tenant_event_ts": "SELECT * ORDER BY (tenant_id, event, ts)",
+}
+
+SKIP_INDEXES = {
+    "idx_event": "event TYPE set(64) GRANULARITY 4",
+    "idx_utm_source": "utm_source TYPE bloom_filter(0.01) GRANULARITY 4",
+    "idx_utm_medium": "utm_medium TYPE bloom_filter(0.01) GRANULARITY 4",
+    "idx_utm_campaign": "utm_campaign TYPE bloom_filter(0.01) GRANULARITY 4",
+}
+
+# Representative query for each analytics endpoint
+BENCHMARK_QUERIES = {
+    "timeseries": """
+        SELECT toDate(ts) as period, count() as value
+        FROM events
+        WHERE tenant_id = {tenant_id:String}
+          AND ts >= {start_date:String} AND ts <= {end_date:String}
+          AND event = 'click'
+        GROUP BY period
+    """,
+    "funnel": """
+        SELECT count(DISTINCT session_id)
+        FROM events
+        WHERE tenant_id = {tenant_id:String}
+          AND ts >= {start_date:String} AND ts <= {end_date:String}
+          AND event = 'conversion'
+    """,
+    "summary": """
+        SELECT countIf(event = 'pageview'), countIf(event = 'click'), sum(revenue)
+        FROM events
+        WHERE tenant_id = {tenant_id:String}
+          AND ts >= {start_date:String} AND ts <= {end_date:String}
+    """,
+    "breakdown": """
+        SELECT utm_campaign, countIf(event = 'conversion') as conversions
+        FROM events
+        WHERE tenant_id = {tenant_id:String}
+          AND ts >= {start_date:String} AND ts <= {end_date:String}
+          AND utm_source = 'google'
+        GROUP BY utm_campaign
+    """,
+}
+
+# Settings that make ClickHouse ignore projections and skip indexes
+BASELINE_SETTINGS = {
+    "optimize_use_projections": 0,
+    "use_skip_indexes": 0,
+}
+
+
+def apply(client, materialize: bool = False, wait: bool = False):
+    """Add any missing projections and skip indexes to the events table.
+
+    New parts get them immediately; existing parts only after
+    materializing, which runs as a background mutation unless `wait`.
+    """
+    settings = {"mutations_sync": 1} if wait else None
+
+    for name, definition in PROJECTIONS.items():
+        client.command(f"ALTER TABLE events ADD PROJECTION IF NOT EXISTS {name} ({definition})")
+        logger.info(f"Projection {name} present")
+        if materialize:
+            client.command(f"ALTER TABLE events MATERIALIZE PROJECTION {name}", settings=settings)
+            logger.info(f"Projection {name} materialization started")
+
+    for name, definition in SKIP_INDEXES.items():
+        client.command(f"ALTER TABLE events ADD INDEX IF NOT EXISTS {name} {definition}")
+        logger.info(f"Index {name} present")
+        if materialize:
+            client.command(f"ALTER TABLE events MATERIALIZE INDEX {name}", settings=settings)
+            logger.info(f"Index {name} materialization started")
+
+
+def benchmark(client, tenant_id: str, days: int) -> List[Dict]:
+    """Compare read_rows/read_bytes of each endpoint query without and with the optimizations."""
+    params = {
+        "tenant_id": tenant_id,
+        "start_date": (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d"),
+        "end_date": datetime.utcnow().strftime("%Y-%m-%d"),
+    }
+
+    report = []
+    for endpoint, query in BENCHMARK_QUERIES.items():
+        row = {"endpoint": endpoint}
+        for label, settings in (("before", BASELINE_SETTINGS), ("after", {})):
+            started = time.perf_counter()
+            result = client.query(query, parameters=params, settings=settings)
+            row[label] = {
+                "read_rows": int(result.summary.get("read_rows", 0)),
+                "read_bytes": int(result.summary.get("read_bytes", 0)),
+                "ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+        report.append(row)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage events table projections and skip indexes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    apply_parser = subparsers.add_parser("apply", help="Add missing projections and indexes")
+    apply_parser.add_argument("--materialize", action="store_true", help="Build them for existing parts")
+    apply_parser.add_argument("--wait", action="store_true", help="Wait for materialization to finish")
+
+    bench_parser = subparsers.add_parser("benchmark", help="Compare read_rows before and after")
+    bench_parser.add_argument("--tenant", default="t0")
+    bench_parser.add_argument("--days", type=int, default=7)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    client = clickhouse_connect.get_client(
+        host=os.getenv("CLICKHOUSE_HOST", "clickhouse"),
+        port=int(os.getenv("CLICKHOUSE_PORT", "8123")),
+        database=os.getenv("CLICKHOUSE_DB", "analytics"),
+    )
+
+    if args.command == "apply":
+        apply(client, materialize=args.materialize, wait=args.wait)
+    else:
+        print(f"{'endpoint':<12} {'rows before':>14} {'rows after':>14} {'bytes before':>14} {'bytes after':>14}")
+        for row in benchmark(client, args.tenant, args.days):
+            print(
+                f"{row['endpoint']:<12} "
+                f"{row['before']['read_rows']:>14,} {row['after']['read_rows']:>14,} "
+                f"{row['before']['read_bytes']:>14,} {row['after']['read_bytes']:>14,}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Shared query building blocks for the analytics service."""
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+# Map granularity to ClickHouse bucketing expression
+INTERVAL_MAP = {
+    "h": "toStartOfHour(ts)",
+    "d": "toDate(ts)",
+    "w": "toMonday(ts)",
+}
+
+# Map count metrics to event names
+METRIC_EVENTS = {
+    "impressions": "impression",
+    "clicks": "click",
+    "conversions": "conversion",
+    "pageviews": "pageview",
+}
+
+
+def interval_for(granularity: str) -> str:
+    """Get the bucketing expression for a granularity (defaults to daily)."""
+    return INTERVAL_MAP.get(granularity, "toDate(ts)")
+
+
+def event_for(metric: str) -> str:
+    """Get the event name counted by a metric (defaults to pageview)."""
+    return METRIC_EVENTS.get(metric, "pageview")
+
+
+def default_range(
+    start_date: Optional[str],
+    end_date: Optional[str],
+    days: int,
+) -> Tuple[str, str]:
+    """Fill in a missing date range with the last `days` days."""
+    now = datetime.utcnow()
+    if not end_date:
+        end_date = now.strftime("%Y-%m-%d")
+    if not start_date:
+        start_date = (now - timedelta(days=days)).strftime("%Y-%m-%d")
+    return start_date, end_date
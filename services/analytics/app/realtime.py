@@ -0,0 +1,179 @@
+"""Reading and reconciling the real-time "today so far" counters.
+
+The attribution service bumps Redis counters on every collected event (see
+its app/realtime.py for the key layout). Reads here touch one small hash
+and two HyperLogLogs, so today's tiles never scan ClickHouse. A periodic
+reconciliation replaces settled minutes with ClickHouse's counts so lost
+or duplicated counter updates do not accumulate.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _day_key(tenant_id: str, day: datetime) -> str:
+    return f"rt:{tenant_id}:{day.strftime('%Y%m%d')}"
+
+
+def read_today(client, tenant_id: str, now: datetime, include_minutes: bool = False) -> Dict[str, Any]:
+    """Read today's totals (and optionally per-minute values) for a tenant."""
+    base = _day_key(tenant_id, now)
+
+    pipe = client.pipeline(transaction=False)
+    pipe.hgetall(base)
+    pipe.pfcount(f"{base}:sessions")
+    pipe.pfcount(f"{base}:users")
+    pipe.get(f"{base}:watermark")
+    if include_minutes:
+        pipe.hgetall(f"{base}:minutes")
+    results = pipe.execute()
+    totals, sessions, users, watermark = results[:4]
+
+    pageviews = int(totals.get(b"pageview", 0))
+    clicks = int(totals.get(b"click", 0))
+    conversions = int(totals.get(b"conversion", 0))
+
+    response = {
+        "pageviews": pageviews,
+        "clicks": clicks,
+        "conversions": conversions,
+        "revenue": round(float(totals.get(b"revenue", 0)), 2),
+        "sessions": sessions,
+        "users": users,
+        "ctr": round((clicks / max(pageviews, 1)) * 100, 2),
+        "cvr": round((conversions / max(clicks, 1)) * 100, 2),
+        "date": now.strftime("%Y-%m-%d"),
+        "reconciled_through": _format_minute(watermark.decode()) if watermark else None,
+    }
+
+    if include_minutes:
+        minutes: Dict[str, Dict[str, Any]] = {}
+        for field, value in results[4].items():
+            minute, name = field.decode().split(":", 1)
+            bucket = minutes.setdefault(minute, {"minute": _format_minute(minute)})
+            bucket[name] = float(value) if name == "revenue" else int(value)
+        response["minutes"] = [minutes[m] for m in sorted(minutes)]
+
+    return response
+
+
+def _format_minute(hhmm: str) -> str:
+    return f"{hhmm[:2]}:{hhmm[2:]}"
+
+
+def reconcile(redis_client, ch_client, now: datetime, settle_minutes: int, lock_seconds: int):
+    """Replace settled minutes of the counters with ClickHouse's counts.
+
+    Each tenant keeps a watermark (exclusive HHMM) of what has been
+    reconciled; only the minutes between it and `now - settle_minutes` are
+    queried. Counters are corrected by the difference, so increments made
+    while reconciling are not lost. The previous day's last minutes only
+    settle after midnight, so it is finished off once then.
+    """
+    # Only one replica reconciles per cycle
+    if not redis_client.set("rt:reconcile:lock", "1", nx=True, ex=lock_seconds):
+        return
+
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    settled_upto = (now - timedelta(minutes=settle_minutes)).replace(second=0, microsecond=0)
+
+    for day_start in (today - timedelta(days=1), today):
+        day_end = day_start + timedelta(days=1)
+        done_key = f"rt:reconciled:{day_start.strftime('%Y%m%d')}"
+        if day_start < today and redis_client.exists(done_key):
+            continue
+        upto = min(settled_upto, day_end)
+        if upto <= day_start:
+            continue
+        upto_hhmm = "2400" if upto == day_end else upto.strftime("%H%M")
+
+        failed = False
+        for raw_tenant in redis_client.smembers(f"rt:tenants:{day_start.strftime('%Y%m%d')}"):
+            tenant_id = raw_tenant.decode()
+            try:
+                _reconcile_tenant(redis_client, ch_client, tenant_id, day_start, upto, upto_hhmm)
+            except Exception as e:
+                failed = True
+                logger.error(f"Counter reconciliation failed for tenant {tenant_id}: {e}")
+        if upto == day_end and not failed:
+            redis_client.set(done_key, "1", ex=2 * 24 * 3600)
+
+
+def _reconcile_tenant(
+    redis_client,
+    ch_client,
+    tenant_id: str,
+    day_start: datetime,
+    upto: datetime,
+    upto_hhmm: str,
+):
+    """Reconcile one tenant's counters between its watermark and `upto`."""
+    base = _day_key(tenant_id, day_start)
+    watermark: Optional[bytes] = redis_client.get(f"{base}:watermark")
+    from_hhmm = watermark.decode() if watermark else "0000"
+    if from_hhmm >= upto_hhmm:
+        return
+
+    window_start = day_start + timedelta(hours=int(from_hhmm[:2]), minutes=int(from_hhmm[2:]))
+
+    result = ch_client.query(
+        """
+            SELECT
+                toHour(ts) as h,
+                toMinute(ts) as m,
+                event,
+                count() as events,
+                sum(revenue) as revenue
+            FROM events
+            WHERE tenant_id = {tenant_id:String}
+              AND ts >= {start:DateTime}
+              AND ts < {end:DateTime}
+            GROUP BY h, m, event
+        """,
+        parameters={"tenant_id": tenant_id, "start": window_start, "end": upto},
+    )
+
+    # Authoritative per-minute values from ClickHouse
+    settled: Dict[str, float] = {}
+    for h, m, event, events, revenue in result.result_rows:
+        minute = f"{h:02d}{m:02d}"
+        settled[f"{minute}:{event}"] = events
+        if revenue:
+            settled[f"{minute}:revenue"] = settled.get(f"{minute}:revenue", 0.0) + revenue
+
+    # What the counters currently hold for the same window
+    current = {
+        field.decode(): float(value)
+        for field, value in redis_client.hgetall(f"{base}:minutes").items()
+        if from_hhmm <= field.decode()[:4] < upto_hhmm
+    }
+
+    # Per-minute and total corrections, applied as increments so counts
+    # added since the read above are kept
+    minute_deltas: Dict[str, float] = {}
+    deltas: Dict[str, float] = {}
+    for field in set(settled) | set(current):
+        diff = settled.get(field, 0) - current.get(field, 0)
+        if diff:
+            minute_deltas[field] = diff
+            name = field.split(":", 1)[1]
+            deltas[name] = deltas.get(name, 0) + diff
+
+    pipe = redis_client.pipeline(transaction=True)
+    for field, diff in minute_deltas.items():
+        if field.endswith(":revenue"):
+            pipe.hincrbyfloat(f"{base}:minutes", field, diff)
+        else:
+            pipe.hincrby(f"{base}:minutes", field, int(diff))
+    for name, diff in deltas.items():
+        if name == "revenue":
+            pipe.hincrbyfloat(base, name, diff)
+        else:
+            pipe.hincrby(base, name, int(diff))
+    pipe.set(f"{base}:watermark", upto_hhmm, ex=2 * 24 * 3600)
+    pipe.execute()
+
+    if deltas:
+        logger.info(f"Reconciled counters for tenant {tenant_id}: {deltas}")
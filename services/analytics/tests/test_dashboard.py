@@ -0,0 +1,53 @@
+import asyncio
+import json
+
+import pandas as pd
+
+from app.dashboard import run_dashboard
+from app.serialize import json_response
+
+
+class FakeClient:
+    """Answers every timeseries scan with the same two points."""
+
+    def query_df(self, query, parameters=None, settings=None):
+        return pd.DataFrame({
+            "bucket": pd.to_datetime(["2024-01-01", "2024-01-02"]),
+            "period": ["2024-01-01", "2024-01-02"],
+            "m0": [3.0, 4.0],
+        })
+
+
+def _timeseries(widget_id):
+    return {
+        "id": widget_id,
+        "type": "timeseries",
+        "metric": "clicks",
+        "granularity": "d",
+        "steps": [],
+        "start_date": "2024-01-01",
+        "end_date": "2024-01-02",
+    }
+
+
+def test_widget_id_equal_to_a_marker_keeps_its_series():
+    marker = "\0" + "0" + "\0"
+    result = asyncio.run(run_dashboard(FakeClient(), "t0", [_timeseries(marker), _timeseries("w2")], 5000))
+    body = json.loads(json_response(result).body)
+
+    expected = [{"period": "2024-01-01", "value": 3.0}, {"period": "2024-01-02", "value": 4.0}]
+    assert [w["id"] for w in body["widgets"]] == [marker, "w2"]
+    assert [w["data"]["data"] for w in body["widgets"]] == [expected, expected]
+
+
+def test_dashboard_rejects_out_of_range_deadline():
+    from fastapi.testclient import TestClient
+
+    from app.dashboard import MAX_DEADLINE_MS
+    from app.main import app
+
+    client = TestClient(app)
+    widgets = [_timeseries("w1")]
+    for deadline_ms in (0, -5, MAX_DEADLINE_MS + 1):
+        response = client.post("/dashboard", json={"deadline_ms": deadline_ms, "widgets": widgets})
+        assert response.status_code == 422
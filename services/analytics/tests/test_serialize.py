@@ -0,0 +1,36 @@
+import json
+
+import pandas as pd
+
+from app.serialize import RawJSON, json_response, records_json, records_response
+
+
+def test_raw_values_are_spliced_in_place():
+    body = json.loads(json_response({
+        "widgets": [{"id": "w1", "data": RawJSON('[{"v": 1}]')}, {"id": "w2", "data": RawJSON("[]")}],
+    }).body)
+    assert body == {"widgets": [{"id": "w1", "data": [{"v": 1}]}, {"id": "w2", "data": []}]}
+
+
+def test_values_that_look_like_markers_are_left_alone():
+    # The placeholder strings an earlier version substituted into the body
+    for marker in ("\0" + "0" + "\0", "\\u00000\\u0000", '"\\u00000\\u0000"'):
+        body = json.loads(json_response({
+            "widgets": [{"id": marker, "data": RawJSON('[{"v": 1}]')}],
+        }).body)
+        assert body == {"widgets": [{"id": marker, "data": [{"v": 1}]}]}
+
+
+def test_plain_values_match_json_dumps():
+    payload = {"a": [1, 2.5, None, True], "b": {"c": "d\n\"e\""}, 3: "int key", "t": (1, 2)}
+    assert json.loads(json_response(payload).body) == json.loads(json.dumps(payload))
+
+
+def test_records_response_encodes_columns():
+    df = pd.DataFrame({"period": ["2024-01-01", "2024-01-02"], "value": [1.0, 2.5]})
+    body = json.loads(records_response({"metric": "clicks"}, df).body)
+    assert body == {
+        "metric": "clicks",
+        "data": [{"period": "2024-01-01", "value": 1.0}, {"period": "2024-01-02", "value": 2.5}],
+    }
+    assert json.loads(records_json(df)) == body["data"]
@@ -48,6 +48,7 @@ def init_db():
         event_inbox,
         attribution,
         audit_log,
+        tracking_link,
     )
 
     Base.metadata.create_all(bind=engine)
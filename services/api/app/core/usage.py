@@ -0,0 +1,80 @@
+"""Read the LLM usage ledger kept in Redis by the LLM router.
+
+The router counts prompt/completion tokens and cost (in micro-USD) per
+agent run (`llm_usage:run:{run_id}`) and per tenant and day
+(`llm_usage:tenant:{tenant_id}:{YYYY-MM-DD}`), plus the generations whose
+provider reported no token counts (`unaccounted_requests`).
+
+These helpers use the blocking Redis and database clients, so they are
+called from plain `def` endpoints, which FastAPI runs in its threadpool.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import redis
+from sqlalchemy import update
+
+from app.models.agent_run import AgentRun
+from .config import get_settings
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+
+
+def _totals(counters: Dict[str, str]) -> Dict[str, float]:
+    return {
+        "requests": int(counters.get("requests", 0)),
+        "prompt_tokens": int(counters.get("prompt_tokens", 0)),
+        "completion_tokens": int(counters.get("completion_tokens", 0)),
+        "cost": int(counters.get("cost_micros", 0)) / 1_000_000,
+        "unaccounted_requests": int(counters.get("unaccounted_requests", 0)),
+    }
+
+
+def sync_run_usage(agent_runs: List[AgentRun]):
+    """Copy ledger totals into AgentRun.tokens_used / cost, in one Redis round trip.
+
+    The loaded runs are updated in place and the changed rows are written
+    with one bulk UPDATE in a separate session, so the caller's objects are
+    not expired and reloaded one by one.
+    """
+    if not agent_runs:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for agent_run in agent_runs:
+            pipe.hgetall(f"llm_usage:run:{agent_run.id}")
+        results = pipe.execute()
+    except Exception as e:
+        logger.warning(f"Usage ledger unavailable: {e}")
+        return
+
+    changed = []
+    for agent_run, counters in zip(agent_runs, results):
+        if not counters:
+            continue
+        totals = _totals(counters)
+        tokens_used = totals["prompt_tokens"] + totals["completion_tokens"]
+        if tokens_used != agent_run.tokens_used or totals["cost"] != agent_run.cost:
+            agent_run.tokens_used = tokens_used
+            agent_run.cost = totals["cost"]
+            changed.append({"id": agent_run.id, "tokens_used": tokens_used, "cost": totals["cost"]})
+
+    if changed:
+        with SessionLocal() as session:
+            session.execute(update(AgentRun), changed)
+            session.commit()
+
+
+def get_tenant_usage(tenant_id: int, days: int) -> List[Dict[str, float]]:
+    """Daily usage for the last `days` days, oldest first."""
+    today = datetime.now(timezone.utc).date()
+    dates = [today - timedelta(days=offset) for offset in range(days - 1, -1, -1)]
+    pipe = redis_client.pipeline(transaction=False)
+    for day in dates:
+        pipe.hgetall(f"llm_usage:tenant:{tenant_id}:{day.isoformat()}")
+    return [{"date": day, **_totals(counters)} for day, counters in zip(dates, pipe.execute())]
@@ -11,6 +11,7 @@ from .agent_run import AgentRun
 from .event_inbox import EventInbox
 from .attribution import Attribution
 from .audit_log import AuditLog
+from .tracking_link import TrackingLink
 
 __all__ = [
     "Tenant",
@@ -25,4 +26,5 @@ __all__ = [
     "EventInbox",
     "Attribution",
     "AuditLog",
+    "TrackingLink",
 ]
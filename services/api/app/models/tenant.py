@@ -43,3 +43,6 @@ class Tenant(Base):
     audit_logs = relationship(
         "AuditLog", back_populates="tenant", cascade="all, delete-orphan"
     )
+    tracking_links = relationship(
+        "TrackingLink", back_populates="tenant", cascade="all, delete-orphan"
+    )
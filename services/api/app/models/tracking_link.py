@@ -0,0 +1,28 @@
+"""Tracking link model."""
+from sqlalchemy import Column, String, DateTime, Integer, ForeignKey, Boolean, Text
+from sqlalchemy.orm import relationship
+from datetime import datetime
+from app.core.database import Base
+
+
+class TrackingLink(Base):
+    """Redirect link served by the attribution service at /r/{id}."""
+
+    __tablename__ = "tracking_links"
+
+    id = Column(String, primary_key=True, index=True)  # Short link id used in the URL
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False, index=True)
+    campaign_id = Column(Integer, ForeignKey("campaigns.id"), nullable=True, index=True)
+    ad_id = Column(Integer, ForeignKey("ads.id"), nullable=True, index=True)
+    destination_url = Column(Text, nullable=False)
+    utm_source = Column(String, nullable=True)
+    utm_medium = Column(String, nullable=True)
+    utm_campaign = Column(String, nullable=True)
+    active = Column(Boolean, default=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
+
+    # Relationships
+    tenant = relationship("Tenant", back_populates="tracking_links")
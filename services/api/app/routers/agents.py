@@ -1,14 +1,15 @@
 """Agents router."""
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from typing import List
 import json
 from app.core.database import get_db
 from app.core.config import get_settings
+from app.core.usage import get_tenant_usage, sync_run_usage
 from app.auth.dependencies import require_auth
 from app.models.user import User
 from app.models.agent_run import AgentRun
-from app.schemas.agent import AgentRunRequest, AgentRunResponse, AgentConfig, AgentConfigUpdate
+from app.schemas.agent import AgentRunRequest, AgentRunResponse, AgentConfig, AgentConfigUpdate, LLMUsageDay
 
 router = APIRouter()
 settings = get_settings()
@@ -54,13 +55,16 @@ async def run_agent(
 
     # TODO: Trigger Celery task to execute agent
     # from app.tasks import run_agent_task
-    # run_agent_task.delay(agent_run.id)
+    # run_agent_task.delay(
+    #     agent_run.agent, request.context, agent_run.id, llm_provider,
+    #     tenant_id=agent_run.tenant_id,  # Required: LLM usage is recorded per tenant
+    # )
 
     return agent_run
 
 
 @router.get("/runs", response_model=List[AgentRunResponse])
-async def list_agent_runs(
+def list_agent_runs(
     current_user: User = Depends(require_auth),
     db: Session = Depends(get_db),
     agent: str = None,
@@ -74,11 +78,12 @@ async def list_agent_runs(
         query = query.filter(AgentRun.agent == agent)
 
     agent_runs = query.order_by(AgentRun.created_at.desc()).offset(skip).limit(limit).all()
+    sync_run_usage(agent_runs)
     return agent_runs
 
 
 @router.get("/runs/{run_id}", response_model=AgentRunResponse)
-async def get_agent_run(
+def get_agent_run(
     run_id: int,
     current_user: User = Depends(require_auth),
     db: Session = Depends(get_db),
@@ -99,9 +104,25 @@ async def get_agent_run(
             detail="Agent run not found"
         )
 
+    sync_run_usage([agent_run])
     return agent_run
 
 
+@router.get("/usage", response_model=List[LLMUsageDay])
+def get_llm_usage(
+    current_user: User = Depends(require_auth),
+    days: int = Query(30, ge=1, le=400),
+):
+    """Daily LLM token usage and cost for the current tenant."""
+    try:
+        return get_tenant_usage(current_user.tenant_id, days)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Usage ledger unavailable"
+        )
+
+
 @router.get("/config", response_model=List[AgentConfig])
 async def get_agent_configs(
     current_user: User = Depends(require_auth),
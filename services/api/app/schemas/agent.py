@@ -1,7 +1,7 @@
 """Agent schemas."""
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
-from datetime import datetime
+from datetime import date, datetime
 
 
 class AgentRunRequest(BaseModel):
@@ -46,3 +46,14 @@ class AgentConfigUpdate(BaseModel):
 
     enabled: Optional[bool] = None
     llm_provider: Optional[str] = None
+
+
+class LLMUsageDay(BaseModel):
+    """LLM usage of a tenant on one day."""
+
+    date: date
+    requests: int
+    prompt_tokens: int
+    completion_tokens: int
+    cost: float
+    unaccounted_requests: int = 0  # Generations without token counts, not in the totals
@@ -0,0 +1,65 @@
+"""Attribution models for distributing revenue across touchpoints."""
+from typing import Dict, List
+
+
+def calculate_attribution(touchpoints: List[Dict], revenue: float, model: str) -> Dict:
+    """Calculate attribution based on model."""
+    num_touchpoints = len(touchpoints)
+
+    if num_touchpoints == 0:
+        return {}
+
+    attribution = {}
+
+    if model == "last_touch":
+        # 100% to last touchpoint
+        last = touchpoints[-1]
+        key = f"{last['source']}_{last['campaign']}"
+        attribution[key] = revenue
+
+    elif model == "first_touch":
+        # 100% to first touchpoint
+        first = touchpoints[0]
+        key = f"{first['source']}_{first['campaign']}"
+        attribution[key] = revenue
+
+    elif model == "linear":
+        # Equal distribution
+        value_per_touch = revenue / num_touchpoints
+        for tp in touchpoints:
+            key = f"{tp['source']}_{tp['campaign']}"
+            attribution[key] = attribution.get(key, 0) + value_per_touch
+
+    elif model == "position_based":
+        # 40% first, 40% last, 20% distributed to middle
+        if num_touchpoints == 1:
+            key = f"{touchpoints[0]['source']}_{touchpoints[0]['campaign']}"
+            attribution[key] = revenue
+        elif num_touchpoints == 2:
+            for tp in touchpoints:
+                key = f"{tp['source']}_{tp['campaign']}"
+                attribution[key] = revenue * 0.5
+        else:
+            # First 40%
+            first = touchpoints[0]
+            key_first = f"{first['source']}_{first['campaign']}"
+            attribution[key_first] = revenue * 0.4
+
+            # Last 40%
+            last = touchpoints[-1]
+            key_last = f"{last['source']}_{last['campaign']}"
+            attribution[key_last] = attribution.get(key_last, 0) + revenue * 0.4
+
+            # Middle 20% distributed
+            middle_value = revenue * 0.2 / (num_touchpoints - 2)
+            for tp in touchpoints[1:-1]:
+                key = f"{tp['source']}_{tp['campaign']}"
+                attribution[key] = attribution.get(key, 0) + middle_value
+
+    else:
+        # Default to last touch
+        last = touchpoints[-1]
+        key = f"{last['source']}_{last['campaign']}"
+        attribution[key] = revenue
+
+    return attribution
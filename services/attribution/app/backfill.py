@@ -0,0 +1,294 @@
+"""Parallel historical attribution backfill.
+
+Recomputes attribution for every converting session by splitting the
+events table into (tenant, month) chunks, which line up with the monthly
+partitions, and processing the chunks in a process pool. Each worker
+streams session blocks from ClickHouse, attributes them and writes the
+results in bulk. Finished chunks are recorded per run, so an interrupted
+run picks up where it left off when started again with the same run id.
+
+Sessions are attributed within a month: a session whose events span a
+month boundary is attributed once per month it touched. Each session's
+credits are stored as one row holding a channel -> credit map, so a newer
+run replaces them whole even when the session's channels changed.
+
+Usage:
+    python -m app.backfill --model linear --workers 8 [--run-id ID]
+        [--tenant t0 ...] [--from 202401] [--to 202406]
+    python -m app.backfill --model linear --benchmark-workers 1,2,4,8 [--tenant t0 ...]
+"""
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import clickhouse_connect
+
+from app.attribution import calculate_attribution
+
+logger = logging.getLogger(__name__)
+
+INSERT_BATCH_ROWS = 50000
+
+RESULTS_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS attributed_revenue (
+        tenant_id String,
+        month UInt32,
+        model LowCardinality(String),
+        session_id String,
+        credits Map(String, Float64),
+        session_revenue Float64,
+        version UInt64
+    ) ENGINE = ReplacingMergeTree(version)
+    PARTITION BY month
+    ORDER BY (tenant_id, model, month, session_id)
+"""
+
+PROGRESS_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS attribution_backfill_progress (
+        run_id String,
+        tenant_id String,
+        month UInt32,
+        model LowCardinality(String),
+        sessions UInt64,
+        revenue Float64,
+        seconds Float64,
+        finished_at DateTime
+    ) ENGINE = ReplacingMergeTree(finished_at)
+    ORDER BY (run_id, tenant_id, month)
+"""
+
+RESULT_COLUMNS = [
+    "tenant_id", "month", "model", "session_id",
+    "credits", "session_revenue", "version",
+]
+
+# Converting sessions in one chunk, touchpoints in time order
+CHUNK_QUERY = """
+    SELECT
+        session_id,
+        arraySort(t -> t.1, groupArray((ts, utm_source, utm_campaign, event))) as path,
+        sum(revenue) as total_revenue
+    FROM events
+    WHERE tenant_id = {tenant_id:String}
+      AND toYYYYMM(ts) = {month:UInt32}
+    GROUP BY session_id
+    HAVING total_revenue > 0
+"""
+
+
+def get_client():
+    """Create a ClickHouse client from the service environment."""
+    return clickhouse_connect.get_client(
+        host=os.getenv("CLICKHOUSE_HOST", "clickhouse"),
+        port=int(os.getenv("CLICKHOUSE_PORT", "8123")),
+        database=os.getenv("CLICKHOUSE_DB", "analytics"),
+    )
+
+
+def plan_chunks(
+    client,
+    run_id: str,
+    tenants: Optional[List[str]],
+    month_from: Optional[int],
+    month_to: Optional[int],
+) -> List[Tuple[str, int, int]]:
+    """List the (tenant, month, rows) chunks still to process, largest first."""
+    query = """
+        SELECT tenant_id, toYYYYMM(ts) as month, count() as rows
+        FROM events
+        WHERE 1
+    """
+    params: Dict[str, Any] = {}
+    if tenants:
+        query += " AND tenant_id IN {tenants:Array(String)}"
+        params["tenants"] = tenants
+    if month_from:
+        query += " AND toYYYYMM(ts) >= {month_from:UInt32}"
+        params["month_from"] = month_from
+    if month_to:
+        query += " AND toYYYYMM(ts) <= {month_to:UInt32}"
+        params["month_to"] = month_to
+    query += " GROUP BY tenant_id, month"
+
+    chunks = client.query(query, parameters=params).result_rows
+
+    done = {
+        (tenant_id, month)
+        for tenant_id, month in client.query(
+            "SELECT tenant_id, month FROM attribution_backfill_progress FINAL WHERE run_id = {run_id:String}",
+            parameters={"run_id": run_id},
+        ).result_rows
+    }
+
+    # Largest chunks first keeps the pool busy until the end
+    pending = [c for c in chunks if (c[0], c[1]) not in done]
+    pending.sort(key=lambda c: c[2], reverse=True)
+    return pending
+
+
+def process_chunk(run_id: str, tenant_id: str, month: int, model: str, version: int) -> Dict[str, Any]:
+    """Attribute one (tenant, month) chunk and record it as done."""
+    started = time.perf_counter()
+    client = get_client()
+    batch: List[List[Any]] = []
+    sessions = 0
+    revenue = 0.0
+
+    with client.query_row_block_stream(
+        CHUNK_QUERY,
+        parameters={"tenant_id": tenant_id, "month": month},
+        # Unnamed tuples, so paths come back as tuples rather than dicts
+        settings={"enable_named_columns_in_function_tuple": 0},
+    ) as stream:
+        for block in stream:
+            for session_id, path, total_revenue in block:
+                touchpoints = [
+                    {"source": source, "campaign": campaign, "event": event}
+                    for _, source, campaign, event in path
+                    if source  # Only include touchpoints with UTM data
+                ]
+                if not touchpoints:
+                    continue
+
+                attribution = calculate_attribution(touchpoints, total_revenue, model)
+                batch.append([
+                    tenant_id, month, model, session_id,
+                    attribution, total_revenue, version,
+                ])
+                sessions += 1
+                revenue += total_revenue
+
+            if len(batch) >= INSERT_BATCH_ROWS:
+                client.insert("attributed_revenue", batch, column_names=RESULT_COLUMNS)
+                batch = []
+
+    if batch:
+        client.insert("attributed_revenue", batch, column_names=RESULT_COLUMNS)
+
+    seconds = time.perf_counter() - started
+    client.insert(
+        "attribution_backfill_progress",
+        [[run_id, tenant_id, month, model, sessions, revenue, seconds, datetime.utcnow()]],
+        column_names=[
+            "run_id", "tenant_id", "month", "model",
+            "sessions", "revenue", "seconds", "finished_at",
+        ],
+    )
+    client.close()
+
+    return {"tenant_id": tenant_id, "month": month, "sessions": sessions, "seconds": seconds}
+
+
+def run(
+    run_id: str,
+    model: str,
+    workers: int,
+    tenants: Optional[List[str]] = None,
+    month_from: Optional[int] = None,
+    month_to: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Run (or resume) a backfill across a process pool, returning its totals."""
+    client = get_client()
+    client.command(RESULTS_TABLE_DDL)
+    client.command(PROGRESS_TABLE_DDL)
+
+    chunks = plan_chunks(client, run_id, tenants, month_from, month_to)
+    client.close()
+
+    total_rows = sum(rows for _, _, rows in chunks)
+    logger.info(f"Backfill {run_id}: {len(chunks)} chunks, {total_rows:,} events, {workers} workers")
+    if not chunks:
+        return {"chunks": 0, "events": 0, "seconds": 0.0, "failed": 0}
+
+    # Newer runs win in the ReplacingMergeTree
+    version = time.time_ns()
+    started = time.perf_counter()
+    done_rows = 0
+    failed = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(process_chunk, run_id, tenant_id, month, model, version): (tenant_id, month, rows)
+            for tenant_id, month, rows in chunks
+        }
+        for i, future in enumerate(as_completed(futures), start=1):
+            tenant_id, month, rows = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                logger.error(f"Chunk {tenant_id}/{month} failed: {e}")
+                continue
+
+            done_rows += rows
+            elapsed = time.perf_counter() - started
+            rate = done_rows / elapsed if elapsed else 0
+            eta = (total_rows - done_rows) / rate if rate else 0
+            logger.info(
+                f"[{i}/{len(chunks)}] {tenant_id}/{month}: {result['sessions']:,} sessions "
+                f"in {result['seconds']:.1f}s ({rate:,.0f} events/s, ETA {eta:.0f}s)"
+            )
+
+    seconds = time.perf_counter() - started
+    if failed:
+        logger.warning(f"Backfill {run_id}: {failed} chunks failed; rerun with --run-id {run_id} to retry")
+    else:
+        logger.info(f"Backfill {run_id} complete in {seconds:.1f}s")
+    return {"chunks": len(chunks), "events": done_rows, "seconds": seconds, "failed": failed}
+
+
+def benchmark(
+    model: str,
+    worker_counts: List[int],
+    tenants: Optional[List[str]] = None,
+    month_from: Optional[int] = None,
+    month_to: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Run the same backfill once per worker count, each as a fresh run."""
+    stamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    report = []
+    for workers in worker_counts:
+        result = run(f"bench-{model}-{stamp}-w{workers}", model, workers, tenants, month_from, month_to)
+        report.append({"workers": workers, **result})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute historical attribution in parallel")
+    parser.add_argument("--model", default=os.getenv("ATTRIBUTION_DEFAULT_MODEL", "last_touch"))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--run-id", help="Resume a previous run (defaults to a new id)")
+    parser.add_argument("--tenant", action="append", dest="tenants", help="Limit to tenant (repeatable)")
+    parser.add_argument("--from", type=int, dest="month_from", help="First month, YYYYMM")
+    parser.add_argument("--to", type=int, dest="month_to", help="Last month, YYYYMM")
+    parser.add_argument(
+        "--benchmark-workers",
+        help="Instead, time a full run per worker count, e.g. 1,2,4,8",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.benchmark_workers:
+        counts = [int(w) for w in args.benchmark_workers.split(",")]
+        report = benchmark(args.model, counts, args.tenants, args.month_from, args.month_to)
+        base = report[0]["seconds"] or 1
+        print(f"{'workers':>7} {'chunks':>7} {'events':>12} {'seconds':>9} {'events/s':>12} {'speedup':>8}")
+        for row in report:
+            rate = row["events"] / row["seconds"] if row["seconds"] else 0
+            print(
+                f"{row['workers']:>7} {row['chunks']:>7} {row['events']:>12,} {row['seconds']:>9.1f} "
+                f"{rate:>12,.0f} {base / (row['seconds'] or 1):>7.2f}x"
+            )
+        return
+
+    run_id = args.run_id or f"{args.model}-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+    run(run_id, args.model, args.workers, args.tenants, args.month_from, args.month_to)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Incrementally maintained path transitions for flow (Sankey) analysis.
+
+Each session's last node per flow kind lives in a Redis hash that expires
+with the session. When an event moves a session to a new node, one
+(step, source -> target) transition is written to the `flow_transitions`
+SummingMergeTree, so flows across all sessions are read from pre-summed
+edges instead of re-walking raw events.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.enrich import parse_url
+
+# Transitions past this many steps into a session are not recorded
+MAX_FLOW_STEPS = 10
+
+ENTRY = "(entry)"
+
+FLOW_COLUMNS = ["tenant_id", "day", "kind", "step", "source", "target", "transitions"]
+
+FLOW_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS flow_transitions (
+        tenant_id String,
+        day Date,
+        kind LowCardinality(String),
+        step UInt8,
+        source String,
+        target String,
+        transitions UInt64
+    ) ENGINE = SummingMergeTree()
+    PARTITION BY toYYYYMM(day)
+    ORDER BY (tenant_id, kind, day, step, source, target)
+    TTL day + INTERVAL 400 DAY
+"""
+
+# Atomically move a session to a node, returning {previous node, step}
+# or nil if the session is already there or past MAX_FLOW_STEPS
+_ADVANCE_SCRIPT = """
+local prev = redis.call('HGET', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+if prev == ARGV[2] then
+    return nil
+end
+local step = redis.call('HINCRBY', KEYS[1], ARGV[1] .. ':step', 1)
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+if step > tonumber(ARGV[4]) then
+    return nil
+end
+return {prev or '', step}
+"""
+
+_advance = None
+
+
+def page_path(url: Optional[str]) -> str:
+    """Reduce a URL to its path so query strings don't split pages."""
+    if not url:
+        return ""
+    return parse_url(url)[0]
+
+
+def record_transitions(
+    client,
+    tenant_id: str,
+    session_id: str,
+    event: str,
+    utm_source: Optional[str],
+    url: Optional[str],
+    ts: datetime,
+    session_timeout: int,
+) -> List[List[Any]]:
+    """Advance a session's source and page flows, returning new transition rows."""
+    global _advance
+    if _advance is None:
+        _advance = client.register_script(_ADVANCE_SCRIPT)
+
+    nodes = {}
+    if utm_source:
+        nodes["source"] = utm_source
+    if event == "pageview" and url:
+        nodes["url"] = page_path(url)
+
+    rows = []
+    key = f"flow:{tenant_id}:{session_id}"
+    for kind, node in nodes.items():
+        moved = _advance(keys=[key], args=[kind, node, session_timeout, MAX_FLOW_STEPS])
+        if moved:
+            prev, step = moved
+            source = prev.decode() if isinstance(prev, bytes) else prev
+            rows.append([tenant_id, ts.date(), kind, step, source or ENTRY, node, 1])
+    return rows
+
+
+def build_sankey(rows: List[tuple]) -> Dict[str, Any]:
+    """Turn (step, source, target, count) edges into Sankey nodes and links.
+
+    Node ids carry their step so the graph stays acyclic even when a path
+    revisits a node.
+    """
+    nodes: Dict[str, Dict[str, Any]] = {}
+    links = []
+    for step, source, target, count in rows:
+        source_id = f"{step - 1}:{source}"
+        target_id = f"{step}:{target}"
+        nodes.setdefault(source_id, {"id": source_id, "name": source, "step": step - 1})
+        nodes.setdefault(target_id, {"id": target_id, "name": target, "step": step})
+        links.append({"source": source_id, "target": target_id, "value": count})
+    return {"nodes": list(nodes.values()), "links": links}
@@ -0,0 +1,172 @@
+"""In-memory tracking link table for the /r/{link_id} redirect.
+
+Links are defined in Postgres (`tracking_links`, owned by the API service)
+and copied into a dict that is swapped wholesale on every refresh, so a
+redirect is a single dict lookup with no I/O. Destination URLs have the
+link's UTM parameters merged in ahead of time so the landing page pixel
+still sees them.
+
+Usage (latency benchmark):
+    python -m app.links [--requests 50000] [--concurrency 64]
+"""
+import argparse
+import asyncio
+import logging
+import time
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import psycopg
+
+logger = logging.getLogger(__name__)
+
+LINKS_QUERY = """
+    SELECT id, tenant_id, destination_url, utm_source, utm_medium, utm_campaign
+    FROM tracking_links
+    WHERE active
+"""
+
+
+class Link(NamedTuple):
+    tenant_id: str
+    destination: str
+    utm_source: str
+    utm_medium: str
+    utm_campaign: str
+
+
+def with_utm(url: str, utm: Dict[str, str]) -> str:
+    """Add UTM parameters to a URL unless it already sets them."""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    present = {name for name, _ in query}
+    query += [(name, value) for name, value in utm.items() if value and name not in present]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class LinkTable:
+    """Snapshot of active tracking links, refreshed from Postgres."""
+
+    def __init__(self, dsn: str):
+        # SQLAlchemy-style DSNs carry the driver name, which libpq rejects
+        self.dsn = dsn.replace("postgresql+psycopg://", "postgresql://")
+        self.links: Dict[str, Link] = {}
+        self.refreshed_at: Optional[float] = None
+
+    def resolve(self, link_id: str) -> Optional[Link]:
+        return self.links.get(link_id)
+
+    def load(self, rows: List[tuple]):
+        """Replace the table with (id, tenant_id, url, source, medium, campaign) rows."""
+        links = {}
+        for link_id, tenant_id, url, utm_source, utm_medium, utm_campaign in rows:
+            utm = {
+                "utm_source": utm_source or "",
+                "utm_medium": utm_medium or "",
+                "utm_campaign": utm_campaign or "",
+            }
+            links[link_id] = Link(str(tenant_id), with_utm(url, utm), **utm)
+        # A single assignment, so readers never see a half-built table
+        self.links = links
+        self.refreshed_at = time.time()
+
+    def refresh(self):
+        with psycopg.connect(self.dsn) as conn:
+            rows = conn.execute(LINKS_QUERY).fetchall()
+        self.load(rows)
+        logger.info(f"Loaded {len(self.links)} tracking links")
+
+
+class _NullClient:
+    """Discards inserts so the benchmark times only the redirect path."""
+
+    def insert(self, *args, **kwargs):
+        pass
+
+
+async def _redirect_latency(app, path: str) -> float:
+    """Seconds from request to the 302 status line, via a raw ASGI call."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"user-agent", b"Mozilla/5.0 (iPhone) Mobile"), (b"referer", b"https://www.google.com/")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8085),
+    }
+    started = time.perf_counter()
+    responded = None
+    request_sent = False
+    finished = asyncio.Event()
+
+    async def receive():
+        # Like a server: the (empty) body once, then nothing until the
+        # response is complete, then a disconnect
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal responded
+        if message["type"] == "http.response.start" and responded is None:
+            responded = time.perf_counter()
+        elif message["type"] == "http.response.body" and not message.get("more_body", False):
+            finished.set()
+
+    await app(scope, receive, send)
+    return responded - started
+
+
+async def _benchmark(requests: int, concurrency: int, links: int) -> List[float]:
+    from app import main
+    from app.writer import BatchWriter
+
+    main.links.load([
+        (f"l{i}", "t0", f"https://shop.example.com/p/{i}", "google", "cpc", f"c{i % 20}")
+        for i in range(links)
+    ])
+    main.event_writer = BatchWriter(_NullClient(), "events", main.EVENT_COLUMNS)
+    main.flow_writer = BatchWriter(_NullClient(), "flow_transitions", main.FLOW_COLUMNS)
+
+    latencies: List[float] = []
+    per_worker = requests // concurrency
+
+    async def worker(offset: int):
+        for i in range(per_worker):
+            latencies.append(await _redirect_latency(main.app, f"/r/l{(offset + i) % links}"))
+
+    await asyncio.gather(*(worker(w * per_worker) for w in range(concurrency)))
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /r/{link_id} time to redirect")
+    parser.add_argument("--requests", type=int, default=50000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--links", type=int, default=10000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    started = time.perf_counter()
+    latencies = sorted(asyncio.run(_benchmark(args.requests, args.concurrency, args.links)))
+    elapsed = time.perf_counter() - started
+
+    def pct(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print(f"requests: {len(latencies):,} at {len(latencies) / elapsed:,.0f} req/s")
+    print(f"p50: {pct(0.50):.3f} ms  p95: {pct(0.95):.3f} ms  p99: {pct(0.99):.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
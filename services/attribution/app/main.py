@@ -1,13 +1,28 @@
 """Attribution Service for tracking and attribution."""
 from fastapi import FastAPI, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, RedirectResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict
-from datetime import datetime
+from typing import Optional, Dict
+from datetime import datetime, timedelta
 import clickhouse_connect
+import clickhouse_connect.common
+import redis
+import asyncio
 import json
 import logging
 import os
+import uuid
+from marketeer_shared.instrumentation import InstrumentedClient, instrument_app, set_tenant
+from app.attribution import calculate_attribution
+from app.enrich import ENRICHED_COLUMNS, ENRICHED_COLUMNS_DDL, UTM_PARAMS, enrich
+from app.flows import (
+    FLOW_COLUMNS, FLOW_TABLE_DDL, MAX_FLOW_STEPS, build_sankey, record_transitions,
+)
+from app.links import LinkTable
+from app.paths import build_paths_query
+from app.realtime import event_time, record_event
+from app.writer import BatchWriter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,9 +32,24 @@ logger = logging.getLogger(__name__)
 CLICKHOUSE_HOST = os.getenv("CLICKHOUSE_HOST", "clickhouse")
 CLICKHOUSE_PORT = int(os.getenv("CLICKHOUSE_PORT", "8123"))
 CLICKHOUSE_DB = os.getenv("CLICKHOUSE_DB", "analytics")
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+SESSION_TIMEOUT = int(os.getenv("ATTRIBUTION_SESSION_TIMEOUT", "1800"))
+POSTGRES_DSN = os.getenv("POSTGRES_DSN", "postgresql://postgres:example_change_me@db:5432/agentic")
+LINKS_REFRESH_SECONDS = int(os.getenv("LINKS_REFRESH_SECONDS", "30"))
+EVENT_BATCH_ROWS = int(os.getenv("EVENT_BATCH_ROWS", "1000"))
+EVENT_FLUSH_MS = int(os.getenv("EVENT_FLUSH_MS", "200"))
+EVENT_MAX_RETRIES = int(os.getenv("EVENT_MAX_RETRIES", "5"))
+EVENT_MAX_BUFFERED_ROWS = int(os.getenv("EVENT_MAX_BUFFERED_ROWS", "100000"))
+
+EVENT_COLUMNS = [
+    "tenant_id", "user_id", "session_id", "event", "ts",
+    "url", "ref", "utm_source", "utm_medium", "utm_campaign",
+    "revenue", "properties", *ENRICHED_COLUMNS,
+]
 
 # Create FastAPI app
 app = FastAPI(title="Attribution Service")
+instrument_app(app)
 
 # CORS
 app.add_middleware(
@@ -33,6 +63,16 @@ app.add_middleware(
 # ClickHouse client
 ch_client = None
 
+# Redis client for real-time counters
+redis_client = None
+
+# Batched writers for events and flow transitions
+event_writer = None
+flow_writer = None
+
+# Tracking links for /r/{link_id}
+links = LinkTable(POSTGRES_DSN)
+
 
 class Event(BaseModel):
     """Event schema."""
@@ -53,14 +93,26 @@ class Event(BaseModel):
 
 @app.on_event("startup")
 async def startup():
-    """Initialize ClickHouse connection."""
-    global ch_client
+    """Initialize ClickHouse and Redis connections."""
+    global ch_client, redis_client, event_writer, flow_writer
+
+    try:
+        redis_client = redis.from_url(REDIS_URL)
+        redis_client.ping()
+        logger.info("Redis connection established")
+    except Exception as e:
+        logger.warning(f"Redis connection failed: {e}")
+        redis_client = None
+
     try:
-        ch_client = clickhouse_connect.get_client(
+        # Without a session the writer threads and request handlers can
+        # run queries concurrently
+        clickhouse_connect.common.set_setting("autogenerate_session_id", False)
+        ch_client = InstrumentedClient(clickhouse_connect.get_client(
             host=CLICKHOUSE_HOST,
             port=CLICKHOUSE_PORT,
             database=CLICKHOUSE_DB,
-        )
+        ))
         logger.info("ClickHouse connection established")
 
         # Create events table if not exists
@@ -77,15 +129,54 @@ async def startup():
                 utm_medium String,
                 utm_campaign String,
                 revenue Float64,
-                properties String
+                properties String,
+                ref_host LowCardinality(String),
+                path String,
+                device LowCardinality(String)
             ) ENGINE = MergeTree()
             ORDER BY (tenant_id, session_id, ts)
         """)
+        for ddl in ENRICHED_COLUMNS_DDL:
+            ch_client.command(ddl)
         logger.info("Events table ready")
 
+        ch_client.command(FLOW_TABLE_DDL)
+        logger.info("Flow transitions table ready")
+
+        event_writer = BatchWriter(
+            ch_client, "events", EVENT_COLUMNS, EVENT_BATCH_ROWS, EVENT_FLUSH_MS,
+            EVENT_MAX_RETRIES, EVENT_MAX_BUFFERED_ROWS,
+        )
+        event_writer.start()
+        flow_writer = BatchWriter(
+            ch_client, "flow_transitions", FLOW_COLUMNS, EVENT_BATCH_ROWS, EVENT_FLUSH_MS,
+            EVENT_MAX_RETRIES, EVENT_MAX_BUFFERED_ROWS,
+        )
+        flow_writer.start()
+
     except Exception as e:
         logger.error(f"Failed to connect to ClickHouse: {e}")
 
+    asyncio.create_task(refresh_links())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Flush buffered events and flow transitions."""
+    for writer in (event_writer, flow_writer):
+        if writer:
+            await asyncio.to_thread(writer.close)
+
+
+async def refresh_links():
+    """Periodically reload tracking links from Postgres."""
+    while True:
+        try:
+            await asyncio.to_thread(links.refresh)
+        except Exception as e:
+            logger.error(f"Failed to refresh tracking links: {e}")
+        await asyncio.sleep(LINKS_REFRESH_SECONDS)
+
 
 @app.get("/health")
 async def health_check():
@@ -93,54 +184,118 @@ async def health_check():
     return {
         "status": "healthy",
         "clickhouse": ch_client is not None,
+        "redis": redis_client is not None,
+        "links": len(links.links),
     }
 
 
 @app.post("/collect")
-async def collect_event(event: Event, bg: BackgroundTasks):
+async def collect_event(event: Event, request: Request, bg: BackgroundTasks):
     """Collect tracking event."""
     # Set timestamp if not provided
     if not event.ts:
         event.ts = datetime.utcnow().isoformat()
 
     # Write event to ClickHouse in background
-    bg.add_task(write_event, event)
+    set_tenant(event.tenant_id)
+    bg.add_task(write_event, event, request.headers.get("user-agent", ""))
 
     return {"ok": True, "event": event.event}
 
 
-def write_event(event: Event):
-    """Write event to ClickHouse."""
-    if not ch_client:
-        logger.error("ClickHouse client not initialized")
-        return
+def write_event(event: Event, user_agent: str = ""):
+    """Enrich an event, write it to ClickHouse and bump the real-time counters."""
+    enriched = enrich(event.url, event.ref, user_agent)
 
-    try:
-        ch_client.insert(
-            "events",
-            [[
+    # Fall back to UTM parameters in the page URL
+    for name in UTM_PARAMS:
+        if not getattr(event, name) and name in enriched:
+            setattr(event, name, enriched[name])
+
+    # clickhouse-connect writes DateTime columns from datetimes, not strings
+    ts = event_time(event.ts)
+
+    transitions = []
+    if redis_client:
+        try:
+            record_event(
+                redis_client,
+                event.tenant_id,
+                event.event,
+                event.sid,
+                event.user_id,
+                event.value or 0.0,
+                ts,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to update real-time counters: {e}")
+
+        try:
+            transitions = record_transitions(
+                redis_client,
                 event.tenant_id,
-                event.user_id or "",
                 event.sid,
                 event.event,
-                event.ts,
-                event.url or "",
-                event.ref or "",
-                event.utm_source or "",
-                event.utm_medium or "",
-                event.utm_campaign or "",
-                event.value,
-                json.dumps(event.props),
-            ]],
-            column_names=[
-                "tenant_id", "user_id", "session_id", "event", "ts",
-                "url", "ref", "utm_source", "utm_medium", "utm_campaign",
-                "revenue", "properties"
-            ],
-        )
-        logger.info(f"Event written: {event.event} for session {event.sid}")
-    except Exception as e:
-        logger.error(f"Failed to write event: {e}")
+                event.utm_source,
+                event.url,
+                ts,
+                SESSION_TIMEOUT,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to track flow transitions: {e}")
+
+    if not event_writer:
+        logger.error("ClickHouse client not initialized")
+        return
+
+    event_writer.add([
+        event.tenant_id,
+        event.user_id or "",
+        event.sid,
+        event.event,
+        ts,
+        event.url or "",
+        event.ref or "",
+        event.utm_source or "",
+        event.utm_medium or "",
+        event.utm_campaign or "",
+        event.value,
+        json.dumps(event.props),
+        *(enriched[column] for column in ENRICHED_COLUMNS),
+    ])
+
+    if flow_writer:
+        for transition in transitions:
+            flow_writer.add(transition)
+
+
+@app.get("/r/{link_id}")
+async def redirect_link(link_id: str, request: Request, bg: BackgroundTasks):
+    """Redirect a tracking link to its destination and record the click.
+
+    The click is written after the 302 has been sent, so the redirect
+    itself only costs a dict lookup.
+    """
+    link = links.resolve(link_id)
+    if not link:
+        return JSONResponse({"error": f"Unknown link: {link_id}"}, status_code=404)
+
+    event = Event(
+        event="click",
+        sid=request.query_params.get("sid") or uuid.uuid4().hex,
+        tenant_id=link.tenant_id,
+        ts=datetime.utcnow().isoformat(),
+        url=link.destination,
+        ref=request.headers.get("referer"),
+        utm_source=link.utm_source,
+        utm_medium=link.utm_medium,
+        utm_campaign=link.utm_campaign,
+        props={"link_id": link_id},
+    )
+    set_tenant(link.tenant_id)
+    bg.add_task(write_event, event, request.headers.get("user-agent", ""))
+
+    return RedirectResponse(link.destination, status_code=302)
 
 
 @app.get("/paths")
@@ -149,37 +304,21 @@ async def get_attribution_paths(
     session_id: Optional[str] = None,
     model: str = "last_touch",
     limit: int = 100,
+    source: str = "rollup",  # rollup, events
 ):
-    """Get attribution paths for sessions."""
+    """Get attribution paths for sessions.
+
+    Paths are read from the `session_paths` rollup, touching only sessions
+    that converted; `source=events` re-aggregates raw events instead.
+    """
     if not ch_client:
         return {"error": "ClickHouse not available"}
 
     try:
-        # Build query
-        query = """
-            SELECT
-                session_id,
-                groupArray(event) as events,
-                groupArray(utm_source) as sources,
-                groupArray(utm_campaign) as campaigns,
-                sum(revenue) as total_revenue
-            FROM events
-            WHERE tenant_id = {tenant_id:String}
-        """
-
-        params = {"tenant_id": tenant_id}
-
+        params = {"tenant_id": tenant_id, "limit": limit}
         if session_id:
-            query += " AND session_id = {session_id:String}"
             params["session_id"] = session_id
-
-        query += """
-            GROUP BY session_id
-            HAVING total_revenue > 0
-            ORDER BY total_revenue DESC
-            LIMIT {limit:UInt32}
-        """
-        params["limit"] = limit
+        query = build_paths_query("events" if source == "events" else "rollup", bool(session_id))
 
         result = ch_client.query(query, parameters=params)
 
@@ -217,67 +356,76 @@ async def get_attribution_paths(
         return {"error": str(e)}
 
 
-def calculate_attribution(touchpoints: List[Dict], revenue: float, model: str) -> Dict:
-    """Calculate attribution based on model."""
-    num_touchpoints = len(touchpoints)
-
-    if num_touchpoints == 0:
-        return {}
-
-    attribution = {}
-
-    if model == "last_touch":
-        # 100% to last touchpoint
-        last = touchpoints[-1]
-        key = f"{last['source']}_{last['campaign']}"
-        attribution[key] = revenue
-
-    elif model == "first_touch":
-        # 100% to first touchpoint
-        first = touchpoints[0]
-        key = f"{first['source']}_{first['campaign']}"
-        attribution[key] = revenue
-
-    elif model == "linear":
-        # Equal distribution
-        value_per_touch = revenue / num_touchpoints
-        for tp in touchpoints:
-            key = f"{tp['source']}_{tp['campaign']}"
-            attribution[key] = attribution.get(key, 0) + value_per_touch
-
-    elif model == "position_based":
-        # 40% first, 40% last, 20% distributed to middle
-        if num_touchpoints == 1:
-            key = f"{touchpoints[0]['source']}_{touchpoints[0]['campaign']}"
-            attribution[key] = revenue
-        elif num_touchpoints == 2:
-            for tp in touchpoints:
-                key = f"{tp['source']}_{tp['campaign']}"
-                attribution[key] = revenue * 0.5
-        else:
-            # First 40%
-            first = touchpoints[0]
-            key_first = f"{first['source']}_{first['campaign']}"
-            attribution[key_first] = revenue * 0.4
-
-            # Last 40%
-            last = touchpoints[-1]
-            key_last = f"{last['source']}_{last['campaign']}"
-            attribution[key_last] = attribution.get(key_last, 0) + revenue * 0.4
-
-            # Middle 20% distributed
-            middle_value = revenue * 0.2 / (num_touchpoints - 2)
-            for tp in touchpoints[1:-1]:
-                key = f"{tp['source']}_{tp['campaign']}"
-                attribution[key] = attribution.get(key, 0) + middle_value
-
-    else:
-        # Default to last touch
-        last = touchpoints[-1]
-        key = f"{last['source']}_{last['campaign']}"
-        attribution[key] = revenue
-
-    return attribution
+@app.get("/flow")
+async def get_flow(
+    tenant_id: str = "t0",
+    kind: str = "source",  # source, url
+    steps: int = 3,
+    limit: int = 20,
+    min_count: int = 5,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+):
+    """Get the top transitions between sources or pages as a Sankey graph.
+
+    Edges seen fewer than `min_count` times are pruned, and only the
+    `limit` heaviest edges are kept at each step.
+    """
+    if not ch_client:
+        return {"error": "ClickHouse not available"}
+
+    if kind not in ("source", "url"):
+        return {"error": f"Invalid kind: {kind}"}
+
+    # Default to last 30 days
+    if not end_date:
+        end_date = datetime.utcnow().strftime("%Y-%m-%d")
+    if not start_date:
+        start_date = (datetime.utcnow() - timedelta(days=30)).strftime("%Y-%m-%d")
+
+    try:
+        query = """
+            SELECT
+                step,
+                source,
+                target,
+                sum(transitions) as weight
+            FROM flow_transitions
+            WHERE tenant_id = {tenant_id:String}
+              AND kind = {kind:String}
+              AND day >= toDate({start_date:String})
+              AND day <= toDate({end_date:String})
+              AND step <= {steps:UInt8}
+            GROUP BY step, source, target
+            HAVING weight >= {min_count:UInt64}
+            ORDER BY step, weight DESC
+            LIMIT {limit:UInt32} BY step
+        """
+
+        params = {
+            "tenant_id": tenant_id,
+            "kind": kind,
+            "start_date": start_date,
+            "end_date": end_date,
+            "steps": max(1, min(steps, MAX_FLOW_STEPS)),
+            "min_count": max(1, min_count),
+            "limit": max(1, limit),
+        }
+
+        result = ch_client.query(query, parameters=params)
+
+        flow = build_sankey(result.result_rows)
+        flow.update({
+            "kind": kind,
+            "steps": params["steps"],
+            "start_date": start_date,
+            "end_date": end_date,
+        })
+        return flow
+
+    except Exception as e:
+        logger.error(f"Failed to get flow: {e}")
+        return {"error": str(e)}
 
 
 @app.get("/pixel.js")
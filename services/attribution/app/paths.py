@@ -0,0 +1,122 @@
+"""Attribution path queries.
+
+Paths are read from the `session_paths` rollup, which keeps one
+touchpoint state per session, and only the states of sessions that
+converted are merged. The raw-events query is kept for comparison.
+
+Usage (benchmark):
+    python -m app.paths [--tenant t0] [--limit 100]
+"""
+import argparse
+import time
+from typing import Any, Dict, List, Optional
+
+SOURCES = ("events", "rollup")
+
+
+def build_paths_query(source: str, by_session: bool) -> str:
+    """Top converting session paths as (session_id, events, sources, campaigns, total_revenue)."""
+    session_filter = " AND session_id = {session_id:String}" if by_session else ""
+
+    if source == "events":
+        query = f"""
+            SELECT
+                session_id,
+                groupArray(event) as events,
+                groupArray(utm_source) as sources,
+                groupArray(utm_campaign) as campaigns,
+                sum(revenue) as total_revenue
+            FROM events
+            WHERE tenant_id = {{tenant_id:String}}
+              {session_filter}
+        """
+    else:
+        # Only merge the touchpoint states of sessions that converted
+        query = f"""
+            WITH arraySort(t -> t.1, groupArrayMerge(touchpoints)) as path
+            SELECT
+                session_id,
+                arrayMap(t -> t.2, path) as events,
+                arrayMap(t -> t.3, path) as sources,
+                arrayMap(t -> t.4, path) as campaigns,
+                sumMerge(revenue) as total_revenue
+            FROM session_paths
+            WHERE tenant_id = {{tenant_id:String}}
+              AND session_id IN (
+                  SELECT session_id
+                  FROM session_paths
+                  WHERE tenant_id = {{tenant_id:String}}
+                    AND converted = 1
+                    {session_filter}
+              )
+              {session_filter}
+        """
+
+    return query + """
+        GROUP BY session_id
+        HAVING total_revenue > 0
+        ORDER BY total_revenue DESC
+        LIMIT {limit:UInt32}
+    """
+
+
+def _comparable(rows) -> List[tuple]:
+    """Rows with touchpoints as a sorted multiset: raw groupArray order is arbitrary."""
+    return [
+        (sid, sorted(zip(events, sources, campaigns)), round(revenue, 2))
+        for sid, events, sources, campaigns, revenue in rows
+    ]
+
+
+def benchmark(client, tenant_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+    """Compare /paths from raw events and from the rollup, for the top paths and for one session."""
+    report = []
+    session_id: Optional[str] = None
+    for label in ("top paths", "one session"):
+        params = {"tenant_id": tenant_id, "limit": limit}
+        if label == "one session":
+            if session_id is None:
+                break
+            params["session_id"] = session_id
+
+        row = {"query": label}
+        for source in SOURCES:
+            started = time.perf_counter()
+            result = client.query(build_paths_query(source, "session_id" in params), parameters=params)
+            row[source] = {
+                "read_rows": int(result.summary.get("read_rows", 0)),
+                "read_bytes": int(result.summary.get("read_bytes", 0)),
+                "ms": round((time.perf_counter() - started) * 1000, 1),
+                "rows": _comparable(result.result_rows),
+            }
+        events_rows = row["events"].pop("rows")
+        row["sessions"] = len(events_rows)
+        row["same_sessions"] = events_rows == row["rollup"].pop("rows")
+        report.append(row)
+
+        if session_id is None and events_rows:
+            session_id = events_rows[0][0]
+    return report
+
+
+def main():
+    from app.backfill import get_client
+
+    parser = argparse.ArgumentParser(description="Compare /paths from raw events and from the session_paths rollup")
+    parser.add_argument("--tenant", default="t0")
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{'query':<12} {'source':<7} {'ms':>9} {'read_rows':>12} {'read_bytes':>14}")
+    for row in benchmark(get_client(), args.tenant, args.limit):
+        for source in SOURCES:
+            stats = row[source]
+            print(
+                f"{row['query']:<12} {source:<7} {stats['ms']:>9.1f} "
+                f"{stats['read_rows']:>12,} {stats['read_bytes']:>14,}"
+            )
+        print(f"{'':<12} {row['sessions']} session(s), same in both: {row['same_sessions']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Real-time "today so far" counters kept in Redis.
+
+Every collected event bumps a handful of counters so the analytics
+service can serve today's tiles without scanning ClickHouse. Key layout
+(read and reconciled by the analytics service):
+
+    rt:{tenant}:{day}           hash of day totals: {event} -> count, revenue -> sum
+    rt:{tenant}:{day}:minutes   hash of per-minute values: {HHMM}:{event}, {HHMM}:revenue
+    rt:{tenant}:{day}:sessions  HyperLogLog of session ids
+    rt:{tenant}:{day}:users     HyperLogLog of user ids
+    rt:tenants:{day}            set of tenants active that day
+"""
+from datetime import datetime, timezone
+from typing import Optional
+
+# Keep yesterday's counters around until the day has been reconciled
+COUNTER_TTL = 2 * 24 * 3600
+
+
+def event_time(ts: Optional[str]) -> datetime:
+    """Parse an event timestamp into naive UTC, falling back to now."""
+    try:
+        parsed = datetime.fromisoformat(ts)
+    except (TypeError, ValueError):
+        return datetime.utcnow()
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def record_event(
+    client,
+    tenant_id: str,
+    event: str,
+    session_id: str,
+    user_id: Optional[str],
+    revenue: float,
+    ts: datetime,
+):
+    """Bump the day and minute counters for one event in a single round-trip."""
+    day = ts.strftime("%Y%m%d")
+    minute = ts.strftime("%H%M")
+    base = f"rt:{tenant_id}:{day}"
+
+    pipe = client.pipeline(transaction=False)
+    pipe.hincrby(base, event, 1)
+    pipe.hincrby(f"{base}:minutes", f"{minute}:{event}", 1)
+    if revenue:
+        pipe.hincrbyfloat(base, "revenue", revenue)
+        pipe.hincrbyfloat(f"{base}:minutes", f"{minute}:revenue", revenue)
+    pipe.pfadd(f"{base}:sessions", session_id)
+    if user_id:
+        pipe.pfadd(f"{base}:users", user_id)
+    pipe.sadd(f"rt:tenants:{day}", tenant_id)
+
+    for key in (base, f"{base}:minutes", f"{base}:sessions", f"{base}:users", f"rt:tenants:{day}"):
+        pipe.expire(key, COUNTER_TTL)
+    pipe.execute()
@@ -0,0 +1,109 @@
+"""Batched ClickHouse writer for collected events.
+
+Request handlers only append a row to an in-memory buffer; a background
+thread inserts the buffer as one block when it reaches `max_rows` or every
+`flush_ms`, whichever comes first. One insert per batch instead of one per
+event keeps ClickHouse from creating a part per row and keeps the insert
+round trip off the request path.
+
+A failed batch is kept and retried ahead of newer rows with exponential
+backoff. Rows are only dropped after `max_retries` failed inserts in a
+row, or when more than `max_buffered_rows` pile up while ClickHouse is
+unreachable (oldest first).
+"""
+import logging
+import threading
+import time
+from typing import Any, List
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    """Buffers rows for one table and inserts them in batches."""
+
+    def __init__(
+        self,
+        client,
+        table: str,
+        column_names: List[str],
+        max_rows: int = 1000,
+        flush_ms: int = 200,
+        max_retries: int = 5,
+        max_buffered_rows: int = 100000,
+    ):
+        self.client = client
+        self.table = table
+        self.column_names = column_names
+        self.max_rows = max_rows
+        self.flush_interval = flush_ms / 1000
+        self.max_retries = max_retries
+        self.max_buffered_rows = max_buffered_rows
+        self.dropped = 0
+        self._rows: List[List[Any]] = []
+        # Rows from failed inserts, only touched by the flushing thread
+        self._failed: List[List[Any]] = []
+        self._attempts = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"batch-writer-{table}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def add(self, row: List[Any]):
+        """Queue a row; never blocks on ClickHouse."""
+        with self._lock:
+            self._rows.append(row)
+            full = len(self._rows) >= self.max_rows
+        if full:
+            self._wake.set()
+
+    def close(self):
+        """Stop the flush thread and write whatever is still buffered."""
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout=10)
+        self.flush(force=True)
+
+    def flush(self, force: bool = False):
+        """Insert buffered rows; while backing off from a failure, wait unless `force`."""
+        if self._failed and not force and time.monotonic() < self._retry_at:
+            return
+        with self._lock:
+            rows, self._rows = self._rows, []
+        rows = self._failed + rows
+        self._failed = []
+        if not rows:
+            return
+        try:
+            self.client.insert(self.table, rows, column_names=self.column_names)
+            self._attempts = 0
+        except Exception as e:
+            self._attempts += 1
+            if self._attempts > self.max_retries:
+                self.dropped += len(rows)
+                self._attempts = 0
+                logger.error(f"Dropping {len(rows)} rows for {self.table} after {self.max_retries + 1} failed inserts: {e}")
+                return
+
+            overflow = len(rows) - self.max_buffered_rows
+            if overflow > 0:
+                self.dropped += overflow
+                rows = rows[overflow:]
+                logger.error(f"Dropping {overflow} oldest rows for {self.table}: buffer full")
+            self._failed = rows
+            backoff = min(self.flush_interval * 2 ** self._attempts, 30.0)
+            self._retry_at = time.monotonic() + backoff
+            logger.warning(
+                f"Failed to write {len(rows)} rows to {self.table} "
+                f"(attempt {self._attempts}), retrying in {backoff:.1f}s: {e}"
+            )
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
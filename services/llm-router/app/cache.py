@@ -0,0 +1,196 @@
+"""Two-tier response cache: an in-process LRU in front of Redis.
+
+Responses are stored as zstd-compressed JSON envelopes that carry their
+own freshness deadline. The local tier is bounded by the total size of
+those compressed blobs; the Redis tier uses the async client so lookups
+never block the event loop. Each entry stays fresh for its TTL and is then
+served stale for `stale_seconds` while the caller refreshes it in the
+background (stale-while-revalidate).
+
+TTLs come from policies like "openai:86400,local:3600,CreativeAgent:1800".
+An agent's policy wins over its provider's, which wins over the default.
+"""
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import zstandard
+
+from app.metrics import CACHE_LATENCY, CACHE_LOCAL_BYTES, CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+def parse_ttl_policies(spec: str) -> Dict[str, int]:
+    """Parse "name:seconds" pairs into a dict."""
+    return {
+        name.strip(): int(seconds)
+        for name, seconds in (pair.split(":", 1) for pair in spec.split(",") if ":" in pair)
+    }
+
+
+class LocalLRU:
+    """LRU of compressed blobs, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        blob, expires_at = entry
+        if expires_at <= time.time():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return blob
+
+    def set(self, key: str, blob: bytes, expires_at: float):
+        if len(blob) > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (blob, expires_at)
+        self.bytes += len(blob)
+        while self.bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+        CACHE_LOCAL_BYTES.set(self.bytes)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[0])
+
+
+class ResponseCache:
+    """Get and set generated responses across the local and Redis tiers."""
+
+    def __init__(
+        self,
+        redis_client,
+        default_ttl: int,
+        ttl_policies: Dict[str, int],
+        stale_seconds: int = 300,
+        local_max_bytes: int = 64 * 1024 * 1024,
+        compression_level: int = 3,
+    ):
+        self.redis = redis_client
+        self.default_ttl = default_ttl
+        self.ttl_policies = ttl_policies
+        self.stale_seconds = stale_seconds
+        self.local = LocalLRU(local_max_bytes)
+        self._compressor = zstandard.ZstdCompressor(level=compression_level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def ttl_for(self, provider: Optional[str], agent: Optional[str]) -> int:
+        for name in (agent, provider):
+            if name and name in self.ttl_policies:
+                return self.ttl_policies[name]
+        return self.default_ttl
+
+    def _decode(self, blob: bytes) -> Tuple[Dict[str, Any], float]:
+        """(response, fresh_until) from a stored envelope."""
+        envelope = json.loads(self._decompressor.decompress(blob))
+        return envelope["response"], envelope["fresh_until"]
+
+    def _from_redis(self, key: str, blob: Optional[bytes]) -> Optional[Tuple[Dict[str, Any], bool]]:
+        """Decode a Redis lookup and keep fresh entries in the local tier."""
+        if blob is None:
+            CACHE_REQUESTS.labels("redis", "miss").inc()
+            return None
+        try:
+            response, fresh_until = self._decode(blob)
+        except Exception as e:
+            # e.g. an uncompressed entry written before this cache format
+            logger.warning(f"Discarding unreadable cache entry: {e}")
+            CACHE_REQUESTS.labels("redis", "miss").inc()
+            return None
+
+        stale = fresh_until <= time.time()
+        CACHE_REQUESTS.labels("redis", "stale" if stale else "hit").inc()
+        if not stale:
+            # Expires locally when Redis drops it, as set() wrote it
+            self.local.set(key, blob, fresh_until + self.stale_seconds)
+        return response, stale
+
+    async def get(self, key: str) -> Optional[Tuple[Dict[str, Any], bool]]:
+        """Return (response, is_stale), or None on a miss."""
+        started = time.perf_counter()
+        blob = self.local.get(key)
+        if blob is not None:
+            response, fresh_until = self._decode(blob)
+            stale = fresh_until <= time.time()
+            CACHE_REQUESTS.labels("local", "stale" if stale else "hit").inc()
+            CACHE_LATENCY.labels("local").observe(time.perf_counter() - started)
+            return response, stale
+        CACHE_REQUESTS.labels("local", "miss").inc()
+
+        if not self.redis:
+            return None
+
+        started = time.perf_counter()
+        try:
+            blob = await self.redis.get(key)
+        except Exception as e:
+            logger.warning(f"Cache lookup failed: {e}")
+            return None
+        finally:
+            CACHE_LATENCY.labels("redis").observe(time.perf_counter() - started)
+        return self._from_redis(key, blob)
+
+    async def get_many(self, keys: List[str]) -> List[Optional[Tuple[Dict[str, Any], bool]]]:
+        """Like get() for each key, with one MGET for everything the local tier misses."""
+        results: List[Optional[Tuple[Dict[str, Any], bool]]] = [None] * len(keys)
+        remote = []
+        started = time.perf_counter()
+        for i, key in enumerate(keys):
+            blob = self.local.get(key)
+            if blob is None:
+                CACHE_REQUESTS.labels("local", "miss").inc()
+                remote.append(i)
+                continue
+            response, fresh_until = self._decode(blob)
+            results[i] = response, fresh_until <= time.time()
+            CACHE_REQUESTS.labels("local", "stale" if results[i][1] else "hit").inc()
+        CACHE_LATENCY.labels("local").observe(time.perf_counter() - started)
+
+        if not remote or not self.redis:
+            return results
+
+        started = time.perf_counter()
+        try:
+            blobs = await self.redis.mget([keys[i] for i in remote])
+        except Exception as e:
+            logger.warning(f"Cache lookup failed: {e}")
+            return results
+        finally:
+            CACHE_LATENCY.labels("redis").observe(time.perf_counter() - started)
+
+        for i, blob in zip(remote, blobs):
+            results[i] = self._from_redis(keys[i], blob)
+        return results
+
+    async def get_fresh(self, key: str) -> Optional[Dict[str, Any]]:
+        cached = await self.get(key)
+        if cached is None or cached[1]:
+            return None
+        return cached[0]
+
+    async def set(self, key: str, response: Dict[str, Any], provider: Optional[str], agent: Optional[str]):
+        ttl = self.ttl_for(provider, agent)
+        now = time.time()
+        blob = self._compressor.compress(json.dumps({"response": response, "fresh_until": now + ttl}).encode())
+
+        # Keep entries around past their TTL so they can be served stale
+        self.local.set(key, blob, now + ttl + self.stale_seconds)
+        if self.redis:
+            try:
+                await self.redis.set(key, blob, ex=ttl + self.stale_seconds)
+            except Exception as e:
+                logger.warning(f"Cache write failed: {e}")
+
@@ -29,6 +29,12 @@ class Settings(BaseSettings):
     OPENAI_MODEL: str = "gpt-4-turbo-preview"
     OPENAI_MAX_TOKENS: int = 4000
     OPENAI_TEMPERATURE: float = 0.7
+    OPENAI_BASE_URL: Optional[str] = None  # e.g. the mock server in app/mock_openai.py
+    OPENAI_TIMEOUT: float = 60.0
+    OPENAI_MAX_CONCURRENCY: int = 32
+    OPENAI_MAX_RETRIES: int = 3
+    OPENAI_RETRY_BASE_DELAY: float = 0.5
+    OPENAI_RETRY_MAX_DELAY: float = 8.0
 
     # Local LLM
     LOCAL_LLM_ENABLED: bool = True
@@ -36,13 +42,48 @@ class Settings(BaseSettings):
     LOCAL_LLM_MAX_TOKENS: int = 4000
     LOCAL_LLM_TEMPERATURE: float = 0.7
     LOCAL_LLM_GPU_MEMORY_UTILIZATION: float = 0.9
+    LOCAL_LLM_MAX_BATCH_SIZE: int = 8
+    LOCAL_LLM_MAX_BATCH_WAIT_MS: int = 20
+    LOCAL_LLM_PREFIX_CACHE_MAX_BYTES: int = 512 * 1024 * 1024  # 0 disables
+    LOCAL_LLM_PREFIX_CACHE_MIN_TOKENS: int = 32
 
     # Cache
     LLM_CACHE_ENABLED: bool = True
     LLM_CACHE_TTL: int = 3600  # 1 hour
+    # Per provider or agent TTLs as "name:seconds" pairs (agent wins),
+    # e.g. "openai:86400,CreativeAgent:1800"
+    LLM_CACHE_TTL_POLICIES: str = ""
+    LLM_CACHE_STALE_SECONDS: int = 300  # Served stale while refreshing
+    LLM_CACHE_LOCAL_MAX_BYTES: int = 64 * 1024 * 1024
+    LLM_CACHE_COMPRESSION_LEVEL: int = 3
+    LLM_REDIS_MAX_CONNECTIONS: int = 50
+
+    # /generate/batch
+    LLM_BATCH_MAX_ITEMS: int = 100
+
+    # Single-flight: identical in-flight requests share one generation
+    LLM_SINGLEFLIGHT_ENABLED: bool = True
+    LLM_SINGLEFLIGHT_LOCK_MS: int = 120000
+    LLM_SINGLEFLIGHT_WAIT_SECONDS: float = 120.0
+
+    # Semantic cache: opt-in per agent as "Agent:min_similarity" pairs,
+    # e.g. "ChannelPlanner:0.95,AnalystAgent:0.97"
+    LLM_SEMANTIC_CACHE_ENABLED: bool = False
+    LLM_SEMANTIC_CACHE_THRESHOLDS: str = ""
+    LLM_SEMANTIC_CACHE_PATH: str = "/var/lib/llm-router/semantic_cache.npz"
+    LLM_SEMANTIC_CACHE_MAX_ENTRIES: int = 20000  # Per agent/provider
+    LLM_SEMANTIC_CACHE_SAVE_SECONDS: int = 300
+
+    # Usage ledger: per tenant/run token counters in Redis
+    LLM_USAGE_FLUSH_SECONDS: float = 5.0
+    LLM_USAGE_RETENTION_DAYS: int = 400
+    # "model:prompt_usd_per_1k:completion_usd_per_1k" entries
+    LLM_PRICING: str = "gpt-4-turbo-preview:0.01:0.03,gpt-4o:0.005:0.015,gpt-3.5-turbo:0.0005:0.0015"
 
     # Moderation
     LLM_MODERATION_ENABLED: bool = True
+    LLM_MODERATION_TERMS_PATH: Optional[str] = None  # JSON {"category": ["term", ...]}
+    LLM_MODERATION_CACHE_SIZE: int = 10000  # Verdicts kept per router
 
     class Config:
         env_file = ".env"
@@ -1,12 +1,23 @@
 """LLM Router main application."""
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
-import redis
+from typing import Dict, List, Optional
+import asyncio
+import functools
+import redis.asyncio as aioredis
 import json
 import hashlib
 import logging
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from app.cache import ResponseCache, parse_ttl_policies
 from app.config import get_settings
+from app.metrics import MODERATION_VERDICTS, TIME_TO_FIRST_TOKEN
+from app.moderation import EngineCache, VerdictCache, load_terms
+from app.semantic_cache import SemanticCache
+from app.singleflight import SingleFlight
+from app.usage import UsageLedger, parse_pricing
 from app.providers.openai_provider import OpenAIProvider
 from app.providers.local_provider import LocalLLMProvider
 
@@ -29,6 +40,13 @@ app = FastAPI(
 openai_provider = None
 local_provider = None
 redis_client = None
+response_cache = None
+singleflight = SingleFlight()
+semantic_cache = None
+usage_ledger = None
+moderation_verdicts = VerdictCache(settings.LLM_MODERATION_CACHE_SIZE)
+term_engines = EngineCache(cache_size=settings.LLM_MODERATION_CACHE_SIZE)  # For /moderate with terms
+refresh_tasks = set()  # Background stale-while-revalidate refreshes
 
 
 class GenerateRequest(BaseModel):
@@ -40,6 +58,29 @@ class GenerateRequest(BaseModel):
     max_tokens: Optional[int] = None
     temperature: Optional[float] = None
     use_cache: bool = True
+    agent: Optional[str] = None  # Calling agent, e.g. CreativeAgent
+    tenant_id: Optional[int] = None  # Usage is recorded per tenant and agent run
+    run_id: Optional[int] = None
+
+
+class BatchItem(BaseModel):
+    """One prompt of a batch generate request."""
+
+    prompt: str
+    system_prompt: Optional[str] = None
+    provider: Optional[str] = None  # openai, local (override default)
+    max_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    use_cache: bool = True
+
+
+class GenerateBatchRequest(BaseModel):
+    """Batch generate request schema."""
+
+    items: List[BatchItem]
+    agent: Optional[str] = None
+    tenant_id: Optional[int] = None
+    run_id: Optional[int] = None
 
 
 class ModerateRequest(BaseModel):
@@ -47,6 +88,8 @@ class ModerateRequest(BaseModel):
 
     text: str
     provider: Optional[str] = None
+    # {"category": ["term", ...]} to match instead of asking the provider
+    terms: Optional[Dict[str, List[str]]] = None
 
 
 def get_cache_key(prompt: str, system_prompt: Optional[str], params: dict) -> str:
@@ -55,23 +98,161 @@ def get_cache_key(prompt: str, system_prompt: Optional[str], params: dict) -> st
     return f"llm_cache:{hashlib.md5(cache_str.encode()).hexdigest()}"
 
 
+def get_provider(provider_name: str):
+    """Get an initialized provider by name, or raise the matching HTTP error."""
+    if provider_name == "openai":
+        if not openai_provider:
+            raise HTTPException(
+                status_code=503,
+                detail="OpenAI provider not available"
+            )
+        return openai_provider
+    if provider_name == "local":
+        if not local_provider:
+            raise HTTPException(
+                status_code=503,
+                detail="Local LLM provider not available"
+            )
+        return local_provider
+    raise HTTPException(
+        status_code=400,
+        detail=f"Invalid provider: {provider_name}"
+    )
+
+
+async def generate_and_cache(
+    provider_name: str,
+    item,
+    cache_key: Optional[str],
+    agent: Optional[str],
+    tenant_id: Optional[int],
+    run_id: Optional[int],
+) -> dict:
+    """Generate a response for `item` (a GenerateRequest or BatchItem), record usage and cache it."""
+    response = await get_provider(provider_name).generate(
+        prompt=item.prompt,
+        system_prompt=item.system_prompt,
+        max_tokens=item.max_tokens,
+        temperature=item.temperature,
+    )
+
+    if not response.get("success"):
+        raise HTTPException(
+            status_code=500,
+            detail=response.get("error", "Generation failed")
+        )
+
+    if usage_ledger:
+        usage_ledger.record(tenant_id, run_id, response)
+
+    # Cache response if enabled
+    if cache_key:
+        await response_cache.set(cache_key, response, provider_name, agent)
+
+    return response
+
+
+def revalidate(cache_key: str, produce):
+    """Refresh a stale cache entry in the background."""
+    async def refresh():
+        try:
+            if settings.LLM_SINGLEFLIGHT_ENABLED:
+                await singleflight.do(cache_key, produce, lambda: response_cache.get_fresh(cache_key))
+            else:
+                await produce()
+        except Exception as e:
+            logger.warning(f"Cache refresh failed: {e}")
+
+    task = asyncio.create_task(refresh())
+    refresh_tasks.add(task)
+    task.add_done_callback(refresh_tasks.discard)
+
+
+async def moderate_text(provider_name: str, provider, text: str) -> dict:
+    """Moderate `text`, reusing the verdict for text this provider has already seen."""
+    key = VerdictCache.key(text, provider_name)
+    verdict = moderation_verdicts.get(key)
+    MODERATION_VERDICTS.labels(provider_name, "miss" if verdict is None else "hit").inc()
+    if verdict is None:
+        verdict = await provider.moderate(text)
+        if "error" not in verdict:
+            moderation_verdicts.put(key, verdict)
+    return verdict
+
+
+def sse(data: dict, event: Optional[str] = None) -> str:
+    """Format one Server-Sent Event."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize providers on startup."""
-    global openai_provider, local_provider, redis_client
+    global openai_provider, local_provider, redis_client, response_cache, singleflight, semantic_cache, usage_ledger
 
     logger.info("Starting LLM Router...")
     logger.info(f"Default provider: {settings.LLM_DEFAULT_PROVIDER}")
 
     # Initialize Redis client
     try:
-        redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
-        redis_client.ping()
+        redis_client = aioredis.Redis(connection_pool=aioredis.ConnectionPool.from_url(
+            settings.REDIS_URL,
+            max_connections=settings.LLM_REDIS_MAX_CONNECTIONS,
+        ))
+        await redis_client.ping()
         logger.info("Redis connection established")
+
+        # Coordinates identical generations across router replicas
+        singleflight = SingleFlight(
+            redis_client,
+            lock_ms=settings.LLM_SINGLEFLIGHT_LOCK_MS,
+            wait_seconds=settings.LLM_SINGLEFLIGHT_WAIT_SECONDS,
+        )
+
+        usage_ledger = UsageLedger(
+            redis_client,
+            parse_pricing(settings.LLM_PRICING),
+            retention_days=settings.LLM_USAGE_RETENTION_DAYS,
+        )
+        asyncio.create_task(flush_usage())
     except Exception as e:
         logger.warning(f"Redis connection failed: {e}")
         redis_client = None
 
+    # Initialize response cache (in-process only without Redis)
+    if settings.LLM_CACHE_ENABLED:
+        response_cache = ResponseCache(
+            redis_client,
+            default_ttl=settings.LLM_CACHE_TTL,
+            ttl_policies=parse_ttl_policies(settings.LLM_CACHE_TTL_POLICIES),
+            stale_seconds=settings.LLM_CACHE_STALE_SECONDS,
+            local_max_bytes=settings.LLM_CACHE_LOCAL_MAX_BYTES,
+            compression_level=settings.LLM_CACHE_COMPRESSION_LEVEL,
+        )
+
+    # Initialize semantic cache
+    if settings.LLM_SEMANTIC_CACHE_ENABLED:
+        thresholds = {
+            agent: float(threshold)
+            for agent, threshold in (
+                pair.split(":", 1)
+                for pair in settings.LLM_SEMANTIC_CACHE_THRESHOLDS.split(",")
+                if ":" in pair
+            )
+        }
+        semantic_cache = SemanticCache(
+            settings.LLM_SEMANTIC_CACHE_PATH,
+            thresholds,
+            max_entries=settings.LLM_SEMANTIC_CACHE_MAX_ENTRIES,
+        )
+        try:
+            semantic_cache.load()
+        except Exception as e:
+            logger.warning(f"Failed to load semantic cache: {e}")
+        logger.info(f"Semantic cache enabled for: {', '.join(thresholds) or 'no agents'}")
+        asyncio.create_task(persist_semantic_cache())
+
     # Initialize OpenAI provider
     if settings.OPENAI_ENABLED and settings.OPENAI_API_KEY:
         try:
@@ -80,6 +261,12 @@ async def startup_event():
                 model=settings.OPENAI_MODEL,
                 max_tokens=settings.OPENAI_MAX_TOKENS,
                 temperature=settings.OPENAI_TEMPERATURE,
+                base_url=settings.OPENAI_BASE_URL,
+                timeout=settings.OPENAI_TIMEOUT,
+                max_concurrency=settings.OPENAI_MAX_CONCURRENCY,
+                max_retries=settings.OPENAI_MAX_RETRIES,
+                retry_base_delay=settings.OPENAI_RETRY_BASE_DELAY,
+                retry_max_delay=settings.OPENAI_RETRY_MAX_DELAY,
             )
             logger.info("OpenAI provider initialized")
         except Exception as e:
@@ -92,6 +279,11 @@ async def startup_event():
                 model_name=settings.LOCAL_LLM_MODEL,
                 max_tokens=settings.LOCAL_LLM_MAX_TOKENS,
                 temperature=settings.LOCAL_LLM_TEMPERATURE,
+                max_batch_size=settings.LOCAL_LLM_MAX_BATCH_SIZE,
+                max_batch_wait_ms=settings.LOCAL_LLM_MAX_BATCH_WAIT_MS,
+                prefix_cache_max_bytes=settings.LOCAL_LLM_PREFIX_CACHE_MAX_BYTES,
+                prefix_cache_min_tokens=settings.LOCAL_LLM_PREFIX_CACHE_MIN_TOKENS,
+                moderation_terms=load_terms(settings.LLM_MODERATION_TERMS_PATH),
             )
             logger.info("Local LLM provider initialized")
         except Exception as e:
@@ -99,6 +291,43 @@ async def startup_event():
             logger.warning("Local LLM provider will not be available")
 
 
+async def persist_semantic_cache():
+    """Periodically save the semantic cache index to disk."""
+    while True:
+        await asyncio.sleep(settings.LLM_SEMANTIC_CACHE_SAVE_SECONDS)
+        if semantic_cache.dirty:
+            try:
+                await asyncio.to_thread(semantic_cache.write, semantic_cache.snapshot())
+            except Exception as e:
+                logger.warning(f"Failed to save semantic cache: {e}")
+
+
+async def flush_usage():
+    """Periodically write buffered usage counters to Redis."""
+    while True:
+        await asyncio.sleep(settings.LLM_USAGE_FLUSH_SECONDS)
+        await usage_ledger.flush()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release provider resources."""
+    if semantic_cache:
+        try:
+            semantic_cache.save()
+        except Exception as e:
+            logger.warning(f"Failed to save semantic cache: {e}")
+    if openai_provider:
+        await openai_provider.close()
+    if local_provider:
+        local_provider.batcher.close()
+    if usage_ledger:
+        await usage_ledger.flush()
+    await singleflight.close()
+    if redis_client:
+        await redis_client.close()
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
@@ -112,134 +341,276 @@ async def health_check():
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.post("/generate")
 async def generate(request: GenerateRequest):
     """Generate text using LLM."""
     # Determine provider
     provider_name = request.provider or settings.LLM_DEFAULT_PROVIDER
-
-    # Check cache if enabled
-    if request.use_cache and settings.LLM_CACHE_ENABLED and redis_client:
-        cache_key = get_cache_key(
-            request.prompt,
-            request.system_prompt,
-            {
-                "max_tokens": request.max_tokens,
-                "temperature": request.temperature,
-                "provider": provider_name,
-            },
+    use_cache = request.use_cache and response_cache is not None
+    cache_key = get_cache_key(
+        request.prompt,
+        request.system_prompt,
+        {
+            "max_tokens": request.max_tokens,
+            "temperature": request.temperature,
+            "provider": provider_name,
+        },
+    )
+    use_semantic = use_cache and semantic_cache and semantic_cache.enabled_for(request.agent)
+    semantic_text = f"{request.system_prompt or ''}\n{request.prompt}"
+    semantic_namespace = f"{request.agent}:{provider_name}"
+
+    async def produce():
+        response = await generate_and_cache(
+            provider_name,
+            request,
+            cache_key if use_cache else None,
+            request.agent,
+            request.tenant_id,
+            request.run_id,
         )
-        try:
-            cached_response = redis_client.get(cache_key)
-            if cached_response:
-                logger.info("Cache hit for request")
-                response = json.loads(cached_response)
-                response["cached"] = True
-                return response
-        except Exception as e:
-            logger.warning(f"Cache lookup failed: {e}")
+        if use_semantic:
+            semantic_cache.add(semantic_namespace, semantic_text, cache_key)
+        return response
+
+    # Check cache if enabled; a stale hit is returned and refreshed behind it
+    if use_cache:
+        cached = await response_cache.get(cache_key)
+        if cached:
+            response, stale = cached
+            if stale:
+                revalidate(cache_key, produce)
+            response["cached"] = True
+            return response
+
+    # Fall back to a near-identical earlier prompt from the same agent
+    if use_semantic:
+        match = semantic_cache.lookup(request.agent, semantic_namespace, semantic_text)
+        response = await response_cache.get_fresh(match[0]) if match else None
+        semantic_cache.record(request.agent, response is not None)
+        if response:
+            logger.info(f"Semantic cache hit for {request.agent} ({match[1]:.3f})")
+            response["cached"] = True
+            response["semantic_similarity"] = round(match[1], 4)
+            return response
 
     # Get provider
-    provider = None
-    if provider_name == "openai":
-        if not openai_provider:
-            raise HTTPException(
-                status_code=503,
-                detail="OpenAI provider not available"
-            )
-        provider = openai_provider
-    elif provider_name == "local":
-        if not local_provider:
+    provider = get_provider(provider_name)
+
+    # Moderate content if enabled
+    if settings.LLM_MODERATION_ENABLED:
+        moderation = await moderate_text(provider_name, provider, request.prompt)
+        if moderation.get("flagged"):
             raise HTTPException(
-                status_code=503,
-                detail="Local LLM provider not available"
+                status_code=400,
+                detail="Content flagged by moderation"
             )
-        provider = local_provider
+
+    # Identical cacheable requests in flight share one generation
+    if use_cache and settings.LLM_SINGLEFLIGHT_ENABLED:
+        response = await singleflight.do(cache_key, produce, lambda: response_cache.get_fresh(cache_key))
     else:
+        response = await produce()
+
+    response["cached"] = False
+    return response
+
+
+@app.post("/generate/batch")
+async def generate_batch(request: GenerateBatchRequest):
+    """Generate text for many prompts in one call.
+
+    The cache is checked for every item with one MGET. Misses are generated
+    concurrently, so local prompts share inference batches and OpenAI calls
+    run side by side. Results come back in request order, each with a
+    `status`: 200 with the same body as /generate, or the status code and
+    `error` that /generate would have returned for that item alone.
+    """
+    if len(request.items) > settings.LLM_BATCH_MAX_ITEMS:
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid provider: {provider_name}"
+            detail=f"At most {settings.LLM_BATCH_MAX_ITEMS} items per batch"
+        )
+
+    provider_names = [item.provider or settings.LLM_DEFAULT_PROVIDER for item in request.items]
+    cache_keys = [
+        get_cache_key(
+            item.prompt,
+            item.system_prompt,
+            {
+                "max_tokens": item.max_tokens,
+                "temperature": item.temperature,
+                "provider": provider_name,
+            },
+        ) if item.use_cache and response_cache is not None else None
+        for item, provider_name in zip(request.items, provider_names)
+    ]
+
+    def producer(i: int):
+        return functools.partial(
+            generate_and_cache,
+            provider_names[i],
+            request.items[i],
+            cache_keys[i],
+            request.agent,
+            request.tenant_id,
+            request.run_id,
         )
 
+    results: List[Optional[dict]] = [None] * len(request.items)
+
+    # Check cache for all cacheable items at once; stale hits are refreshed behind them
+    cacheable = [i for i, key in enumerate(cache_keys) if key]
+    if cacheable:
+        cached = await response_cache.get_many([cache_keys[i] for i in cacheable])
+        for i, hit in zip(cacheable, cached):
+            if hit:
+                response, stale = hit
+                if stale:
+                    revalidate(cache_keys[i], producer(i))
+                results[i] = {"status": 200, **response, "cached": True}
+
+    async def run(i: int) -> dict:
+        cache_key = cache_keys[i]
+        try:
+            provider = get_provider(provider_names[i])
+            if settings.LLM_MODERATION_ENABLED:
+                moderation = await moderate_text(provider_names[i], provider, request.items[i].prompt)
+                if moderation.get("flagged"):
+                    raise HTTPException(
+                        status_code=400,
+                        detail="Content flagged by moderation"
+                    )
+
+            if cache_key and settings.LLM_SINGLEFLIGHT_ENABLED:
+                response = await singleflight.do(cache_key, producer(i), lambda: response_cache.get_fresh(cache_key))
+            else:
+                response = await producer(i)()
+        except HTTPException as e:
+            return {"status": e.status_code, "success": False, "error": e.detail}
+        except Exception as e:
+            logger.error(f"Batch item generation failed: {e}")
+            return {"status": 500, "success": False, "error": str(e)}
+        return {"status": 200, **response, "cached": False}
+
+    misses = [i for i, result in enumerate(results) if result is None]
+    for i, result in zip(misses, await asyncio.gather(*(run(i) for i in misses))):
+        results[i] = result
+
+    return {"results": results}
+
+
+@app.post("/generate/stream")
+async def generate_stream(request: GenerateRequest):
+    """Stream generated text as Server-Sent Events.
+
+    Emits `data: {"text": ...}` per chunk, then an `event: done` carrying
+    the same response body as /generate (or `event: error`).
+    """
+    started = time.perf_counter()
+    provider_name = request.provider or settings.LLM_DEFAULT_PROVIDER
+    use_cache = request.use_cache and response_cache is not None
+    cache_key = get_cache_key(
+        request.prompt,
+        request.system_prompt,
+        {
+            "max_tokens": request.max_tokens,
+            "temperature": request.temperature,
+            "provider": provider_name,
+        },
+    )
+
+    # A fresh cached response is sent as a single chunk; a stale one is regenerated
+    response = await response_cache.get_fresh(cache_key) if use_cache else None
+    if response:
+        response["cached"] = True
+
+        async def replay():
+            yield sse({"text": response["text"]})
+            yield sse(response, event="done")
+
+        return StreamingResponse(replay(), media_type="text/event-stream")
+
+    provider = get_provider(provider_name)
+
     # Moderate content if enabled
     if settings.LLM_MODERATION_ENABLED:
-        moderation = await provider.moderate(request.prompt)
+        moderation = await moderate_text(provider_name, provider, request.prompt)
         if moderation.get("flagged"):
             raise HTTPException(
                 status_code=400,
                 detail="Content flagged by moderation"
             )
 
-    # Generate response
-    response = await provider.generate(
-        prompt=request.prompt,
-        system_prompt=request.system_prompt,
-        max_tokens=request.max_tokens,
-        temperature=request.temperature,
-    )
-
-    if not response.get("success"):
-        raise HTTPException(
-            status_code=500,
-            detail=response.get("error", "Generation failed")
-        )
-
-    # Cache response if enabled
-    if request.use_cache and settings.LLM_CACHE_ENABLED and redis_client:
+    async def events():
+        response = None
+        first_token = True
         try:
-            cache_key = get_cache_key(
-                request.prompt,
-                request.system_prompt,
-                {
-                    "max_tokens": request.max_tokens,
-                    "temperature": request.temperature,
-                    "provider": provider_name,
-                },
-            )
-            redis_client.setex(
-                cache_key,
-                settings.LLM_CACHE_TTL,
-                json.dumps(response),
-            )
+            async for item in provider.stream(
+                prompt=request.prompt,
+                system_prompt=request.system_prompt,
+                max_tokens=request.max_tokens,
+                temperature=request.temperature,
+            ):
+                if isinstance(item, dict):
+                    response = item
+                    continue
+                if first_token:
+                    TIME_TO_FIRST_TOKEN.labels(provider_name).observe(time.perf_counter() - started)
+                    first_token = False
+                yield sse({"text": item})
         except Exception as e:
-            logger.warning(f"Cache write failed: {e}")
+            logger.error(f"Streaming generation failed: {e}")
+            yield sse({"error": str(e), "provider": provider_name}, event="error")
+            return
 
-    response["cached"] = False
-    return response
+        if usage_ledger:
+            usage_ledger.record(request.tenant_id, request.run_id, response)
+
+        # Cache the full response like /generate does
+        if use_cache:
+            await response_cache.set(cache_key, response, provider_name, request.agent)
+
+        response["cached"] = False
+        yield sse(response, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.post("/moderate")
 async def moderate(request: ModerateRequest):
-    """Moderate content."""
+    """Moderate content, against the caller's term lists when it sends them."""
+    if request.terms is not None:
+        return term_engines.get(request.terms).check(request.text)
+
     provider_name = request.provider or settings.LLM_DEFAULT_PROVIDER
 
     # Get provider
-    provider = None
-    if provider_name == "openai":
-        if not openai_provider:
-            raise HTTPException(
-                status_code=503,
-                detail="OpenAI provider not available"
-            )
-        provider = openai_provider
-    elif provider_name == "local":
-        if not local_provider:
-            raise HTTPException(
-                status_code=503,
-                detail="Local LLM provider not available"
-            )
-        provider = local_provider
-    else:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Invalid provider: {provider_name}"
-        )
+    provider = get_provider(provider_name)
 
     # Moderate content
-    result = await provider.moderate(request.text)
+    result = await moderate_text(provider_name, provider, request.text)
     return result
 
 
+@app.get("/cache/semantic")
+async def semantic_cache_stats():
+    """Semantic cache size, hit rate and lookup latency."""
+    if not semantic_cache:
+        return {"enabled": False}
+    return {"enabled": True, **semantic_cache.stats()}
+
+
 @app.get("/providers")
 async def list_providers():
     """List available providers and their status."""
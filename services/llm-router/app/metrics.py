@@ -0,0 +1,87 @@
+"""Prometheus metrics for the LLM router."""
+from prometheus_client import Counter, Gauge, Histogram
+
+LOCAL_BATCH_SIZE = Histogram(
+    "llm_local_batch_size",
+    "Requests per local inference batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+LOCAL_QUEUE_WAIT = Histogram(
+    "llm_local_queue_wait_seconds",
+    "Time a local request waited before its batch started",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+LOCAL_TOKENS_PER_SECOND = Histogram(
+    "llm_local_tokens_per_second",
+    "Generated tokens per second of each local batch",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+)
+LOCAL_GENERATED_TOKENS = Counter(
+    "llm_local_generated_tokens_total",
+    "Tokens generated by the local model",
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from a streaming request to its first token",
+    ["provider"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+SINGLEFLIGHT_COALESCED = Counter(
+    "llm_singleflight_coalesced_total",
+    "Requests that waited on an identical in-flight generation",
+    ["scope"],  # local: same process, remote: another replica
+)
+SEMANTIC_CACHE_LOOKUPS = Counter(
+    "llm_semantic_cache_lookups_total",
+    "Semantic cache lookups by outcome",
+    ["agent", "result"],
+)
+SEMANTIC_CACHE_LOOKUP_SECONDS = Histogram(
+    "llm_semantic_cache_lookup_seconds",
+    "Semantic cache embedding and index search time",
+    ["agent"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+CACHE_REQUESTS = Counter(
+    "llm_cache_requests_total",
+    "Response cache lookups by tier and outcome",
+    ["tier", "result"],  # tier: local, redis; result: hit, stale, miss
+)
+CACHE_LATENCY = Histogram(
+    "llm_cache_lookup_seconds",
+    "Response cache lookup time by tier",
+    ["tier"],
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+CACHE_LOCAL_BYTES = Gauge(
+    "llm_cache_local_bytes",
+    "Compressed bytes held by the in-process response cache",
+)
+LOCAL_PREFIX_CACHE_LOOKUPS = Counter(
+    "llm_local_prefix_cache_lookups_total",
+    "Prompt prefix KV cache lookups by outcome",
+    ["result"],
+)
+LOCAL_PREFIX_CACHE_BYTES = Gauge(
+    "llm_local_prefix_cache_bytes",
+    "Memory held by cached prefix key/values",
+)
+LOCAL_PREFILL_TOKENS_SAVED = Counter(
+    "llm_local_prefill_tokens_saved_total",
+    "Prompt tokens whose prefill was reused from the prefix cache",
+)
+USAGE_TOKENS = Counter(
+    "llm_usage_tokens_total",
+    "Tokens consumed by generations (cache hits excluded)",
+    ["provider", "type"],  # type: prompt, completion
+)
+USAGE_UNACCOUNTED = Counter(
+    "llm_usage_unaccounted_total",
+    "Generations whose provider reported no token usage",
+    ["provider"],
+)
+MODERATION_VERDICTS = Counter(
+    "llm_moderation_verdicts_total",
+    "Moderation verdicts by provider and whether they came from the verdict cache",
+    ["provider", "result"],  # result: hit, miss
+)
@@ -0,0 +1,199 @@
+"""Local mock of the OpenAI API for load tests.
+
+Serves just enough of /v1/chat/completions and /v1/moderations for
+OpenAIProvider, with a configurable delay per completion and an optional
+share of 429/500 responses to exercise retries. Point the router at it
+with OPENAI_BASE_URL=http://localhost:9999/v1.
+
+Usage:
+    uvicorn app.mock_openai:app --port 9999
+    python -m app.mock_openai --requests 100 --delay-ms 2000  # Through the router
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MOCK_DELAY_MS = int(os.getenv("MOCK_OPENAI_DELAY_MS", "1000"))
+MOCK_ERROR_RATE = float(os.getenv("MOCK_OPENAI_ERROR_RATE", "0"))
+
+app = FastAPI(title="Mock OpenAI")
+
+
+def _maybe_error():
+    """Fail a share of requests the way OpenAI does under load."""
+    if MOCK_ERROR_RATE and random.random() < MOCK_ERROR_RATE:
+        if random.random() < 0.5:
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "requests"}},
+                status_code=429,
+                headers={"retry-after": "0.1"},
+            )
+        return JSONResponse({"error": {"message": "Server error", "type": "server_error"}}, status_code=500)
+    return None
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    error = _maybe_error()
+    if error:
+        return error
+
+    body = await request.json()
+    await asyncio.sleep(MOCK_DELAY_MS / 1000)
+
+    prompt = body["messages"][-1]["content"]
+    text = f"Mock completion for: {prompt[:80]}"
+    prompt_tokens = sum(len(m["content"].split()) for m in body["messages"])
+    completion_tokens = len(text.split())
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+    if body.get("stream"):
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+        return StreamingResponse(
+            _stream_chunks(body.get("model", "mock"), text, usage if include_usage else None),
+            media_type="text/event-stream",
+        )
+
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": "stop",
+        }],
+        "usage": usage,
+    }
+
+
+async def _stream_chunks(model: str, text: str, usage: Optional[dict] = None):
+    """Send a completion word by word as chat.completion.chunk events.
+
+    With `usage`, a last chunk without choices carries it, as OpenAI does
+    for stream_options={"include_usage": true}.
+    """
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    def chunk(choices, **extra):
+        return {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": choices,
+            **extra,
+        }
+
+    for i, word in enumerate(text.split(" ")):
+        delta = {"content": word if i == 0 else f" {word}"}
+        yield f"data: {json.dumps(chunk([{'index': 0, 'delta': delta, 'finish_reason': None}]))}\n\n"
+        await asyncio.sleep(0.01)
+    if usage:
+        yield f"data: {json.dumps(chunk([], usage=usage))}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/moderations")
+async def moderations(request: Request):
+    error = _maybe_error()
+    if error:
+        return error
+
+    body = await request.json()
+    categories = ["hate", "harassment", "self-harm", "sexual", "violence"]
+    return {
+        "id": f"modr-{uuid.uuid4().hex}",
+        "model": "text-moderation-mock",
+        "results": [{
+            "flagged": False,
+            "categories": {c: False for c in categories},
+            "category_scores": {c: 0.0 for c in categories},
+        } for _ in ([body["input"]] if isinstance(body["input"], str) else body["input"])],
+    }
+
+
+async def _benchmark(requests: int) -> Tuple[float, int]:
+    """Send `requests` concurrent /generate calls through the router app.
+
+    The router runs in process over httpx's ASGI transport, so each call
+    goes through the same request handling, moderation and provider code
+    as in production, with the mock server behind it.
+    """
+    import httpx
+
+    from app import main as router
+
+    await router.startup_event()
+    try:
+        transport = httpx.ASGITransport(app=router.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://router", timeout=None) as client:
+            started = time.perf_counter()
+            responses = await asyncio.gather(*(
+                client.post("/generate", json={
+                    "prompt": f"Write ad variant {i}",
+                    "provider": "openai",
+                    "use_cache": False,
+                })
+                for i in range(requests)
+            ))
+            elapsed = time.perf_counter() - started
+    finally:
+        await router.shutdown_event()
+
+    failed = sum(1 for r in responses if r.status_code != 200 or not r.json().get("success"))
+    return elapsed, failed
+
+
+def main():
+    global MOCK_DELAY_MS, MOCK_ERROR_RATE
+
+    parser = argparse.ArgumentParser(description="Benchmark the router's OpenAI path against the mock server")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=100, help="OPENAI_MAX_CONCURRENCY for the router")
+    parser.add_argument("--delay-ms", type=int, default=2000)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=9999)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    MOCK_DELAY_MS = args.delay_ms
+    MOCK_ERROR_RATE = args.error_rate
+    server = uvicorn.Server(uvicorn.Config(app, port=args.port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    # The router reads its settings once, on import
+    os.environ.update(
+        OPENAI_ENABLED="true",
+        OPENAI_API_KEY="mock",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{args.port}/v1",
+        OPENAI_MAX_CONCURRENCY=str(args.concurrency),
+        LLM_DEFAULT_PROVIDER="openai",
+        LOCAL_LLM_ENABLED="false",
+        LLM_SEMANTIC_CACHE_ENABLED="false",
+    )
+    elapsed, failed = asyncio.run(_benchmark(args.requests))
+    serial = args.requests * args.delay_ms / 1000
+    print(f"{args.requests} completions of {args.delay_ms} ms through /generate in {elapsed:.2f}s "
+          f"({args.requests / elapsed:.1f}/s; {serial:.0f}s if serialized; {failed} failed)")
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
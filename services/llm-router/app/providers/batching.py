@@ -0,0 +1,169 @@
+"""Dynamic request batching for local inference.
+
+Requests are queued and a single worker thread gathers them into batches:
+it blocks for the first request, then keeps collecting until the batch is
+full or `max_wait_ms` has passed since that first request. Only requests
+with the same generation parameters share a batch; the rest wait for the
+next one. Results are handed back through futures, so async callers await
+them without blocking the event loop.
+
+Usage (self-check):
+    python -m app.providers.batching
+"""
+import argparse
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, List, NamedTuple, Optional
+
+from app.metrics import LOCAL_BATCH_SIZE, LOCAL_QUEUE_WAIT
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending(NamedTuple):
+    item: Any
+    key: Hashable
+    future: Future
+    enqueued_at: float
+
+
+class BatchScheduler:
+    """Feeds queued items to `run_batch` in batches from a worker thread.
+
+    `run_batch(items, key)` gets items sharing the same `key` and must
+    return one result per item, in order.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Any], Hashable], List[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: int = 20,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._held: List[_Pending] = []
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="local-llm-batcher", daemon=True)
+        self._thread.start()
+
+    async def submit(self, item: Any, key: Hashable) -> Any:
+        """Queue an item and wait for its result."""
+        future: Future = Future()
+        self._queue.put(_Pending(item, key, future, time.perf_counter()))
+        return await asyncio.wrap_future(future)
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join(timeout=5)
+
+    def _next_batch(self) -> List[_Pending]:
+        """Collect up to max_batch_size items sharing the first item's key."""
+        if self._held:
+            first = self._held.pop(0)
+        else:
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                return []
+
+        batch = [first]
+        # Items held back from earlier rounds go first, in arrival order
+        held, self._held = self._held, []
+        for pending in held:
+            if pending.key == first.key and len(batch) < self.max_batch_size:
+                batch.append(pending)
+            else:
+                self._held.append(pending)
+
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                pending = self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if pending.key == first.key:
+                batch.append(pending)
+            else:
+                self._held.append(pending)
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            # Skip items whose caller went away; the rest are marked running,
+            # so a cancellation from here on can no longer race set_result()
+            batch = [p for p in self._next_batch() if p.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            LOCAL_BATCH_SIZE.observe(len(batch))
+            for pending in batch:
+                LOCAL_QUEUE_WAIT.observe(started - pending.enqueued_at)
+
+            try:
+                results = self.run_batch([p.item for p in batch], batch[0].key)
+                if len(results) != len(batch):
+                    raise RuntimeError(f"run_batch returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                logger.error(f"Batch of {len(batch)} failed: {e}")
+                for pending in batch:
+                    self._resolve(pending, exception=e)
+                continue
+
+            for pending, result in zip(batch, results):
+                self._resolve(pending, result=result)
+
+    @staticmethod
+    def _resolve(pending: _Pending, result: Any = None, exception: Optional[BaseException] = None):
+        # One bad item must never take the worker thread down
+        try:
+            if exception is not None:
+                pending.future.set_exception(exception)
+            else:
+                pending.future.set_result(result)
+        except Exception as e:
+            logger.error(f"Could not hand back a batch result: {e}")
+
+
+async def _self_check() -> bool:
+    """Cancel submits while queued and while running; the scheduler must keep serving."""
+
+    def run_batch(items, key):
+        time.sleep(0.2)
+        return [item * 2 for item in items]
+
+    scheduler = BatchScheduler(run_batch, max_batch_size=4, max_wait_ms=10)
+    try:
+        running = asyncio.ensure_future(scheduler.submit(1, "k"))
+        await asyncio.sleep(0.05)  # Now inside run_batch
+        queued = asyncio.ensure_future(scheduler.submit(2, "k"))
+        await asyncio.sleep(0)
+        running.cancel()
+        queued.cancel()
+        await asyncio.gather(running, queued, return_exceptions=True)
+
+        result = await asyncio.wait_for(scheduler.submit(21, "k"), timeout=5)
+        return result == 42 and scheduler._thread.is_alive()
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        scheduler.close()
+
+
+def main():
+    argparse.ArgumentParser(description="Check that cancelled submits leave the batcher serving").parse_args()
+    ok = asyncio.run(_self_check())
+    print("batcher still serving after cancelled submits" if ok else "batcher stopped serving")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,144 @@
 """Local LLM provider using Transformers."""
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+from transformers import AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, StoppingCriteriaList, pipeline
+from transformers.generation.streamers import BaseStreamer
 import torch
-from typing import Dict, Any, Optional
+from typing import AsyncIterator, Dict, Any, List, NamedTuple, Optional, Tuple
+import argparse
+import asyncio
 import logging
+import threading
+import time
+from app.metrics import LOCAL_GENERATED_TOKENS, LOCAL_PREFILL_TOKENS_SAVED, LOCAL_TOKENS_PER_SECOND
+from app.moderation import DEFAULT_TERMS, ModerationEngine
+from app.providers.batching import BatchScheduler
+from app.providers.prefix_cache import PrefixCache
 
 logger = logging.getLogger(__name__)
 
 
+class Completion(NamedTuple):
+    """Generated text with its exact token counts."""
+
+    text: str
+    prompt_tokens: int
+    completion_tokens: int
+
+
+class _StreamChannel:
+    """Hands one streamed request's output from the inference thread to its reader.
+
+    The queue receives text chunks, then either (prompt_tokens,
+    completion_tokens) or the exception that ended generation. The reader
+    sets `cancelled` when it goes away, which stops work on its row.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: "asyncio.Queue[Any]" = asyncio.Queue()
+        self.cancelled = threading.Event()
+
+    def push(self, item: Any):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        except RuntimeError:
+            pass  # Loop closed; nobody is reading
+
+
+class _BatchStreamer(BaseStreamer):
+    """Decodes a batch of streamed generations row by row as tokens arrive.
+
+    Like TextStreamer, text is held back until a space or newline so
+    that tokens which merge when decoded together are not split. A row is
+    finished at its first EOS, so a short completion isn't held up by the
+    longest one in its batch.
+    """
+
+    def __init__(self, tokenizer, channels: List[_StreamChannel], prompt_tokens: List[int]):
+        self.tokenizer = tokenizer
+        self.channels = channels
+        self.prompt_tokens = prompt_tokens
+        self.tokens: List[List[int]] = [[] for _ in channels]
+        self.sent = [0] * len(channels)
+        self.generated = [0] * len(channels)
+        self.done = [False] * len(channels)
+        self._prompt_seen = False
+
+    def put(self, value):
+        # The first call carries the prompt
+        if not self._prompt_seen:
+            self._prompt_seen = True
+            return
+        for row, token in enumerate(value.reshape(-1).tolist()):
+            if self.done[row]:
+                continue
+            if self.channels[row].cancelled.is_set():
+                self.done[row] = True
+                continue
+            self.generated[row] += 1
+            if token == self.tokenizer.eos_token_id:
+                self._finish(row)
+                continue
+            self.tokens[row].append(token)
+            text = self.tokenizer.decode(self.tokens[row], skip_special_tokens=True)
+            if text.endswith("\n"):
+                self._send(row, text[self.sent[row]:])
+                self.tokens[row], self.sent[row] = [], 0
+            else:
+                cut = text.rfind(" ") + 1
+                if cut > self.sent[row]:
+                    self._send(row, text[self.sent[row]:cut])
+                    self.sent[row] = cut
+
+    def end(self):
+        for row in range(len(self.channels)):
+            if not self.done[row]:
+                self._finish(row)
+
+    def fail(self, error: Exception):
+        for row, channel in enumerate(self.channels):
+            if not self.done[row]:
+                self.done[row] = True
+                channel.push(error)
+
+    def abandoned(self) -> bool:
+        """Every row has finished or lost its reader."""
+        return all(done or channel.cancelled.is_set() for done, channel in zip(self.done, self.channels))
+
+    def _send(self, row: int, text: str):
+        if text:
+            self.channels[row].push(text)
+
+    def _finish(self, row: int):
+        text = self.tokenizer.decode(self.tokens[row], skip_special_tokens=True)
+        self._send(row, text[self.sent[row]:])
+        self.done[row] = True
+        self.channels[row].push((self.prompt_tokens[row], self.generated[row]))
+
+
+class _StopWhenAbandoned(StoppingCriteria):
+    """Ends generation once no row of the batch still has a reader."""
+
+    def __init__(self, streamer: _BatchStreamer):
+        self.streamer = streamer
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.streamer.abandoned()
+
+
 class LocalLLMProvider:
     """Local LLM provider using Hugging Face Transformers."""
 
-    def __init__(self, model_name: str, max_tokens: int, temperature: float):
+    def __init__(
+        self,
+        model_name: str,
+        max_tokens: int,
+        temperature: float,
+        max_batch_size: int = 8,
+        max_batch_wait_ms: int = 20,
+        prefix_cache_max_bytes: int = 512 * 1024 * 1024,
+        prefix_cache_min_tokens: int = 32,
+        moderation_terms: Optional[Dict[str, List[str]]] = None,
+    ):
         """Initialize local LLM provider."""
         self.model_name = model_name
         self.max_tokens = max_tokens
@@ -21,6 +149,21 @@ class LocalLLMProvider:
         logger.info(f"Initializing local LLM provider with model: {model_name}")
         self._load_model()
 
+        # Batched prompts are left-padded so generation continues from the real last token
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        # Prefill of repeated system prompts, reused across requests
+        self.prefix_cache = PrefixCache(prefix_cache_max_bytes) if prefix_cache_max_bytes > 0 else None
+        self.prefix_cache_min_tokens = prefix_cache_min_tokens
+
+        # Verdicts are cached by the router, not here
+        self.moderation = ModerationEngine(moderation_terms or DEFAULT_TERMS, cache_size=0)
+
+        # One inference thread; concurrent requests share its batches
+        self.batcher = BatchScheduler(self._generate_batch, max_batch_size, max_batch_wait_ms)
+
     def _load_model(self):
         """Load the model and tokenizer."""
         try:
@@ -65,6 +208,151 @@ class LocalLLMProvider:
                 logger.error(f"Failed to load model in CPU mode: {cpu_error}")
                 raise
 
+    def _split_prompt(self, system_prompt: Optional[str]) -> Tuple[str, str]:
+        """Instruct template as (prefix, suffix format) around the user prompt.
+
+        The prefix holds the system prompt, which is what repeats across calls.
+        """
+        if system_prompt:
+            return f"<s>[INST] {system_prompt}\n\n", "{prompt} [/INST]"
+        return "<s>[INST] ", "{prompt} [/INST]"
+
+    def _cached_prefix(self, prefix: str) -> Optional[Tuple[Any, Any]]:
+        """(input_ids, past_key_values) for `prefix`, running its prefill on a miss.
+
+        None when the cache is off or the prefix is too short to be worth it.
+        """
+        if self.prefix_cache is None:
+            return None
+        entry = self.prefix_cache.get(prefix)
+        if entry is not None:
+            LOCAL_PREFILL_TOKENS_SAVED.inc(entry[0].shape[1])
+            return entry
+
+        prefix_ids = self.tokenizer(prefix, return_tensors="pt")["input_ids"].to(self.model.device)
+        if prefix_ids.shape[1] < self.prefix_cache_min_tokens:
+            return None
+        with torch.inference_mode():
+            past_key_values = self.model(prefix_ids, use_cache=True).past_key_values
+
+        entry = (prefix_ids, past_key_values)
+        size = prefix_ids.nbytes + sum(k.nbytes + v.nbytes for k, v in past_key_values)
+        self.prefix_cache.put(prefix, entry, size)
+        return entry
+
+    def _prepare_inputs(self, system_prompt: Optional[str], prompts: List[str]) -> Dict[str, Any]:
+        """Tokenize prompts that share `system_prompt`, resuming from its cached prefill.
+
+        With a cached prefix each row is [prefix][padding][prompt]; the
+        padding is masked out, so position ids (derived from the attention
+        mask) stay contiguous and the prefix key/values are valid for every
+        row. The prompts are tokenized without the prefix, which can split
+        tokens at the boundary slightly differently from the joint text.
+        """
+        prefix, suffix = self._split_prompt(system_prompt)
+        suffixes = [suffix.format(prompt=prompt) for prompt in prompts]
+
+        cached = self._cached_prefix(prefix)
+        if cached is None:
+            return self.tokenizer(
+                [prefix + s for s in suffixes], return_tensors="pt", padding=True,
+            ).to(self.model.device)
+
+        prefix_ids, past_key_values = cached
+        rows = len(prompts)
+        tail = self.tokenizer(
+            suffixes, return_tensors="pt", padding=True, add_special_tokens=False,
+        ).to(self.model.device)
+        return {
+            "input_ids": torch.cat([prefix_ids.expand(rows, -1), tail["input_ids"]], dim=1),
+            "attention_mask": torch.cat([torch.ones_like(prefix_ids).expand(rows, -1), tail["attention_mask"]], dim=1),
+            "past_key_values": tuple((k.expand(rows, -1, -1, -1), v.expand(rows, -1, -1, -1)) for k, v in past_key_values),
+        }
+
+    def _generate_batch(self, items: List[Any], params: Tuple[str, int, float, Optional[str]]) -> List[Any]:
+        """Generate completions for a batch of requests sharing parameters and system prompt."""
+        mode, max_new_tokens, temperature, system_prompt = params
+        if mode == "stream":
+            self._generate_streamed(system_prompt, items, max_new_tokens, temperature)
+            return [None] * len(items)
+
+        inputs = self._prepare_inputs(system_prompt, items)
+
+        started = time.perf_counter()
+        with torch.inference_mode():
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                do_sample=True,
+                top_p=0.95,
+                top_k=50,
+                pad_token_id=self.tokenizer.pad_token_id,
+            )
+        elapsed = time.perf_counter() - started
+
+        completions = outputs[:, inputs["input_ids"].shape[1]:]
+        prompt_tokens = inputs["attention_mask"].sum(dim=1).tolist()
+        completion_tokens = self._completion_lengths(completions).tolist()
+        generated = sum(completion_tokens)
+        LOCAL_GENERATED_TOKENS.inc(generated)
+        if elapsed > 0:
+            LOCAL_TOKENS_PER_SECOND.observe(generated / elapsed)
+
+        texts = self.tokenizer.batch_decode(completions, skip_special_tokens=True)
+        return [Completion(*row) for row in zip(texts, prompt_tokens, completion_tokens)]
+
+    def _completion_lengths(self, completions: torch.Tensor) -> torch.Tensor:
+        """Generated tokens per row: up to and including EOS, not the padding after it."""
+        ended = (completions == self.tokenizer.eos_token_id) | (completions == self.tokenizer.pad_token_id)
+        first_end = ended.int().argmax(dim=1)
+        return torch.where(ended.any(dim=1), first_end + 1, completions.shape[1])
+
+    def _generate_streamed(
+        self,
+        system_prompt: Optional[str],
+        items: List[Tuple[str, _StreamChannel]],
+        max_new_tokens: int,
+        temperature: float,
+    ):
+        """Generate a batch of streamed completions, pushing text to each row's channel.
+
+        Results and errors go through the channels. Generation stops early
+        once every reader has gone; a single departed row keeps decoding
+        with the rest of its batch but nothing more is sent for it.
+        """
+        channels = [channel for _, channel in items]
+        streamer = None
+        try:
+            inputs = self._prepare_inputs(system_prompt, [prompt for prompt, _ in items])
+            streamer = _BatchStreamer(self.tokenizer, channels, inputs["attention_mask"].sum(dim=1).tolist())
+            started = time.perf_counter()
+            with torch.inference_mode():
+                self.model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    temperature=temperature,
+                    do_sample=True,
+                    top_p=0.95,
+                    top_k=50,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([_StopWhenAbandoned(streamer)]),
+                )
+            elapsed = time.perf_counter() - started
+        except Exception as e:
+            if streamer is None:
+                for channel in channels:
+                    channel.push(e)
+            else:
+                streamer.fail(e)
+            return
+
+        generated = sum(streamer.generated)
+        LOCAL_GENERATED_TOKENS.inc(generated)
+        if elapsed > 0:
+            LOCAL_TOKENS_PER_SECOND.observe(generated / elapsed)
+
     async def generate(
         self,
         prompt: str,
@@ -73,7 +361,7 @@ class LocalLLMProvider:
         temperature: Optional[float] = None,
     ) -> Dict[str, Any]:
         """Generate response using local LLM."""
-        if not self.pipeline:
+        if not self.model:
             return {
                 "success": False,
                 "error": "Model not loaded",
@@ -81,36 +369,21 @@ class LocalLLMProvider:
             }
 
         try:
-            # Combine system and user prompts
-            full_prompt = prompt
-            if system_prompt:
-                full_prompt = f"<s>[INST] {system_prompt}\n\n{prompt} [/INST]"
-            else:
-                full_prompt = f"<s>[INST] {prompt} [/INST]"
-
-            # Generate response
-            outputs = self.pipeline(
-                full_prompt,
-                max_new_tokens=max_tokens or self.max_tokens,
-                temperature=temperature or self.temperature,
-                do_sample=True,
-                top_p=0.95,
-                top_k=50,
-                return_full_text=False,
+            # Generate response in the next batch with matching parameters
+            completion = await self.batcher.submit(
+                prompt,
+                ("batch", max_tokens or self.max_tokens, temperature or self.temperature, system_prompt),
             )
 
-            generated_text = outputs[0]["generated_text"]
-
-            # Calculate token usage (approximate)
-            input_tokens = len(self.tokenizer.encode(full_prompt))
-            output_tokens = len(self.tokenizer.encode(generated_text))
-            total_tokens = input_tokens + output_tokens
-
             return {
                 "success": True,
-                "text": generated_text,
+                "text": completion.text,
                 "model": self.model_name,
-                "tokens_used": total_tokens,
+                "tokens_used": completion.prompt_tokens + completion.completion_tokens,
+                "usage": {
+                    "prompt_tokens": completion.prompt_tokens,
+                    "completion_tokens": completion.completion_tokens,
+                },
                 "provider": "local",
             }
         except Exception as e:
@@ -121,26 +394,107 @@ class LocalLLMProvider:
                 "provider": "local",
             }
 
-    async def moderate(self, text: str) -> Dict[str, Any]:
-        """Simple moderation for local LLM (basic heuristics)."""
-        # Simple heuristic-based moderation
-        # In production, you'd want to use a dedicated moderation model
-        flagged_keywords = [
-            "violence",
-            "hate",
-            "harassment",
-            "illegal",
-            "explicit",
-        ]
-
-        text_lower = text.lower()
-        flagged = any(keyword in text_lower for keyword in flagged_keywords)
+    async def stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+    ) -> AsyncIterator[Any]:
+        """Stream a completion: yields text chunks, then the complete response dict."""
+        if not self.model:
+            raise RuntimeError("Model not loaded")
 
-        return {
-            "flagged": flagged,
-            "categories": {
-                "violence": "violence" in text_lower,
-                "hate": "hate" in text_lower,
-                "harassment": "harassment" in text_lower,
-            },
+        # Chunks arrive on an asyncio queue fed by the inference thread, so a
+        # waiting stream holds no executor thread
+        channel = _StreamChannel(asyncio.get_running_loop())
+        submitted = asyncio.ensure_future(self.batcher.submit(
+            (prompt, channel),
+            ("stream", max_tokens or self.max_tokens, temperature or self.temperature, system_prompt),
+        ))
+
+        chunks = []
+        try:
+            while True:
+                item = await channel.queue.get()
+                if isinstance(item, Exception):
+                    raise item
+                if isinstance(item, tuple):
+                    prompt_tokens, completion_tokens = item
+                    break
+                chunks.append(item)
+                yield item
+        finally:
+            # Also runs when the client disconnects: drops the request if it
+            # is still queued and stops decoding for it otherwise
+            channel.cancelled.set()
+            submitted.cancel()
+
+        yield {
+            "success": True,
+            "text": "".join(chunks),
+            "model": self.model_name,
+            "tokens_used": prompt_tokens + completion_tokens,
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens},
+            "provider": "local",
         }
+
+    async def moderate(self, text: str) -> Dict[str, Any]:
+        """Term-list moderation for the local LLM (see app/moderation.py)."""
+        return self.moderation.check(text)
+
+
+async def _benchmark(provider: LocalLLMProvider, requests: int, max_tokens: int) -> float:
+    """Send `requests` concurrent prompts and return completions per second."""
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        provider.generate(f"Write ad headline number {i} for running shoes", max_tokens=max_tokens)
+        for i in range(requests)
+    ))
+    return requests / (time.perf_counter() - started)
+
+
+async def _benchmark_prefix(provider: LocalLLMProvider, requests: int, system_prompt: str) -> float:
+    """Average latency of one-token generations that share `system_prompt`.
+
+    With a single new token the time is almost all prefill.
+    """
+    await provider.generate("Warm up", system_prompt=system_prompt, max_tokens=1)
+    started = time.perf_counter()
+    for i in range(requests):
+        await provider.generate(f"Write ad headline number {i} for running shoes", system_prompt=system_prompt, max_tokens=1)
+    return (time.perf_counter() - started) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched local generation on CPU")
+    parser.add_argument("--model", default="sshleifer/tiny-gpt2")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--batch-sizes", default="1,4,8,16")
+    parser.add_argument(
+        "--prefix-tokens", type=int, default=0,
+        help="Instead, time prefill with and without the prefix cache for a system prompt of about this many tokens",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.prefix_tokens:
+        system_prompt = " ".join(["You are a marketing assistant. Follow the brand guidelines."] * (args.prefix_tokens // 12))
+        for label, max_bytes in (("off", 0), ("on", 512 * 1024 * 1024)):
+            provider = LocalLLMProvider(args.model, args.max_tokens, 0.7, prefix_cache_max_bytes=max_bytes)
+            latency = asyncio.run(_benchmark_prefix(provider, args.requests, system_prompt))
+            provider.batcher.close()
+            print(f"prefix cache {label:<3} {latency * 1000:8.2f} ms/request")
+        return
+
+    for batch_size in (int(b) for b in args.batch_sizes.split(",")):
+        provider = LocalLLMProvider(args.model, args.max_tokens, 0.7, max_batch_size=batch_size)
+        rate = asyncio.run(_benchmark(provider, args.requests, args.max_tokens))
+        provider.batcher.close()
+        print(f"max_batch_size={batch_size:<3} {rate:8.2f} completions/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,102 @@
 """OpenAI LLM provider."""
-from openai import OpenAI
-from typing import Dict, Any, Optional
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
+from typing import AsyncIterator, Awaitable, Callable, Dict, Any, List, Optional, TypeVar
+import asyncio
+import httpx
 import logging
+import random
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Errors worth retrying; anything else (bad request, auth) fails immediately
+RETRYABLE_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError)
+
 
 class OpenAIProvider:
     """OpenAI LLM provider."""
 
-    def __init__(self, api_key: str, model: str, max_tokens: int, temperature: float):
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        max_tokens: int,
+        temperature: float,
+        base_url: Optional[str] = None,
+        timeout: float = 60.0,
+        max_concurrency: int = 32,
+        max_retries: int = 3,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 8.0,
+    ):
         """Initialize OpenAI provider."""
-        self.client = OpenAI(api_key=api_key)
+        # One pooled connection set shared by all requests; retries are ours
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=timeout,
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                timeout=timeout,
+                limits=httpx.Limits(
+                    max_connections=max_concurrency,
+                    max_keepalive_connections=max_concurrency,
+                ),
+            ),
+        )
         self.model = model
         self.max_tokens = max_tokens
         self.temperature = temperature
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self._semaphore = asyncio.Semaphore(max_concurrency)
         logger.info(f"Initialized OpenAI provider with model: {model}")
 
+    async def close(self):
+        """Close pooled connections."""
+        await self.client.close()
+
+    async def _call(self, request: Callable[[], Awaitable[T]]) -> T:
+        """Run a request within the concurrency limit, retrying transient errors.
+
+        Backoff is exponential with full jitter. When a rate limit response
+        carries a Retry-After, the jitter is added on top of it, so callers
+        throttled together do not all come back at the same moment.
+        """
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    return await request()
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+                retry_after = getattr(getattr(e, "response", None), "headers", {}).get("retry-after")
+                if retry_after:
+                    try:
+                        delay += min(float(retry_after), self.retry_max_delay)
+                    except ValueError:
+                        pass
+                attempt += 1
+                logger.warning(f"OpenAI request failed ({e.__class__.__name__}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    def _messages(self, prompt: str, system_prompt: Optional[str]) -> List[Dict[str, str]]:
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
     async def generate(
         self,
         prompt: str,
@@ -26,23 +106,24 @@ class OpenAIProvider:
     ) -> Dict[str, Any]:
         """Generate response using OpenAI."""
         try:
-            messages = []
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            messages.append({"role": "user", "content": prompt})
+            messages = self._messages(prompt, system_prompt)
 
-            response = self.client.chat.completions.create(
+            response = await self._call(lambda: self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 max_tokens=max_tokens or self.max_tokens,
                 temperature=temperature or self.temperature,
-            )
+            ))
 
             return {
                 "success": True,
                 "text": response.choices[0].message.content,
                 "model": self.model,
                 "tokens_used": response.usage.total_tokens,
+                "usage": {
+                    "prompt_tokens": response.usage.prompt_tokens,
+                    "completion_tokens": response.usage.completion_tokens,
+                },
                 "provider": "openai",
             }
         except Exception as e:
@@ -53,10 +134,58 @@ class OpenAIProvider:
                 "provider": "openai",
             }
 
+    async def stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+    ) -> AsyncIterator[Any]:
+        """Stream a completion: yields text chunks, then the complete response dict.
+
+        The API reports token usage on a final chunk when asked to. Without
+        it (e.g. a proxy that drops the option) the response has no "usage"
+        and the ledger counts the generation as unaccounted.
+        """
+        messages = self._messages(prompt, system_prompt)
+        response = await self._call(lambda: self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens or self.max_tokens,
+            temperature=temperature or self.temperature,
+            stream=True,
+            # Not a named argument in this SDK version
+            extra_body={"stream_options": {"include_usage": True}},
+        ))
+
+        chunks = []
+        usage = None
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                chunks.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+            # An extra field to this SDK, so it arrives as a plain dict
+            usage = getattr(chunk, "usage", None) or usage
+
+        result = {
+            "success": True,
+            "text": "".join(chunks),
+            "model": self.model,
+            "tokens_used": None,
+            "provider": "openai",
+        }
+        if usage:
+            result["tokens_used"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            result["usage"] = {
+                "prompt_tokens": usage["prompt_tokens"],
+                "completion_tokens": usage["completion_tokens"],
+            }
+        yield result
+
     async def moderate(self, text: str) -> Dict[str, Any]:
         """Moderate content using OpenAI."""
         try:
-            response = self.client.moderations.create(input=text)
+            response = await self._call(lambda: self.client.moderations.create(input=text))
             result = response.results[0]
 
             return {
@@ -0,0 +1,51 @@
+"""Prefix KV cache for local inference.
+
+Agents send the same long system prompt on every call, so the prefill for
+that prefix is repeated work. The inference thread keeps the prefix's
+token ids and past_key_values here and resumes generation after them.
+Entries are evicted least recently used first once their tensors exceed
+`max_bytes`. Only the inference thread touches the cache, so it is not
+locked.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.metrics import LOCAL_PREFIX_CACHE_BYTES, LOCAL_PREFIX_CACHE_LOOKUPS
+
+
+class PrefixCache:
+    """LRU of prefix -> (input_ids, past_key_values), bounded by tensor bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, prefix: str) -> Optional[Any]:
+        entry = self._entries.get(prefix)
+        LOCAL_PREFIX_CACHE_LOOKUPS.labels("miss" if entry is None else "hit").inc()
+        if entry is None:
+            return None
+        self._entries.move_to_end(prefix)
+        return entry[0]
+
+    def put(self, prefix: str, value: Any, size: int):
+        if size > self.max_bytes:
+            return
+        self._remove(prefix)
+        self._entries[prefix] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        LOCAL_PREFIX_CACHE_BYTES.set(self.bytes)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "bytes": self.bytes}
+
+    def _remove(self, prefix: str):
+        entry = self._entries.pop(prefix, None)
+        if entry is not None:
+            self.bytes -= entry[1]
@@ -0,0 +1,346 @@
+"""Opt-in semantic response cache.
+
+The exact cache only hits on byte-identical prompts, but agent prompts
+often differ only in numbers or a few words. Here prompts are embedded
+with a signed hashing vectorizer (word unigrams and bigrams, digits folded
+together) and kept in a small IVF index per namespace (agent + provider).
+A lookup returns the exact-cache key of the most similar earlier prompt
+when its cosine similarity clears the agent's threshold, so responses
+themselves stay in Redis with their usual TTL.
+
+The index lives in memory and is saved to `LLM_SEMANTIC_CACHE_PATH` as an
+.npz file (float16 vectors) periodically and on shutdown. Clusters are fit
+in a worker thread and swapped in when done, so a growing index never
+stalls requests; searches scan the old clusters (or every vector) meanwhile.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.metrics import SEMANTIC_CACHE_LOOKUP_SECONDS, SEMANTIC_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"[a-z]+|\d+")
+
+
+def embed(text: str, dim: int) -> np.ndarray:
+    """Hash word unigrams and bigrams of `text` into a unit vector.
+
+    All numbers map to one token so "budget 500" and "budget 750" match.
+    crc32 keeps the hashing stable across processes for the saved index.
+    """
+    tokens = ["0" if t.isdigit() else t for t in _TOKEN.findall(text.lower())]
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in features:
+        h = zlib.crc32(feature.encode())
+        vector[h % dim] += 1.0 if h & 0x80000000 else -1.0
+
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class IVFIndex:
+    """Inverted-file index over unit vectors, searched by inner product.
+
+    Below `nlist * 40` vectors a search is a brute-force scan; above it
+    vectors are clustered with k-means and only the `nprobe` closest
+    clusters are scanned. Prompts from one agent share most of their
+    template, so clustering runs on vectors centered on their mean, which
+    leaves the parts that actually vary. Clusters are refit whenever the
+    index has doubled since the last fit, or after it was trimmed.
+
+    `fit()` and `assign()` only read the array they are given, so they can
+    run in a worker thread on `vectors` while the event loop keeps adding:
+    rows handed out are never written again. Adds write past them,
+    trimming only moves the start of the live rows forward, and a full
+    buffer is replaced rather than compacted in place.
+    """
+
+    def __init__(self, dim: int, nlist: int = 64, nprobe: int = 8):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self._vectors = np.empty((1024, dim), dtype=np.float32)
+        self._start = 0
+        self.keys: List[str] = []
+        self.created: List[float] = []
+        self.mean: Optional[np.ndarray] = None
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[List[int]] = []
+        self._trained_size = 0
+        # Vectors trimmed off the front so far, to line up fits with positions
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[self._start:self._start + len(self.keys)]
+
+    @staticmethod
+    def _nearest(vectors: np.ndarray, centroids: np.ndarray, count: int = 1) -> np.ndarray:
+        """Indices of the `count` closest centroids (squared L2) for each centered vector."""
+        distances = (centroids ** 2).sum(axis=1) - 2 * vectors @ centroids.T
+        if count == 1:
+            return np.argmin(distances, axis=-1)
+        if count >= len(centroids):
+            return np.arange(len(centroids))
+        return np.argpartition(distances, count, axis=-1)[..., :count]
+
+    def add(self, vector: np.ndarray, key: str, created: float):
+        n = len(self.keys)
+        if self._start + n == len(self._vectors):
+            vectors = np.empty((max(2 * n, 1024), self.dim), dtype=np.float32)
+            vectors[:n] = self.vectors
+            self._vectors, self._start = vectors, 0
+        self._vectors[self._start + n] = vector
+        self.keys.append(key)
+        self.created.append(created)
+
+        if self.centroids is not None:
+            self.lists[int(self._nearest(vector - self.mean, self.centroids))].append(n)
+
+    def needs_training(self) -> bool:
+        n = len(self.keys)
+        return n >= self.nlist * 40 and n >= 2 * self._trained_size
+
+    def search(self, vector: np.ndarray) -> Tuple[float, int]:
+        """Best (similarity, position), or (-1, -1) when empty."""
+        if not self.keys:
+            return -1.0, -1
+        if self.centroids is None:
+            scores = self.vectors @ vector
+            best = int(np.argmax(scores))
+            return float(scores[best]), best
+
+        probe = self._nearest(vector - self.mean, self.centroids, self.nprobe)
+        candidates = np.concatenate([self.lists[c] for c in probe]).astype(np.int64)
+        if not len(candidates):
+            return -1.0, -1
+        scores = self.vectors[candidates] @ vector
+        best = int(np.argmax(scores))
+        return float(scores[best]), int(candidates[best])
+
+    def fit(self, vectors: np.ndarray, iterations: int = 10) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Cluster `vectors` with k-means (k-means++ seeding).
+
+        Returns (mean, centroids, cluster of each vector) for `install()`,
+        or None when there are too few vectors.
+        """
+        if len(vectors) < self.nlist:
+            return None
+        mean = vectors.mean(axis=0)
+        vectors = vectors - mean
+        rng = np.random.default_rng(0)
+
+        centroids = np.empty((self.nlist, self.dim), dtype=np.float32)
+        centroids[0] = vectors[rng.integers(len(vectors))]
+        closest = ((vectors - centroids[0]) ** 2).sum(axis=1)
+        for c in range(1, self.nlist):
+            total = closest.sum()
+            if total <= 0:
+                # Fewer distinct vectors than clusters
+                centroids = centroids[:c]
+                break
+            centroids[c] = vectors[rng.choice(len(vectors), p=closest / total)]
+            closest = np.minimum(closest, ((vectors - centroids[c]) ** 2).sum(axis=1))
+
+        for _ in range(iterations):
+            assignment = self._nearest(vectors, centroids)
+            for c in range(len(centroids)):
+                members = vectors[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+
+        return mean, centroids, self._nearest(vectors, centroids)
+
+    def assign(self, vectors: np.ndarray, mean: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """Cluster of each vector under fit clusters."""
+        return self._nearest(vectors - mean, centroids)
+
+    def install(self, mean: np.ndarray, centroids: np.ndarray, assignment: np.ndarray, dropped: int):
+        """Switch to clusters fit on the vectors stored when `self.dropped` was `dropped`.
+
+        Vectors trimmed since then are skipped and vectors added since then
+        are assigned here.
+        """
+        assignment = assignment[self.dropped - dropped:]
+        added = self.vectors[len(assignment):]
+        if len(added):
+            assignment = np.concatenate([assignment, self.assign(added, mean, centroids)])
+
+        self.mean, self.centroids = mean, centroids
+        self.lists = [np.flatnonzero(assignment == c).tolist() for c in range(len(centroids))]
+        self._trained_size = len(assignment) - len(added)
+
+    def train(self, iterations: int = 10):
+        """Fit and install clusters in one go."""
+        fitted = self.fit(self.vectors, iterations)
+        if fitted is not None:
+            self.install(*fitted, self.dropped)
+
+    def keep_newest(self, count: int):
+        """Drop all but the `count` most recently added vectors."""
+        drop = len(self.keys) - count
+        if drop <= 0:
+            return
+        self._start += drop
+        del self.keys[:drop]
+        del self.created[:drop]
+        self.lists = [[position - drop for position in positions if position >= drop] for positions in self.lists]
+        self.dropped += drop
+        # Part of what the clusters were fit on is gone: refit
+        self._trained_size = 0
+
+
+class SemanticCache:
+    """Namespaced semantic lookup in front of the exact response cache."""
+
+    def __init__(
+        self,
+        path: Optional[str],
+        thresholds: Dict[str, float],
+        dim: int = 1024,
+        max_entries: int = 20000,
+    ):
+        self.path = path
+        self.thresholds = thresholds
+        self.dim = dim
+        self.max_entries = max_entries
+        self.indexes: Dict[str, IVFIndex] = {}
+        self.hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+        self.dirty = False
+        self._training: Dict[str, asyncio.Task] = {}
+
+    def enabled_for(self, agent: Optional[str]) -> bool:
+        return bool(agent) and agent in self.thresholds
+
+    def lookup(self, agent: str, namespace: str, text: str) -> Optional[Tuple[str, float]]:
+        """Cache key and similarity of the closest earlier prompt above the agent's threshold."""
+        started = time.perf_counter()
+        index = self.indexes.get(namespace)
+        match = None
+        if index is not None:
+            score, position = index.search(embed(text, self.dim))
+            if score >= self.thresholds[agent]:
+                match = (index.keys[position], score)
+
+        elapsed = time.perf_counter() - started
+        self.lookup_seconds += elapsed
+        SEMANTIC_CACHE_LOOKUP_SECONDS.labels(agent).observe(elapsed)
+        return match
+
+    def record(self, agent: str, hit: bool):
+        """Count a lookup outcome (a match whose response expired is a miss)."""
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        SEMANTIC_CACHE_LOOKUPS.labels(agent, "hit" if hit else "miss").inc()
+
+    def add(self, namespace: str, text: str, cache_key: str):
+        index = self.indexes.setdefault(namespace, IVFIndex(self.dim))
+        index.add(embed(text, self.dim), cache_key, time.time())
+        if len(index) > self.max_entries:
+            index.keep_newest(int(self.max_entries * 0.9))
+        self._train_soon(namespace, index)
+        self.dirty = True
+
+    def _train_soon(self, namespace: str, index: IVFIndex):
+        """Refit a namespace's clusters in a worker thread if it needs it."""
+        if not index.needs_training() or namespace in self._training:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop to keep responsive (e.g. a script)
+            index.train()
+            return
+        self._training[namespace] = loop.create_task(self._train(namespace, index))
+
+    async def _train(self, namespace: str, index: IVFIndex):
+        try:
+            dropped = index.dropped
+            fitted = await asyncio.to_thread(index.fit, index.vectors)
+            if fitted is None:
+                return
+            mean, centroids, assignment = fitted
+
+            # Assign what was added during the fit in the thread too, so
+            # install() only has the few vectors added after this
+            start = dropped + len(assignment) - index.dropped
+            if start < 0:
+                # Everything the fit saw has been trimmed since
+                assignment, dropped, start = assignment[:0], index.dropped, 0
+            added = await asyncio.to_thread(index.assign, index.vectors[start:], mean, centroids)
+
+            if self.indexes.get(namespace) is index:
+                index.install(mean, centroids, np.concatenate([assignment, added]), dropped)
+        except Exception as e:
+            logger.warning(f"Semantic cache training failed for {namespace}: {e}")
+        finally:
+            del self._training[namespace]
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": {ns: len(index) for ns, index in self.indexes.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "avg_lookup_ms": round(self.lookup_seconds / lookups * 1000, 3) if lookups else None,
+            "thresholds": self.thresholds,
+        }
+
+    def snapshot(self) -> Dict[str, np.ndarray]:
+        """Copy every namespace into arrays that can be written off the event loop."""
+        arrays = {"namespaces": np.array(list(self.indexes), dtype=str)}
+        for i, index in enumerate(self.indexes.values()):
+            arrays[f"vectors_{i}"] = index.vectors.astype(np.float16)
+            arrays[f"keys_{i}"] = np.array(index.keys, dtype=str)
+            arrays[f"created_{i}"] = np.array(index.created, dtype=np.float64)
+        self.dirty = False
+        return arrays
+
+    def write(self, arrays: Dict[str, np.ndarray]):
+        """Write a snapshot to the .npz file, atomically."""
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.path)
+        logger.info(f"Saved semantic cache ({sum(len(i) for i in self.indexes.values())} entries)")
+
+    def save(self):
+        self.write(self.snapshot())
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with np.load(self.path) as data:
+            for i, namespace in enumerate(data["namespaces"].tolist()):
+                vectors = data[f"vectors_{i}"]
+                if vectors.shape[1] != self.dim:
+                    logger.warning(f"Skipping semantic cache namespace {namespace}: dimension changed")
+                    continue
+                index = IVFIndex(self.dim)
+                for vector, key, created in zip(
+                    vectors.astype(np.float32), data[f"keys_{i}"].tolist(), data[f"created_{i}"]
+                ):
+                    index.add(vector, key, float(created))
+                self.indexes[namespace] = index
+                self._train_soon(namespace, index)
+        logger.info(f"Loaded semantic cache ({sum(len(i) for i in self.indexes.values())} entries)")
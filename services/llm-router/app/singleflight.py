@@ -0,0 +1,305 @@
+"""Single-flight coalescing of identical in-flight generations.
+
+Concurrent requests with the same cache key share one generation. Within
+a process the first caller starts it as a task of its own and every caller
+awaits that task, so a cancelled caller (e.g. a client that disconnected)
+doesn't fail the others. Across router replicas the leader also holds a
+short Redis lock; a replica that finds the lock taken subscribes to the
+key's channel, waits for the leader to publish, and then reads the result
+from the cache. If nothing shows up (the leader failed or timed out) it
+generates itself. All waits on a replica share one pub/sub connection.
+
+Usage (self-check):
+    python -m app.singleflight [--callers 50] [--keys 1] [--replicas 3] [--redis-url redis://localhost:6379/0]
+"""
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from app.metrics import SINGLEFLIGHT_COALESCED
+
+logger = logging.getLogger(__name__)
+
+# Delete the lock only if we still own it
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class _Subscriber:
+    """One pub/sub connection shared by every wait on a replica.
+
+    A channel is subscribed while someone waits on it, and a message on it
+    sets its waiters' events.
+    """
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._waiters: Dict[str, Set[asyncio.Event]] = {}
+
+    async def subscribe(self, channel: str) -> asyncio.Event:
+        event = asyncio.Event()
+        waiters = self._waiters.get(channel)
+        if waiters is not None:
+            waiters.add(event)
+            return event
+
+        self._waiters[channel] = {event}
+        try:
+            if self._pubsub is None:
+                self._pubsub = self.redis.pubsub()
+            await self._pubsub.subscribe(channel)
+        except BaseException:
+            await self.unsubscribe(channel, event)
+            raise
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.ensure_future(self._listen())
+        return event
+
+    async def unsubscribe(self, channel: str, event: asyncio.Event):
+        waiters = self._waiters.get(channel)
+        if waiters is None:
+            return
+        waiters.discard(event)
+        if waiters:
+            return
+        del self._waiters[channel]
+        try:
+            await self._pubsub.unsubscribe(channel)
+        except Exception as e:
+            logger.warning(f"Single-flight unsubscribe failed: {e}")
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Waiters fall back to polling the lock meanwhile
+                logger.warning(f"Single-flight subscriber failed: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if message and message["type"] == "message":
+                channel = message["channel"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                for event in self._waiters.get(channel, ()):
+                    event.set()
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except BaseException:
+                pass
+        if self._pubsub is not None:
+            await self._pubsub.close()
+
+
+class SingleFlight:
+    """Runs at most one generation per key at a time."""
+
+    def __init__(self, redis_client=None, lock_ms: int = 120000, wait_seconds: float = 120.0):
+        self.redis = redis_client
+        self.lock_ms = lock_ms
+        self.wait_seconds = wait_seconds
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._subscriber = _Subscriber(redis_client) if redis_client else None
+
+    async def do(
+        self,
+        key: str,
+        produce: Callable[[], Awaitable[Dict[str, Any]]],
+        read_cache: Callable[[], Awaitable[Optional[Dict[str, Any]]]],
+    ) -> Dict[str, Any]:
+        """Return `produce()`'s result, sharing it with concurrent callers of `key`.
+
+        `produce` must write its result to the cache before returning so
+        waiters on other replicas can read it.
+        """
+        inflight = self._inflight.get(key)
+        if inflight:
+            SINGLEFLIGHT_COALESCED.labels("local").inc()
+            return dict(await asyncio.shield(inflight))
+
+        # Everyone, the first caller included, awaits the task through a
+        # shield, so cancelling one caller leaves the generation running
+        task = asyncio.ensure_future(self._lead(key, produce, read_cache))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._finished(key, done))
+        return dict(await asyncio.shield(task))
+
+    def _finished(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # Don't warn when every caller had gone
+
+    async def close(self):
+        if self._subscriber:
+            await self._subscriber.close()
+
+    async def _lead(self, key, produce, read_cache) -> Dict[str, Any]:
+        if not self.redis:
+            return await produce()
+
+        lock_key = f"{key}:lock"
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self.redis.set(lock_key, token, nx=True, px=self.lock_ms)
+        except Exception as e:
+            logger.warning(f"Single-flight lock failed, generating anyway: {e}")
+            return await produce()
+
+        if acquired:
+            try:
+                # A leader elsewhere may have finished just before we locked
+                result = await read_cache()
+                if result is not None:
+                    return result
+                return await produce()
+            finally:
+                try:
+                    await self.redis.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+                    await self.redis.publish(f"{key}:done", token)
+                except Exception as e:
+                    logger.warning(f"Single-flight release failed: {e}")
+
+        SINGLEFLIGHT_COALESCED.labels("remote").inc()
+        result = await self._wait_remote(key, read_cache)
+        if result is not None:
+            return result
+        logger.warning("Single-flight leader produced nothing, generating locally")
+        return await produce()
+
+    async def _wait_remote(self, key, read_cache) -> Optional[Dict[str, Any]]:
+        """Wait for another replica's leader to finish, then read its cached result."""
+        channel = f"{key}:done"
+        done = await self._subscriber.subscribe(channel)
+        try:
+            # The leader may have finished before we subscribed
+            result = await read_cache()
+            if result is not None:
+                return result
+
+            deadline = time.monotonic() + self.wait_seconds
+            while time.monotonic() < deadline:
+                try:
+                    await asyncio.wait_for(done.wait(), timeout=min(1.0, deadline - time.monotonic()))
+                    break
+                except asyncio.TimeoutError:
+                    pass
+                # Lock gone without a message (expired or missed): stop waiting
+                if not await self.redis.exists(f"{key}:lock"):
+                    break
+        finally:
+            await self._subscriber.unsubscribe(channel, done)
+
+        return await read_cache()
+
+
+async def _self_check(callers: int, keys: int, replicas: int, redis_url: Optional[str]) -> Tuple[int, int, int]:
+    """Fire `callers` identical requests per key spread over replicas.
+
+    The first caller of each key is cancelled mid-generation. Returns
+    (generations run, other callers without a result, pub/sub connections opened).
+    """
+    import json
+
+    clients = []
+    if redis_url:
+        import redis.asyncio as aioredis
+        clients = [aioredis.from_url(redis_url) for _ in range(replicas)]
+
+    pubsubs = 0
+    for client in clients:
+        def pubsub(open_pubsub=client.pubsub, **kwargs):
+            nonlocal pubsubs
+            pubsubs += 1
+            return open_pubsub(**kwargs)
+        client.pubsub = pubsub
+
+    store: Dict[str, str] = {}
+    prefix = f"llm_cache:selfcheck:{uuid.uuid4().hex}"
+    generations = 0
+
+    def producer(key, client):
+        async def produce():
+            nonlocal generations
+            generations += 1
+            await asyncio.sleep(0.5)
+            result = {"success": True, "text": "generated once"}
+            store[key] = json.dumps(result)
+            if client:
+                await client.set(key, store[key], ex=60)
+            return result
+        return produce
+
+    def reader(key, client):
+        async def read_cache():
+            raw = await client.get(key) if client else store.get(key)
+            return json.loads(raw) if raw else None
+        return read_cache
+
+    flights = [SingleFlight(clients[i] if clients else None) for i in range(replicas)]
+    calls = []
+    for k in range(keys):
+        key = f"{prefix}:{k}"
+        for i in range(callers):
+            client = clients[i % replicas] if clients else None
+            calls.append(asyncio.ensure_future(
+                flights[i % replicas].do(key, producer(key, client), reader(key, client))
+            ))
+
+    await asyncio.sleep(0.1)
+    for k in range(keys):
+        calls[k * callers].cancel()
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    failed = sum(
+        1 for i, result in enumerate(results)
+        if i % callers and not (isinstance(result, dict) and result.get("success"))
+    )
+
+    for flight in flights:
+        await flight.close()
+    for client in clients:
+        await client.delete(*(f"{prefix}:{k}" for k in range(keys)))
+        await client.close()
+    return generations, failed, pubsubs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that identical concurrent calls generate once")
+    parser.add_argument("--callers", type=int, default=50, help="Concurrent calls per key")
+    parser.add_argument("--keys", type=int, default=1, help="Distinct keys in flight at once")
+    parser.add_argument("--replicas", type=int, default=1, help="Simulated routers (needs --redis-url if > 1)")
+    parser.add_argument("--redis-url")
+    args = parser.parse_args()
+
+    if args.replicas > 1 and not args.redis_url:
+        parser.error("--replicas > 1 needs --redis-url")
+
+    generations, failed, pubsubs = asyncio.run(
+        _self_check(args.callers, args.keys, args.replicas, args.redis_url)
+    )
+    print(
+        f"{args.callers} concurrent calls x {args.keys} key(s) over {args.replicas} replica(s), "
+        f"first caller per key cancelled: {generations} generation(s), {failed} caller(s) without a result, "
+        f"{pubsubs} pub/sub connection(s)"
+    )
+    ok = generations == args.keys and failed == 0 and pubsubs <= args.replicas
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
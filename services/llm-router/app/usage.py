@@ -0,0 +1,102 @@
+"""Per-tenant LLM usage ledger in Redis.
+
+Every generation adds its exact prompt/completion token counts and cost to
+in-process counters. A background task adds them to Redis in bulk, as one
+pipeline of HINCRBY calls, so the request path never waits on Redis. The
+counters are kept in two kinds of hashes:
+
+    llm_usage:tenant:{tenant_id}:{YYYY-MM-DD}   daily totals per tenant
+    llm_usage:run:{run_id}                      totals for one agent run
+
+Both have the fields requests, prompt_tokens, completion_tokens and
+cost_micros (USD * 1e6, so the counters stay integers). Generations whose
+provider reported no usage add to requests and unaccounted_requests only,
+so totals are known to be short by that many generations rather than
+silently low. The API reads the run hashes into AgentRun.tokens_used / cost.
+
+Prices come from LLM_PRICING as "model:prompt_usd_per_1k:completion_usd_per_1k"
+entries; models without a price (e.g. the local one) cost nothing.
+"""
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from app.metrics import USAGE_TOKENS, USAGE_UNACCOUNTED
+
+logger = logging.getLogger(__name__)
+
+RUN_KEY_TTL_SECONDS = 7 * 24 * 3600
+
+
+def parse_pricing(spec: str) -> Dict[str, Tuple[float, float]]:
+    """Parse "model:prompt_per_1k:completion_per_1k" entries into a dict."""
+    pricing = {}
+    for entry in spec.split(","):
+        parts = entry.strip().rsplit(":", 2)
+        if len(parts) == 3:
+            pricing[parts[0]] = (float(parts[1]), float(parts[2]))
+    return pricing
+
+
+class UsageLedger:
+    """Buffers usage counters and flushes them to Redis in bulk."""
+
+    def __init__(self, redis_client, pricing: Dict[str, Tuple[float, float]], retention_days: int = 400):
+        self.redis = redis_client
+        self.pricing = pricing
+        self.retention_seconds = retention_days * 24 * 3600
+        self._pending: Dict[str, Counter] = defaultdict(Counter)
+
+    def cost_micros(self, model: str, prompt_tokens: int, completion_tokens: int) -> int:
+        prompt_price, completion_price = self.pricing.get(model, (0.0, 0.0))
+        return round((prompt_tokens * prompt_price + completion_tokens * completion_price) * 1000)
+
+    def record(
+        self,
+        tenant_id: Optional[int],
+        run_id: Optional[int],
+        response: Dict,
+    ):
+        """Count a generated (not cached) response against its tenant and run."""
+        usage = response.get("usage")
+        if usage:
+            prompt_tokens = usage["prompt_tokens"]
+            completion_tokens = usage["completion_tokens"]
+            USAGE_TOKENS.labels(response["provider"], "prompt").inc(prompt_tokens)
+            USAGE_TOKENS.labels(response["provider"], "completion").inc(completion_tokens)
+            counts = {
+                "requests": 1,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "cost_micros": self.cost_micros(response.get("model", ""), prompt_tokens, completion_tokens),
+            }
+        else:
+            USAGE_UNACCOUNTED.labels(response["provider"]).inc()
+            counts = {"requests": 1, "unaccounted_requests": 1}
+
+        if tenant_id is not None:
+            day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+            self._pending[f"llm_usage:tenant:{tenant_id}:{day}"].update(counts)
+        if run_id is not None:
+            self._pending[f"llm_usage:run:{run_id}"].update(counts)
+
+    async def flush(self) -> int:
+        """Write buffered counters to Redis; returns the number of hashes updated."""
+        if not self._pending or not self.redis:
+            return 0
+        pending, self._pending = self._pending, defaultdict(Counter)
+
+        pipe = self.redis.pipeline(transaction=False)
+        for key, counts in pending.items():
+            for field, value in counts.items():
+                pipe.hincrby(key, field, value)
+            pipe.expire(key, RUN_KEY_TTL_SECONDS if key.startswith("llm_usage:run:") else self.retention_seconds)
+        try:
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Usage flush failed, retrying next time: {e}")
+            for key, counts in pending.items():
+                self._pending[key].update(counts)
+            return 0
+        return len(pending)
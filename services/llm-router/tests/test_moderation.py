@@ -0,0 +1,21 @@
+from app.moderation import EngineCache, ModerationEngine
+
+
+def test_whole_words_only():
+    engine = ModerationEngine({"hate": ["hate"], "claims": ["get rich quick"]})
+    verdict = engine.check("Whatever you HATE, get   rich quick!")
+    assert verdict["flagged"]
+    assert verdict["categories"] == {"hate": True, "claims": True}
+    assert verdict["matches"] == [{"category": "hate", "term": "hate"}, {"category": "claims", "term": "get rich quick"}]
+    assert not engine.check("whatever")["flagged"]
+
+
+def test_engine_cache_compiles_each_term_list_once():
+    engines = EngineCache(max_entries=2)
+    first = engines.get({"a": ["x", "y"]})
+    assert engines.get({"a": ["x", "y"]}) is first
+    engines.get({"b": ["z"]})
+    engines.get({"c": ["w"]})
+    # The least recently used list was dropped and is compiled again
+    assert engines.get({"a": ["x", "y"]}) is not first
+    assert engines.get({"a": ["x", "y"]}).check("x marks")["matches"] == [{"category": "a", "term": "x"}]
@@ -0,0 +1,169 @@
+import asyncio
+import json
+
+import fakeredis
+import fakeredis.aioredis
+
+from app.singleflight import SingleFlight
+
+RESULT = {"success": True, "text": "generated once"}
+
+
+class Backend:
+    """Counts generations and stores their results where readers look."""
+
+    def __init__(self, client=None, delay=0.2):
+        self.client = client
+        self.delay = delay
+        self.generations = 0
+        self.store = {}
+
+    def producer(self, key, client=None):
+        client = client or self.client
+
+        async def produce():
+            self.generations += 1
+            await asyncio.sleep(self.delay)
+            self.store[key] = json.dumps(RESULT)
+            if client:
+                await client.set(key, self.store[key], ex=60)
+            return dict(RESULT)
+        return produce
+
+    def reader(self, key, client=None):
+        client = client or self.client
+
+        async def read_cache():
+            raw = await client.get(key) if client else self.store.get(key)
+            return json.loads(raw) if raw else None
+        return read_cache
+
+
+def test_concurrent_identical_calls_generate_once():
+    async def run():
+        flight = SingleFlight()
+        backend = Backend()
+        results = await asyncio.gather(*(
+            flight.do("k", backend.producer("k"), backend.reader("k")) for _ in range(20)
+        ))
+        await flight.close()
+        return backend.generations, results
+
+    generations, results = asyncio.run(run())
+    assert generations == 1
+    assert results == [RESULT] * 20
+
+
+def test_each_key_generates_once():
+    async def run():
+        flight = SingleFlight()
+        backend = Backend()
+        await asyncio.gather(*(
+            flight.do(f"k{i % 3}", backend.producer(f"k{i % 3}"), backend.reader(f"k{i % 3}")) for i in range(15)
+        ))
+        return backend.generations
+
+    assert asyncio.run(run()) == 3
+
+
+def test_callers_get_their_own_copy():
+    async def run():
+        flight = SingleFlight()
+        backend = Backend()
+        first, second = await asyncio.gather(*(
+            flight.do("k", backend.producer("k"), backend.reader("k")) for _ in range(2)
+        ))
+        first["cached"] = True
+        return second
+
+    assert "cached" not in asyncio.run(run())
+
+
+def test_cancelling_the_first_caller_does_not_fail_the_others():
+    async def run():
+        flight = SingleFlight()
+        backend = Backend()
+        calls = [
+            asyncio.ensure_future(flight.do("k", backend.producer("k"), backend.reader("k")))
+            for _ in range(5)
+        ]
+        await asyncio.sleep(0.05)
+        calls[0].cancel()
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        return backend.generations, results
+
+    generations, results = asyncio.run(run())
+    assert generations == 1
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert results[1:] == [RESULT] * 4
+
+
+def test_failed_generation_reaches_every_caller_and_is_not_kept():
+    async def run():
+        flight = SingleFlight()
+        attempts = 0
+
+        async def produce():
+            nonlocal attempts
+            attempts += 1
+            await asyncio.sleep(0.05)
+            raise RuntimeError("provider down")
+
+        async def read_cache():
+            return None
+
+        results = await asyncio.gather(*(flight.do("k", produce, read_cache) for _ in range(3)), return_exceptions=True)
+        backend = Backend()
+        retried = await flight.do("k", backend.producer("k"), backend.reader("k"))
+        return attempts, results, retried
+
+    attempts, results, retried = asyncio.run(run())
+    assert attempts == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert retried == RESULT
+
+
+def test_replicas_share_one_generation_through_redis():
+    async def run():
+        server = fakeredis.FakeServer()
+        clients = [fakeredis.aioredis.FakeRedis(server=server) for _ in range(3)]
+        flights = [SingleFlight(client, wait_seconds=5) for client in clients]
+        backend = Backend(delay=0.3)
+        key = "llm_cache:test"
+
+        calls = [
+            asyncio.ensure_future(flights[i % 3].do(key, backend.producer(key, clients[i % 3]), backend.reader(key, clients[i % 3])))
+            for i in range(12)
+        ]
+        await asyncio.sleep(0.1)
+        calls[0].cancel()
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        lock_left = await clients[0].exists(f"{key}:lock")
+
+        for flight in flights:
+            await flight.close()
+        return backend.generations, results, lock_left
+
+    generations, results, lock_left = asyncio.run(run())
+    assert generations == 1
+    assert results[1:] == [RESULT] * 11
+    assert not lock_left
+
+
+def test_waiter_generates_itself_when_the_remote_leader_vanishes():
+    async def run():
+        server = fakeredis.FakeServer()
+        client = fakeredis.aioredis.FakeRedis(server=server)
+        key = "llm_cache:orphan"
+        # A lock held by a leader that died without publishing, expiring soon
+        await client.set(f"{key}:lock", "gone", px=300)
+
+        flight = SingleFlight(client, wait_seconds=5)
+        backend = Backend(client, delay=0)
+        result = await flight.do(key, backend.producer(key), backend.reader(key))
+        await flight.close()
+        return backend.generations, result
+
+    generations, result = asyncio.run(run())
+    assert generations == 1
+    assert result == RESULT
@@ -7,6 +7,26 @@ import os
 logger = logging.getLogger(__name__)
 
 LLM_ROUTER_URL = os.getenv("LOCAL_LLM_URL", "http://llmrouter:9090")
+ANALYTICS_URL = os.getenv("ANALYTICS_URL", "http://analytics:8086")
+
+
+def fetch_anomalies(tenant_id) -> list:
+    """Ranked anomalies of the last 24 hours from the analytics service, or [] if unavailable."""
+    try:
+        response = httpx.get(
+            f"{ANALYTICS_URL}/anomalies",
+            params={"tenant_id": str(tenant_id), "limit": 10},
+            timeout=30.0,
+        )
+        response.raise_for_status()
+        body = response.json()
+    except Exception as e:
+        logger.warning(f"Anomaly lookup failed: {e}")
+        return []
+    if "error" in body:
+        logger.warning(f"Anomaly lookup failed: {body['error']}")
+        return []
+    return body.get("anomalies", [])
 
 
 def run(context: dict, provider: str = "local") -> dict:
@@ -18,6 +38,8 @@ def run(context: dict, provider: str = "local") -> dict:
             - metrics: Campaign metrics data
             - time_period: Time period for analysis
             - campaigns: List of campaign summaries
+            - anomalies: Ranked anomalies; fetched from the analytics
+              /anomalies endpoint for tenant_id when not given
         provider: LLM provider to use
 
     Returns:
@@ -28,6 +50,9 @@ def run(context: dict, provider: str = "local") -> dict:
     metrics = context.get("metrics", {})
     time_period = context.get("time_period", "last 7 days")
     campaigns = context.get("campaigns", [])
+    anomalies = context.get("anomalies")
+    if anomalies is None:
+        anomalies = fetch_anomalies(context["tenant_id"]) if context.get("tenant_id") is not None else []
 
     # Build summary of metrics
     spend = metrics.get("spend", 0)
@@ -56,12 +81,21 @@ CPA: ${cpa:.2f}
 ROAS: {roas:.2f}x
 """
 
+    # Give the LLM detected anomalies instead of leaving it to guess
+    anomalies_summary = "\n".join(
+        f"- {a['campaign']} {a['metric']} at {a['hour']}: {a['value']:,.2f} "
+        f"vs expected {a['expected']:,.2f} ({a['direction']}, z={a['z_score']})"
+        for a in anomalies[:10]
+    ) or "None detected"
+
     system_prompt = f"""You are a senior marketing analyst. Analyze the campaign performance data and provide insights and recommendations.
 
 Time Period: {time_period}
 
 Performance Metrics:
 {metrics_summary}
+Detected Anomalies (last 24 hours):
+{anomalies_summary}
 
 Provide your analysis in this structure:
 1. Performance Overview (2-3 sentences)
@@ -81,6 +115,9 @@ Keep your response concise and focused on actionable insights.
                 "prompt": user_prompt,
                 "system_prompt": system_prompt,
                 "provider": provider,
+                "agent": "AnalystAgent",
+                "tenant_id": context.get("tenant_id"),
+                "run_id": context.get("run_id"),
                 "max_tokens": 1000,
                 "temperature": 0.7,
             },
@@ -67,6 +67,9 @@ Return your response as a JSON array with this structure:
                 "prompt": user_prompt,
                 "system_prompt": system_prompt,
                 "provider": provider,
+                "agent": "CreativeAgent",
+                "tenant_id": context.get("tenant_id"),
+                "run_id": context.get("run_id"),
                 "max_tokens": 1500,
                 "temperature": 0.8,
             },
@@ -62,6 +62,9 @@ Return a JSON plan:
                 "prompt": user_prompt,
                 "system_prompt": system_prompt,
                 "provider": provider,
+                "agent": "ChannelPlanner",
+                "tenant_id": context.get("tenant_id"),
+                "run_id": context.get("run_id"),
                 "max_tokens": 1000,
             },
             timeout=60.0,
@@ -62,8 +62,21 @@ async def call_llm(
 
 
 @celery.task(bind=True, max_retries=3, default_retry_delay=60)
-def run_agent(self, agent_name: str, context: dict, run_id: int, provider: str = "local"):
-    """Execute an agent with the given context."""
+def run_agent(self, agent_name: str, context: dict, run_id: int, provider: str = "local", *, tenant_id: int):
+    """Execute an agent with the given context.
+
+    The tenant and run ids are passed on to the LLM router, which records
+    token usage against them, so both are required: e.g.
+    run_agent.delay("CreativeAgent", context, run.id, "openai", tenant_id=run.tenant_id).
+    """
+    if tenant_id is None or run_id is None:
+        # Usage would land in the ledger without its tenant or run; don't retry
+        logger.error(f"Agent {agent_name} enqueued without tenant_id/run_id ({tenant_id}, {run_id})")
+        return {
+            "success": False,
+            "error": "tenant_id and run_id are required",
+        }
+
     logger.info(f"Running agent {agent_name} for run_id {run_id}")
 
     # Import agents dynamically
@@ -88,7 +101,7 @@ def run_agent(self, agent_name: str, context: dict, run_id: int, provider: str =
     try:
         # Execute the agent
         agent_func = agent_registry[agent_name]
-        result = agent_func(context, provider=provider)
+        result = agent_func({**context, "tenant_id": tenant_id, "run_id": run_id}, provider=provider)
 
         logger.info(f"Agent {agent_name} completed successfully")
         return result
@@ -0,0 +1,5 @@
+"""Code shared by the Autonomous Marketeer services.
+
+Installed into each service image that uses it (see the `shared` build
+context in docker-compose.yml), so there is one copy to fix.
+"""
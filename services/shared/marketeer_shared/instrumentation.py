@@ -0,0 +1,289 @@
+"""ClickHouse query instrumentation and Prometheus metrics.
+
+Every query and insert goes through `InstrumentedClient`, which records
+latency, rows/bytes read from the ClickHouse query summary and errors,
+labeled by the calling endpoint and the tenant's tier. Queries slower than
+`CLICKHOUSE_SLOW_QUERY_MS` are logged with their normalized SQL and
+aggregated so hot queries can be found.
+"""
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("CLICKHOUSE_SLOW_QUERY_MS", "1000"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("CLICKHOUSE_SLOW_QUERY_LOG_SIZE", "200"))
+
+# Tenant tiers as "tenant:tier" pairs, e.g. "t1:enterprise,t2:starter"
+TENANT_TIERS = dict(
+    pair.split(":", 1)
+    for pair in os.getenv("TENANT_TIERS", "").split(",")
+    if ":" in pair
+)
+DEFAULT_TENANT_TIER = os.getenv("DEFAULT_TENANT_TIER", "free")
+
+current_endpoint = contextvars.ContextVar("current_endpoint", default="unknown")
+current_tenant_tier = contextvars.ContextVar("current_tenant_tier", default=DEFAULT_TENANT_TIER)
+
+QUERY_LATENCY = Histogram(
+    "clickhouse_query_duration_seconds",
+    "ClickHouse query latency",
+    ["endpoint", "tenant_tier", "operation"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+QUERY_ERRORS = Counter(
+    "clickhouse_query_errors_total",
+    "ClickHouse queries that raised",
+    ["endpoint", "tenant_tier", "operation"],
+)
+READ_ROWS = Counter(
+    "clickhouse_read_rows_total",
+    "Rows read by ClickHouse queries",
+    ["endpoint", "tenant_tier"],
+)
+READ_BYTES = Counter(
+    "clickhouse_read_bytes_total",
+    "Bytes read by ClickHouse queries",
+    ["endpoint", "tenant_tier"],
+)
+WRITTEN_ROWS = Counter(
+    "clickhouse_written_rows_total",
+    "Rows written by ClickHouse inserts",
+    ["endpoint", "tenant_tier"],
+)
+
+_LITERALS = re.compile(r"'(?:[^'\\]|\\.)*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+_slow_lock = threading.Lock()
+_slow_queries: Dict[str, Dict[str, Any]] = {}
+
+
+def tier_for(tenant_id: Optional[str]) -> str:
+    """Get the configured tier for a tenant."""
+    return TENANT_TIERS.get(tenant_id or "", DEFAULT_TENANT_TIER)
+
+
+def set_tenant(tenant_id: Optional[str]):
+    """Label subsequent queries in this context with the tenant's tier."""
+    current_tenant_tier.set(tier_for(tenant_id))
+
+
+def normalize_sql(query: str) -> str:
+    """Collapse whitespace and replace literals so similar queries group together."""
+    return _WHITESPACE.sub(" ", _LITERALS.sub("?", query)).strip()
+
+
+def slow_queries(limit: int = 20) -> List[Dict[str, Any]]:
+    """Get the slow queries seen so far, by total time spent."""
+    with _slow_lock:
+        entries = [dict(sql=sql, **stats) for sql, stats in _slow_queries.items()]
+    entries.sort(key=lambda e: e["total_ms"], reverse=True)
+    return entries[:limit]
+
+
+def _record_slow(query: str, elapsed_ms: float, endpoint: str, summary: Dict[str, Any]):
+    """Log a slow query and fold it into the slow-query aggregate."""
+    sql = normalize_sql(query)
+    logger.warning(
+        f"Slow ClickHouse query ({elapsed_ms:.0f} ms, endpoint={endpoint}, "
+        f"read_rows={summary.get('read_rows', 0)}): {sql}"
+    )
+    with _slow_lock:
+        stats = _slow_queries.get(sql)
+        if stats is None:
+            if len(_slow_queries) >= SLOW_QUERY_LOG_SIZE:
+                # Evict the entry that has cost the least so far
+                coldest = min(_slow_queries, key=lambda k: _slow_queries[k]["total_ms"])
+                del _slow_queries[coldest]
+            stats = _slow_queries[sql] = {
+                "count": 0, "total_ms": 0.0, "max_ms": 0.0, "endpoint": endpoint,
+            }
+        stats["count"] += 1
+        stats["total_ms"] = round(stats["total_ms"] + elapsed_ms, 2)
+        stats["max_ms"] = round(max(stats["max_ms"], elapsed_ms), 2)
+
+
+class InstrumentedClient:
+    """ClickHouse client wrapper that records metrics for every call."""
+
+    def __init__(self, client):
+        """Wrap a clickhouse_connect client."""
+        self.client = client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _observe(self, operation: str, query: str, started: float, summary: Optional[Dict[str, Any]]):
+        """Record latency, summary counters and slow-query entries."""
+        endpoint = current_endpoint.get()
+        tier = current_tenant_tier.get()
+        elapsed = time.perf_counter() - started
+        summary = summary or {}
+
+        QUERY_LATENCY.labels(endpoint, tier, operation).observe(elapsed)
+        READ_ROWS.labels(endpoint, tier).inc(int(summary.get("read_rows", 0) or 0))
+        READ_BYTES.labels(endpoint, tier).inc(int(summary.get("read_bytes", 0) or 0))
+        WRITTEN_ROWS.labels(endpoint, tier).inc(int(summary.get("written_rows", 0) or 0))
+
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            _record_slow(query, elapsed * 1000, endpoint, summary)
+
+    def _error(self, operation: str):
+        QUERY_ERRORS.labels(current_endpoint.get(), current_tenant_tier.get(), operation).inc()
+
+    def query(self, query: str, *args, **kwargs):
+        """Run a query and record its metrics."""
+        started = time.perf_counter()
+        try:
+            result = self.client.query(query, *args, **kwargs)
+        except Exception:
+            self._error("query")
+            raise
+        self._observe("query", query, started, getattr(result, "summary", None))
+        return result
+
+    def _context_query(self, operation: str, attribute: str, query: str, parameters, settings, **context_args):
+        """Run a query through a query context, record its metrics and return `attribute` of the result.
+
+        Streams are recorded when they open, with the summary ClickHouse has
+        sent by then.
+        """
+        context = self.client.create_query_context(
+            query=query,
+            parameters=parameters,
+            settings=settings,
+            **context_args,
+        )
+        started = time.perf_counter()
+        try:
+            result = self.client.query(context=context)
+        except Exception:
+            self._error(operation)
+            raise
+        self._observe(operation, query, started, getattr(result, "summary", None))
+        return getattr(result, attribute)
+
+    def _timed(self, operation: str, method: str, query: str, *args, **kwargs):
+        """Call a client method that returns no summary, recording its latency."""
+        started = time.perf_counter()
+        try:
+            result = getattr(self.client, method)(query, *args, **kwargs)
+        except Exception:
+            self._error(operation)
+            raise
+        self._observe(operation, query, started, None)
+        return result
+
+    def query_df(self, query: str, parameters=None, settings=None, **kwargs):
+        """Run a query returning a DataFrame and record its metrics."""
+        return self._context_query(
+            "query", "df_result", query, parameters, settings, use_numpy=True, as_pandas=True, **kwargs
+        )
+
+    def query_np(self, query: str, parameters=None, settings=None, **kwargs):
+        """Run a query returning a NumPy array and record its metrics."""
+        return self._context_query("query", "np_result", query, parameters, settings, use_numpy=True, **kwargs)
+
+    def query_row_block_stream(self, query: str, parameters=None, settings=None, **kwargs):
+        """Open a stream of row blocks and record its metrics."""
+        return self._context_query(
+            "stream", "row_block_stream", query, parameters, settings, streaming=True, **kwargs
+        )
+
+    def query_rows_stream(self, query: str, parameters=None, settings=None, **kwargs):
+        """Open a stream of rows and record its metrics."""
+        return self._context_query("stream", "rows_stream", query, parameters, settings, streaming=True, **kwargs)
+
+    def query_column_block_stream(self, query: str, parameters=None, settings=None, **kwargs):
+        """Open a stream of column blocks and record its metrics."""
+        return self._context_query(
+            "stream", "column_block_stream", query, parameters, settings, streaming=True, **kwargs
+        )
+
+    def query_np_stream(self, query: str, parameters=None, settings=None, **kwargs):
+        """Open a stream of NumPy blocks and record its metrics."""
+        return self._context_query(
+            "stream", "np_stream", query, parameters, settings, use_numpy=True, streaming=True, **kwargs
+        )
+
+    def query_df_stream(self, query: str, parameters=None, settings=None, **kwargs):
+        """Open a stream of DataFrame blocks and record its metrics."""
+        return self._context_query(
+            "stream", "df_stream", query, parameters, settings,
+            use_numpy=True, as_pandas=True, streaming=True, **kwargs
+        )
+
+    def query_arrow(self, query: str, *args, **kwargs):
+        """Run a query returning an Arrow table, recording its latency."""
+        return self._timed("query", "query_arrow", query, *args, **kwargs)
+
+    def query_arrow_stream(self, query: str, *args, **kwargs):
+        """Open a stream of Arrow batches, recording the time to first byte."""
+        return self._timed("stream", "query_arrow_stream", query, *args, **kwargs)
+
+    def raw_query(self, query: str, *args, **kwargs):
+        """Run a query returning raw bytes, recording its latency."""
+        return self._timed("query", "raw_query", query, *args, **kwargs)
+
+    def raw_stream(self, query: str, *args, **kwargs):
+        """Open a raw result stream, recording the time to first byte."""
+        return self._timed("stream", "raw_stream", query, *args, **kwargs)
+
+    def insert(self, table: str, *args, **kwargs):
+        """Insert rows and record the write metrics."""
+        started = time.perf_counter()
+        try:
+            result = self.client.insert(table, *args, **kwargs)
+        except Exception:
+            self._error("insert")
+            raise
+        self._observe("insert", f"INSERT INTO {table}", started, getattr(result, "summary", None))
+        return result
+
+    def command(self, cmd: str, *args, **kwargs):
+        """Run a command and record its latency."""
+        started = time.perf_counter()
+        try:
+            result = self.client.command(cmd, *args, **kwargs)
+        except Exception:
+            self._error("command")
+            raise
+        self._observe("command", cmd, started, getattr(result, "summary", None))
+        return result
+
+
+def instrument_app(app):
+    """Label ClickHouse calls with the matched route and tenant, and serve /metrics."""
+    from fastapi import Response
+    from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+    from starlette.routing import Match
+
+    @app.middleware("http")
+    async def clickhouse_context(request, call_next):
+        endpoint = "unmatched"
+        for route in app.router.routes:
+            match, _ = route.matches(request.scope)
+            if match == Match.FULL:
+                endpoint = route.path
+                break
+        current_endpoint.set(endpoint)
+        set_tenant(request.query_params.get("tenant_id"))
+        return await call_next(request)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        """Prometheus metrics."""
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+    @app.get("/slow-queries")
+    async def get_slow_queries(limit: int = 20):
+        """Get the slowest normalized ClickHouse queries."""
+        return {"threshold_ms": SLOW_QUERY_MS, "queries": slow_queries(limit)}